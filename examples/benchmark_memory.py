@@ -0,0 +1,52 @@
+"""
+Measures the memory retained by parsed region files, per shape.
+
+python benchmark_memory.py [nshapes]
+"""
+
+import io
+import sys
+import gc
+import tracemalloc
+
+import pyregion
+from pyregion.shape_table import ShapeTable
+
+from benchmark_parse import make_region_string
+
+
+def retained(f):
+    """ returns the result of f() and the memory it retains """
+    gc.collect()
+    tracemalloc.start()
+    r = f()
+    gc.collect()
+    size = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    return r, size
+
+
+if __name__ == "__main__":
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 1000000
+    s = make_region_string(n)
+
+    # the grammars and the attribute caches are built on first use;
+    # build them before the measurements.
+    pyregion.parse(make_region_string(100, seed=1))
+    pyregion.parse(make_region_string(100, seed=1), attributes=False)
+
+    tests = [("ShapeList", lambda: pyregion.parse(s)),
+             ("ShapeList, attributes=False",
+              lambda: pyregion.parse(s, attributes=False)),
+             ("ShapeTable",
+              lambda: ShapeTable.from_shapelist(pyregion.iter_shapes(io.StringIO(s)))),
+             ("ShapeTable, attributes=False",
+              lambda: ShapeTable.from_shapelist(pyregion.iter_shapes(io.StringIO(s),
+                                                                     attributes=False))),
+             ]
+
+    for name, f in tests:
+        r, size = retained(f)
+        print("%-30s: %8.1f MB, %6.1f bytes/shape" % (name, size / 2.**20,
+                                                      size / float(n)))
+        del r
@@ -0,0 +1,64 @@
+"""
+Measures the cost of parsing large region files, per line.
+
+python benchmark_parse.py [nlines]
+"""
+
+import sys
+import time
+import random
+
+import pyregion
+from pyregion.ds9_region_parser import RegionParser
+
+
+def make_region_string(n, seed=0):
+    """ returns a region string of n lines of mixed shapes """
+    rnd = random.Random(seed)
+    lines = ['# Region file format: DS9 version 4.1',
+             'global color=green font="helvetica 10 normal" select=1',
+             'fk5']
+    for i in range(n):
+        ra, dec = rnd.uniform(0, 360), rnd.uniform(-90, 90)
+        k = i % 5
+        if k == 0:
+            l = 'circle(%.6f,%.6f,%.3f")' % (ra, dec, rnd.uniform(1, 10))
+        elif k == 1:
+            l = 'ellipse(%.6f,%.6f,%.3f",%.3f",%.2f) # color=red' % \
+                (ra, dec, rnd.uniform(1, 10), rnd.uniform(1, 10),
+                 rnd.uniform(0, 180))
+        elif k == 2:
+            l = 'box(%.6f,%.6f,%.3f",%.3f",%.2f)' % \
+                (ra, dec, rnd.uniform(1, 10), rnd.uniform(1, 10),
+                 rnd.uniform(0, 180))
+        elif k == 3:
+            l = 'polygon(%s)' % ",".join(["%.6f" % (ra + rnd.uniform(0, .01))
+                                          for j in range(8)])
+        else:
+            l = 'point(%.6f,%.6f) # point=x text={%d}' % (ra, dec, i)
+        lines.append(l)
+
+    return "\n".join(lines)
+
+
+def bench(f, n, repeat=1):
+    best = None
+    for i in range(repeat):
+        t0 = time.time()
+        f()
+        t = time.time() - t0
+        best = t if best is None else min(best, t)
+    return best
+
+
+if __name__ == "__main__":
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+    s = make_region_string(n)
+    lines = s.split("\n")
+
+    rp = RegionParser()
+    t = bench(lambda: [rp.parseLine(l) for l in lines], n)
+    print("parseLine      : %8.2f s, %6.1f us/line" % (t, t / n * 1.e6))
+
+    t = bench(lambda: pyregion.parse(s), n)
+    print("pyregion.parse : %8.2f s, %6.1f us/line" % (t, t / n * 1.e6))
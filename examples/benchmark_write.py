@@ -0,0 +1,35 @@
+"""
+Measures the cost of writing large region files, per shape.
+
+python benchmark_write.py [nshapes]
+"""
+
+import os
+import sys
+import tempfile
+
+import pyregion
+from pyregion.shape_table import ShapeTable
+
+from benchmark_parse import make_region_string, bench
+
+
+if __name__ == "__main__":
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 1000000
+    r = pyregion.parse(make_region_string(n))
+    t = ShapeTable.from_shapelist(r)
+
+    fd, fname = tempfile.mkstemp(suffix=".reg")
+    os.close(fd)
+
+    tests = [("ShapeList", lambda: r.write(fname)),
+             ("ShapeList, sexagesimal",
+              lambda: r.write(fname, sexagesimal=True)),
+             ("ShapeTable", lambda: pyregion.write_region(t, fname)),
+             ]
+
+    for name, f in tests:
+        t1 = bench(f, n)
+        print("%-25s: %8.2f s, %6.2f us/shape" % (name, t1, t1 / n * 1.e6))
+
+    os.remove(fname)
@@ -2,8 +2,16 @@
 cdef extern from "stdio.h":
     pass
 
-cdef extern from "stdlib.h":
-    pass
+cdef extern from "stdlib.h" nogil:
+    void *malloc(size_t size)
+    void *realloc(void *ptr, size_t size)
+    void free(void *ptr)
+    void qsort(void *base, size_t nmemb, size_t size,
+               int (*compar)(const void *, const void *))
+
+cdef extern from "string.h" nogil:
+    void *memset(void *s, int c, size_t n)
+    void *memcpy(void *dest, const void *src, size_t n)
 
 # cdef extern from "geom2.h":
 #     ctypedef struct Metric:
@@ -18,9 +26,12 @@ cdef extern from "stdlib.h":
 
 
 cimport  c_numpy
-from c_numpy cimport npy_bool
+from c_numpy cimport npy_bool, npy_int32
 cimport c_python
 
+import numpy as np
+import multiprocessing
+import threading
 
 c_numpy.import_array()
 #c_numpy.import_ufunc()
@@ -35,6 +46,62 @@ class RegionFilterException(Exception):
     pass
 
 
+# rows per tile, and minimum number of points per thread, for the
+# multi-threaded evaluation.
+DEF _TILE_ROWS = 16
+DEF _MIN_POINTS_PER_THREAD = 4096
+
+
+def _get_nthreads(nthreads):
+    if not nthreads:
+        return multiprocessing.cpu_count()
+    if nthreads < 0:
+        raise ValueError("nthreads must be a positive integer, 0, or None")
+    return int(nthreads)
+
+
+def _run_in_threads(func, nthreads):
+    """
+    Call func(i) for i in range(nthreads), each in its own thread. func
+    is expected to release the GIL. The first exception raised is
+    re-raised in the calling thread.
+    """
+    errors = []
+
+    def _target(i):
+        try:
+            func(i)
+        except BaseException as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target=_target, args=(i,))
+               for i in range(1, nthreads)]
+    for th in threads:
+        th.start()
+    _target(0)
+    for th in threads:
+        th.join()
+
+    if errors:
+        raise errors[0]
+
+
+def _image_shape(img_or_shape):
+    # returns (ny, nx) of a numpy 2d array (or any python object with
+    # *shape* attribute) or a tuple of two integers.
+    if hasattr(img_or_shape, "shape"):
+        shape = img_or_shape.shape
+    elif c_python.PySequence_Check(img_or_shape):
+        shape = img_or_shape
+    else:
+        raise RegionFilterException("the inut needs to be a numpy 2-d array or a tuple of two integers")
+
+    if c_python.PySequence_Length(shape) != 2:
+        raise RegionFilterException("shape of the input image must be 2d: %s is given" % (str(shape)))
+
+    return int(shape[0]), int(shape[1])
+
+
 cdef struct Metric:
     double x0
     double y0
@@ -80,6 +147,361 @@ cdef int _update_metric_wcs(Metric *m):
 #cdef RegionContext metric_default
 #metric_default._set(_init_metric_default)
 
+
+# Bounding box of a region. A region is guaranteed to have a constant
+# value outside of its bounding box (the value is returned by
+# RegionBase._bbox). An empty box has x1 > x2 (or y1 > y2), and an
+# unbounded one has infinite limits.
+
+cdef struct BBox:
+    double x1
+    double y1
+    double x2
+    double y2
+
+
+cdef void bbox_set(BBox *b, double x1, double y1, double x2, double y2) noexcept nogil:
+    b.x1 = x1
+    b.y1 = y1
+    b.x2 = x2
+    b.y2 = y2
+
+cdef void bbox_set_infinite(BBox *b) noexcept nogil:
+    bbox_set(b, -HUGE_VAL, -HUGE_VAL, HUGE_VAL, HUGE_VAL)
+
+cdef void bbox_set_empty(BBox *b) noexcept nogil:
+    bbox_set(b, HUGE_VAL, HUGE_VAL, -HUGE_VAL, -HUGE_VAL)
+
+cdef int bbox_is_empty(BBox *b) noexcept nogil:
+    return (b.x1 > b.x2) | (b.y1 > b.y2)
+
+cdef int bbox_is_finite(BBox *b) noexcept nogil:
+    return (fabs(b.x1) < HUGE_VAL) & (fabs(b.x2) < HUGE_VAL) & \
+           (fabs(b.y1) < HUGE_VAL) & (fabs(b.y2) < HUGE_VAL)
+
+cdef void bbox_union(BBox *b, BBox *o) noexcept nogil:
+    if o.x1 < b.x1: b.x1 = o.x1
+    if o.y1 < b.y1: b.y1 = o.y1
+    if o.x2 > b.x2: b.x2 = o.x2
+    if o.y2 > b.y2: b.y2 = o.y2
+
+cdef void bbox_intersect(BBox *b, BBox *o) noexcept nogil:
+    if o.x1 > b.x1: b.x1 = o.x1
+    if o.y1 > b.y1: b.y1 = o.y1
+    if o.x2 < b.x2: b.x2 = o.x2
+    if o.y2 < b.y2: b.y2 = o.y2
+
+
+cdef void _pixel_range(double v1, double v2, c_numpy.npy_intp n,
+                       c_numpy.npy_intp *i1, c_numpy.npy_intp *i2) noexcept nogil:
+    # conservative range of pixel indices (0 <= i < n) between v1 and v2
+    if (v1 != v1) | (v2 != v2): # nan
+        i1[0] = 0
+        i2[0] = n - 1
+        return
+
+    if v1 <= 0:
+        i1[0] = 0
+    elif v1 >= n:
+        i1[0] = n
+    else:
+        i1[0] = <c_numpy.npy_intp> floor(v1)
+
+    if v2 >= n - 1:
+        i2[0] = n - 1
+    elif v2 < 0:
+        i2[0] = -1
+    else:
+        i2[0] = <c_numpy.npy_intp> ceil(v2)
+
+
+# Affine transform from image coordinates (x, y) to the local
+# coordinates of a region, i.e.,
+#   x' = a11*x + a12*y + b1
+#   y' = a21*x + a22*y + b2
+
+cdef struct Affine:
+    double a11
+    double a12
+    double a21
+    double a22
+    double b1
+    double b2
+
+
+cdef void affine_set_identity(Affine *t) noexcept nogil:
+    t.a11, t.a12, t.a21, t.a22 = 1., 0., 0., 1.
+    t.b1, t.b2 = 0., 0.
+
+cdef int affine_is_identity(Affine *t) noexcept nogil:
+    return (t.a11 == 1.) & (t.a12 == 0.) & (t.a21 == 0.) & (t.a22 == 1.) & \
+           (t.b1 == 0.) & (t.b2 == 0.)
+
+
+# A sorted list of disjoint x-intervals, [x[0], x[1]], [x[2], x[3]], ...
+# covered by a region along a single image row.
+
+cdef struct Spans:
+    double *x
+    int n
+    int size
+
+
+cdef void spans_init(Spans *s) noexcept nogil:
+    s.x = NULL
+    s.n = 0
+    s.size = 0
+
+cdef void spans_free(Spans *s) noexcept nogil:
+    free(s.x)
+    spans_init(s)
+
+cdef int spans_reserve(Spans *s, int n) noexcept nogil:
+    cdef double *x
+    if n <= s.size:
+        return 0
+    if n < 2*s.size:
+        n = 2*s.size
+    x = <double *> realloc(s.x, 2*n*sizeof(double))
+    if x == NULL:
+        return -1
+    s.x = x
+    s.size = n
+    return 0
+
+cdef int spans_append(Spans *s, double x1, double x2) noexcept nogil:
+    if spans_reserve(s, s.n + 1) < 0:
+        return -1
+    s.x[2*s.n] = x1
+    s.x[2*s.n+1] = x2
+    s.n = s.n + 1
+    return 0
+
+cdef int spans_set_full(Spans *s) noexcept nogil:
+    s.n = 0
+    return spans_append(s, -HUGE_VAL, HUGE_VAL)
+
+cdef int _cmp_span(const void *a, const void *b) noexcept nogil:
+    cdef double xa, xb
+    xa = (<double *> a)[0]
+    xb = (<double *> b)[0]
+    return (xa > xb) - (xa < xb)
+
+cdef void spans_normalize(Spans *s) noexcept nogil:
+    # sort intervals, and merge overlapping ones. Intervals that only
+    # touch are kept separate, as the point between them may not be
+    # covered (e.g., the complement of a single point).
+    cdef int i, n
+    cdef double *x
+
+    x = s.x
+    qsort(x, s.n, 2*sizeof(double), _cmp_span)
+
+    n = 0
+    for i from 0 <= i < s.n:
+        if x[2*i] > x[2*i+1]:
+            continue
+        if n and x[2*i] < x[2*n-1]:
+            if x[2*i+1] > x[2*n-1]:
+                x[2*n-1] = x[2*i+1]
+        else:
+            x[2*n] = x[2*i]
+            x[2*n+1] = x[2*i+1]
+            n = n + 1
+    s.n = n
+
+cdef int spans_extend(Spans *s, Spans *o) noexcept nogil:
+    # append intervals of o to s. Call spans_normalize afterward.
+    cdef int i
+    if spans_reserve(s, s.n + o.n) < 0:
+        return -1
+    for i from 0 <= i < 2*o.n:
+        s.x[2*s.n+i] = o.x[i]
+    s.n = s.n + o.n
+    return 0
+
+cdef int spans_intersect(Spans *s, Spans *o) noexcept nogil:
+    cdef Spans r
+    cdef int i, j
+    cdef double x1, x2
+
+    spans_init(&r)
+    if spans_reserve(&r, s.n + o.n) < 0:
+        return -1
+
+    i, j = 0, 0
+    while (i < s.n) & (j < o.n):
+        x1 = s.x[2*i]
+        if o.x[2*j] > x1: x1 = o.x[2*j]
+        x2 = s.x[2*i+1]
+        if o.x[2*j+1] < x2: x2 = o.x[2*j+1]
+        if x1 <= x2:
+            r.x[2*r.n] = x1
+            r.x[2*r.n+1] = x2
+            r.n = r.n + 1
+        if s.x[2*i+1] < o.x[2*j+1]:
+            i = i + 1
+        else:
+            j = j + 1
+
+    free(s.x)
+    s[0] = r
+    return 0
+
+cdef int spans_has_points(Spans *s) noexcept nogil:
+    # returns 1 if a span, or a gap between two spans, is a single
+    # point. The closed complement of such spans is not exact.
+    cdef int i
+
+    for i from 0 <= i < s.n:
+        if s.x[2*i] >= s.x[2*i+1]:
+            return 1
+        if i > 0 and s.x[2*i-1] >= s.x[2*i]:
+            return 1
+    return 0
+
+cdef int spans_complement(Spans *s) noexcept nogil:
+    cdef Spans r
+    cdef int i
+    cdef double x1
+
+    spans_init(&r)
+    if spans_reserve(&r, s.n + 1) < 0:
+        return -1
+
+    x1 = -HUGE_VAL
+    for i from 0 <= i < s.n:
+        if x1 < s.x[2*i]:
+            r.x[2*r.n] = x1
+            r.x[2*r.n+1] = s.x[2*i]
+            r.n = r.n + 1
+        x1 = s.x[2*i+1]
+    if x1 < HUGE_VAL:
+        r.x[2*r.n] = x1
+        r.x[2*r.n+1] = HUGE_VAL
+        r.n = r.n + 1
+
+    free(s.x)
+    s[0] = r
+    return 0
+
+
+cdef int _linear_range(double a, double c, double lo, double hi,
+                       double *x1, double *x2) noexcept nogil:
+    # range of x where lo <= a*x + c <= hi. Returns 0 if empty.
+    if a > 0.:
+        x1[0] = (lo - c)/a
+        x2[0] = (hi - c)/a
+    elif a < 0.:
+        x1[0] = (hi - c)/a
+        x2[0] = (lo - c)/a
+    elif (lo <= c) & (c <= hi):
+        x1[0] = -HUGE_VAL
+        x2[0] = HUGE_VAL
+    else:
+        return 0
+    return (x1[0] <= x2[0])
+
+cdef int _quadratic_range(double a, double b, double c,
+                          double *x1, double *x2) noexcept nogil:
+    # range of x where a*x**2 + b*x + c <= 0, for a >= 0. Returns 0 if
+    # empty.
+    cdef double d
+    if a > 0.:
+        d = b*b - 4.*a*c
+        if d < 0.:
+            return 0
+        d = sqrt(d)
+        x1[0] = (-b - d)/(2.*a)
+        x2[0] = (-b + d)/(2.*a)
+        return 1
+    else:
+        return _linear_range(b, c, -HUGE_VAL, 0., x1, x2)
+
+cdef int _weighted_disk_spans(Affine *t, double y,
+                              double xc, double yc,
+                              double wx, double wy, double r2,
+                              Spans *s) noexcept nogil:
+    # spans of wx*(x'-xc)**2 + wy*(y'-yc)**2 <= r2 along the row y,
+    # where (x', y') is the transformed coordinate.
+    cdef double c1, c2, x1, x2
+
+    c1 = t.a12*y + t.b1 - xc
+    c2 = t.a22*y + t.b2 - yc
+
+    s.n = 0
+    if _quadratic_range(wx*t.a11*t.a11 + wy*t.a21*t.a21,
+                        2.*(wx*t.a11*c1 + wy*t.a21*c2),
+                        wx*c1*c1 + wy*c2*c2 - r2,
+                        &x1, &x2):
+        if spans_append(s, x1, x2) < 0:
+            return -1
+    return 1
+
+
+# Packing of mask rows, in the layout of numpy.packbits (the first
+# pixel is the most significant bit).
+
+cdef unsigned char _pad_mask(c_numpy.npy_intp nx) noexcept nogil:
+    # the bits of the last byte of a row which hold pixels.
+    return <unsigned char> (0xff << (8 - nx % 8))
+
+cdef void _pack_row(npy_bool *row, c_numpy.npy_intp nx,
+                    unsigned char *out) noexcept nogil:
+    cdef c_numpy.npy_intp i
+    cdef unsigned char c
+    c = 0
+    for i from 0 <= i < nx:
+        c = (c << 1) | (row[i] != 0)
+        if i % 8 == 7:
+            out[i//8] = c
+            c = 0
+    if nx % 8:
+        out[nx//8] = c << (8 - nx % 8)
+
+
+# A list of runs of pixels, (row, x0, x1) with x0 <= x < x1, used for
+# the sparse masks.
+
+cdef struct Runs:
+    c_numpy.npy_intp *v
+    c_numpy.npy_intp n
+    c_numpy.npy_intp size
+
+
+cdef void runs_init(Runs *r) noexcept nogil:
+    r.v = NULL
+    r.n = 0
+    r.size = 0
+
+cdef void runs_free(Runs *r) noexcept nogil:
+    free(r.v)
+    runs_init(r)
+
+cdef int runs_append(Runs *r, c_numpy.npy_intp row,
+                     c_numpy.npy_intp x0, c_numpy.npy_intp x1) noexcept nogil:
+    # runs are appended in order. Adjacent or overlapping runs on the
+    # same row are merged.
+    cdef c_numpy.npy_intp *v
+    cdef c_numpy.npy_intp size
+    if r.n > 0 and r.v[3*r.n-3] == row and r.v[3*r.n-1] >= x0:
+        if r.v[3*r.n-1] < x1:
+            r.v[3*r.n-1] = x1
+        return 0
+    if r.n == r.size:
+        size = 2*r.size
+        if size < 64:
+            size = 64
+        v = <c_numpy.npy_intp *> realloc(r.v, 3*size*sizeof(c_numpy.npy_intp))
+        if v == NULL:
+            return -1
+        r.v = v
+        r.size = size
+    r.v[3*r.n], r.v[3*r.n+1], r.v[3*r.n+2] = row, x0, x1
+    r.n = r.n + 1
+    return 0
+
+
 cdef RegionContext metric_wcs
 metric_wcs = RegionContext()
 metric_wcs.set_update_func(_update_metric_wcs)
@@ -136,60 +558,556 @@ cdef class RegionBase:
     def __or__(self, RegionBase o):
         return RegionOr(self, o)
 
-    cdef npy_bool _inside(self, double x, double y):
+    cdef npy_bool _inside(self, double x, double y) noexcept nogil:
         return (0)
 
-    def mask(self, img_or_shape):
+    cdef npy_bool _bbox(self, BBox *b) noexcept nogil:
+        # set b to a box outside of which the region has a constant
+        # value, and return that value. Unless overridden, the box is
+        # infinite.
+        bbox_set_infinite(b)
+        return 0
+
+    cdef int _spans(self, double y, Affine *t, Spans *s) noexcept nogil:
+        # set s to the x-intervals covered by the region along the row
+        # y, where t transforms image coordinates to the coordinate
+        # of the region. Returns 1 if the intervals are exact, 0 if
+        # they only bound the region (pixels within them need to be
+        # tested with _inside), and -1 on memory error. Unless
+        # overridden, the bounding box is used.
+        cdef BBox b
+        cdef npy_bool outside
+
+        s.n = 0
+        if not affine_is_identity(t):
+            return spans_set_full(s)
+
+        outside = self._bbox(&b)
+        if (y < b.y1) | (y > b.y2):
+            if outside and spans_set_full(s) < 0:
+                return -1
+            return 1
+        if outside:
+            return spans_set_full(s)
+        if b.x1 <= b.x2:
+            return spans_append(s, b.x1, b.x2)
+        return 0
+
+    def bbox(self):
+        """
+        bbox() : returns a tuple of (x1, y1, x2, y2). The region is
+        guaranteed to have a constant value outside of this box. The
+        box can be empty (x1 > x2) or infinite.
+        """
+        cdef BBox b
+        self._bbox(&b)
+        return (b.x1, b.y1, b.x2, b.y2)
+
+    def mask(self, img_or_shape, method="scanline", nthreads=1,
+             format="dense"):
         """
         Create a mask ( a 2-d image whose pixel value is 1 if the
         pixel is inside the filter, otherwise 0). It takes a single
         argument which is numpy 2d array (or any python object with
         *shape* attribute) or a tuple of two integer representing the
         image shape.
-        """
 
-        cdef int l, nx, ny
+        By default (method="scanline"), the mask is filled row by row
+        with the intervals covered by the region, and only the pixels
+        at the ends of the intervals are tested. With method="point",
+        every pixel within the bounding box of the region is tested.
 
-        if hasattr(img_or_shape, "shape"):
-            shape = img_or_shape.shape
-        elif c_python.PySequence_Check(img_or_shape):
-            shape = img_or_shape
-        else:
-            raise RegionFilterException("the inut needs to be a numpy 2-d array or a tuple of two integers")
+        With nthreads > 1, rows are split into tiles which are
+        processed in parallel threads. nthreads=None (or 0) uses all
+        the cpus.
 
-        if c_python.PySequence_Length(shape) != 2:
-            raise RegionFilterException("shape of the input image must be 2d: %s is given" % (str(shape)))
+        With format="slices" (or "rle"), the dense mask is never
+        created. Instead, a pyregion.mask_helper.SpanMask, which holds
+        the runs of pixels inside the filter as (row, x0, x1) arrays,
+        is returned.
 
-        ny = c_python.PySequence_GetItem(shape, 0)
-        nx = c_python.PySequence_GetItem(shape, 1)
+        With format="packed", a uint8 array of shape (ny, (nx+7)//8)
+        with 8 pixels per byte is returned, in the same layout as
+        numpy.packbits(mask, axis=1). See pyregion.mask_helper for the
+        operations on packed masks.
+        """
+
+        if method not in ("scanline", "point"):
+            raise ValueError("unknown method: %s" % (method,))
 
-        return self._mask(nx, ny)
+        ny, nx = _image_shape(img_or_shape)
 
-    cdef c_numpy.ndarray _mask(self, c_numpy.npy_intp nx, c_numpy.npy_intp ny):
+        if format in ("slices", "rle"):
+            return self._mask_runs(nx, ny, method == "scanline")
+        elif format not in ("dense", "packed"):
+            raise ValueError("unknown format: %s" % (format,))
 
+        return self._mask(nx, ny, method == "scanline",
+                          _get_nthreads(nthreads), format == "packed")
+
+    def fractional_mask(self, img_or_shape, int subsample=5):
+        """
+        Create a float32 image of the fraction of each pixel covered by
+        the filter. Each pixel is sampled on a grid of subsample x
+        subsample points. The samples are counted along sub-rows using
+        the intervals covered by the region, so that the cost of the
+        interior pixels (1.0) and of the exterior ones (0.0) is small.
+        """
         cdef c_numpy.npy_intp ny_nx[2]
         cdef c_numpy.ndarray ra
-        cdef npy_bool *rd
-        cdef int iy, ix
+        cdef float *rd
+        cdef c_numpy.npy_intp nx, ny
+        cdef int err
 
+        if subsample < 1:
+            raise ValueError("subsample must be a positive integer")
+
+        ny, nx = _image_shape(img_or_shape)
         ny_nx[0] = ny
         ny_nx[1] = nx
 
-        ra = c_numpy.PyArray_EMPTY(2, ny_nx,
-                                   c_numpy.NPY_BOOL, 0)
+        ra = c_numpy.PyArray_EMPTY(2, ny_nx, c_numpy.NPY_FLOAT, 0)
+        rd = <float *> c_numpy.PyArray_DATA(ra)
 
-        rd = <npy_bool *> c_numpy.PyArray_DATA(ra)
+        with nogil:
+            err = self._fractional(rd, nx, ny, subsample)
+        if err < 0:
+            raise MemoryError()
 
-        for iy from 0 <= iy < ny:
+        return ra
+
+    cdef int _fractional(self, float *rd, c_numpy.npy_intp nx,
+                         c_numpy.npy_intp ny, int n) noexcept nogil:
+        cdef c_numpy.npy_intp i, j, ix, iy, iy1, iy2, j1, j2, jlast, p1, p2, run
+        cdef npy_bool outside
+        cdef BBox b
+        cdef Affine t
+        cdef Spans s
+        cdef int exact, k, err
+        cdef double y, x
+        cdef c_numpy.npy_intp *acc
+        cdef c_numpy.npy_intp *d
+        cdef float norm
+
+        outside = self._bbox(&b)
+        for i from 0 <= i < nx*ny:
+            rd[i] = outside
+
+        if bbox_is_empty(&b):
+            return 0
+
+        # a pixel iy covers iy-0.5 <= y < iy+0.5
+        _pixel_range(b.y1 - 0.5, b.y2 + 0.5, ny, &iy1, &iy2)
+
+        # acc : the number of samples inside each pixel, for the end
+        # pixels of the runs; d : the difference array for the pixels
+        # fully covered by the runs.
+        acc = <c_numpy.npy_intp *> malloc((2*nx+1)*sizeof(c_numpy.npy_intp))
+        if acc == NULL:
+            return -1
+        d = acc + nx
+
+        norm = 1./(n*n)
+        affine_set_identity(&t)
+        spans_init(&s)
+        err = 0
+        for iy from iy1 <= iy <= iy2:
+            memset(acc, 0, (2*nx+1)*sizeof(c_numpy.npy_intp))
+            for k from 0 <= k < n:
+                # the sample j of the row is at x = (j+0.5)/n - 0.5
+                y = iy - 0.5 + (k + 0.5)/n
+                exact = self._spans(y, &t, &s)
+                if exact < 0:
+                    err = -1
+                    break
+                jlast = -1
+                for i from 0 <= i < s.n:
+                    if exact:
+                        if not self._span_pixels(s.x[2*i], s.x[2*i+1],
+                                                 nx*n, y, &j1, &j2, n):
+                            continue
+                        # the spans may share their end samples
+                        if j1 <= jlast:
+                            j1 = jlast + 1
+                            if j1 > j2:
+                                continue
+                        jlast = j2
+                        p1, p2 = j1//n, j2//n
+                        if p1 == p2:
+                            acc[p1] = acc[p1] + j2 - j1 + 1
+                        else:
+                            acc[p1] = acc[p1] + n - j1 % n
+                            acc[p2] = acc[p2] + j2 % n + 1
+                            d[p1+1] = d[p1+1] + n
+                            d[p2] = d[p2] - n
+                    else:
+                        _pixel_range((s.x[2*i] + 0.5)*n - 1,
+                                     (s.x[2*i+1] + 0.5)*n, nx*n, &j1, &j2)
+                        if j1 <= jlast:
+                            j1 = jlast + 1
+                        if j2 > jlast:
+                            jlast = j2
+                        for j from j1 <= j <= j2:
+                            x = (j + 0.5)/n - 0.5
+                            if self._inside(x, y):
+                                acc[j//n] = acc[j//n] + 1
+            if err < 0:
+                break
+            run = 0
             for ix from 0 <= ix < nx:
-                #rd[iy*nx + ix] = self._inside(i, j)
-                # altenatively more optimized
-                #rd[0] = self._inside(ix+1, iy+1) # +1 for (1,1) based..
-                rd[0] = self._inside(ix, iy)
-                rd = rd + 1
+                run = run + d[ix]
+                rd[iy*nx + ix] = (acc[ix] + run)*norm
+        spans_free(&s)
+        free(acc)
+
+        return err
+
+    cdef c_numpy.ndarray _mask(self, c_numpy.npy_intp nx, c_numpy.npy_intp ny,
+                               int scanline, int nthreads, int packed=0):
+
+        cdef c_numpy.npy_intp ny_nx[2]
+        cdef c_numpy.ndarray ra
+        cdef unsigned char *rd
+        cdef npy_bool outside
+        cdef c_numpy.npy_intp iy, iy1, iy2, rowsize
+        cdef BBox b
+
+        ny_nx[0] = ny
+        if packed:
+            # 8 pixels per byte, as in numpy.packbits(mask, axis=1)
+            rowsize = (nx + 7)//8
+            ny_nx[1] = rowsize
+            ra = c_numpy.PyArray_EMPTY(2, ny_nx,
+                                       c_numpy.NPY_UBYTE, 0)
+        else:
+            rowsize = nx*sizeof(npy_bool)
+            ny_nx[1] = nx
+            ra = c_numpy.PyArray_EMPTY(2, ny_nx,
+                                       c_numpy.NPY_BOOL, 0)
+
+        rd = <unsigned char *> c_numpy.PyArray_DATA(ra)
+
+        # pixels outside the bounding box are not evaluated.
+        outside = self._bbox(&b)
+        if packed:
+            memset(rd, 0xff if outside else 0, ny*rowsize)
+            if outside and nx % 8:
+                # the padding bits are left 0
+                for iy from 0 <= iy < ny:
+                    rd[iy*rowsize + rowsize - 1] = _pad_mask(nx)
+        else:
+            memset(rd, outside, ny*rowsize)
+
+        if bbox_is_empty(&b):
+            return ra
+
+        _pixel_range(b.y1, b.y2, ny, &iy1, &iy2)
+
+        if nthreads > (iy2 - iy1)//_TILE_ROWS + 1:
+            nthreads = (iy2 - iy1)//_TILE_ROWS + 1
+
+        if nthreads > 1:
+            _run_in_threads(lambda i: self._mask_tiles(ra, nx, iy1, iy2+1,
+                                                       scanline, packed,
+                                                       i, nthreads),
+                            nthreads)
+        else:
+            self._mask_tiles(ra, nx, iy1, iy2+1, scanline, packed, 0, 1)
 
         return ra
 
+    cdef object _mask_runs(self, c_numpy.npy_intp nx, c_numpy.npy_intp ny,
+                           int scanline):
+        from pyregion.mask_helper import SpanMask
+
+        cdef c_numpy.ndarray va
+        cdef Runs r
+        cdef int err
+
+        runs_init(&r)
+        with nogil:
+            err = self._runs(&r, nx, ny, scanline)
+        if err < 0:
+            runs_free(&r)
+            raise MemoryError()
+
+        try:
+            va = np.empty((r.n, 3), dtype=np.intp)
+            memcpy(c_numpy.PyArray_DATA(va), r.v,
+                   3*r.n*sizeof(c_numpy.npy_intp))
+        finally:
+            runs_free(&r)
+
+        return SpanMask((ny, nx), va[:,0], va[:,1], va[:,2])
+
+    cdef int _runs(self, Runs *r, c_numpy.npy_intp nx,
+                   c_numpy.npy_intp ny, int scanline) noexcept nogil:
+        cdef c_numpy.npy_intp iy, ix, ix1, ix2, iy1, iy2, bx1, bx2
+        cdef npy_bool outside
+        cdef BBox b
+        cdef Affine t
+        cdef Spans s
+        cdef int exact, i, err
+
+        outside = self._bbox(&b)
+        if bbox_is_empty(&b):
+            iy1, iy2 = ny, ny-1
+        else:
+            _pixel_range(b.y1, b.y2, ny, &iy1, &iy2)
+            _pixel_range(b.x1, b.x2, nx, &bx1, &bx2)
+
+        affine_set_identity(&t)
+        spans_init(&s)
+        err = 0
+        for iy from 0 <= iy < ny:
+            if iy < iy1 or iy > iy2:
+                if outside:
+                    err = runs_append(r, iy, 0, nx)
+            elif scanline:
+                exact = self._spans(iy, &t, &s)
+                if exact < 0:
+                    err = -1
+                for i from 0 <= i < s.n:
+                    if err < 0:
+                        break
+                    if exact:
+                        if self._span_pixels(s.x[2*i], s.x[2*i+1], nx, iy,
+                                             &ix1, &ix2):
+                            err = runs_append(r, iy, ix1, ix2+1)
+                    else:
+                        _pixel_range(s.x[2*i], s.x[2*i+1], nx, &ix1, &ix2)
+                        for ix from ix1 <= ix <= ix2:
+                            if self._inside(ix, iy):
+                                err = runs_append(r, iy, ix, ix+1)
+                                if err < 0:
+                                    break
+            else:
+                for ix from 0 <= ix < nx:
+                    if ix < bx1 or ix > bx2:
+                        if outside:
+                            err = runs_append(r, iy, ix, ix+1)
+                    elif self._inside(ix, iy):
+                        err = runs_append(r, iy, ix, ix+1)
+                    if err < 0:
+                        break
+            if err < 0:
+                break
+        spans_free(&s)
+
+        return err
+
+    def _mask_tiles(self, c_numpy.ndarray ra, c_numpy.npy_intp nx,
+                    c_numpy.npy_intp iy1, c_numpy.npy_intp iy2,
+                    int scanline, int packed, int ithread, int nthreads):
+        # fill every nthreads-th tile of rows (starting from the
+        # ithread-th one) between iy1 and iy2 with the GIL released.
+        cdef unsigned char *rd
+        cdef c_numpy.npy_intp rowsize
+        cdef int r
+
+        rd = <unsigned char *> c_numpy.PyArray_DATA(ra)
+        rowsize = ra.dimensions[1]
+
+        with nogil:
+            r = self._mask_rows(rd, rowsize, nx, iy1, iy2, scanline, packed,
+                                ithread, nthreads)
+
+        if r < 0:
+            raise MemoryError()
+
+    cdef int _mask_rows(self, unsigned char *rd, c_numpy.npy_intp rowsize,
+                        c_numpy.npy_intp nx,
+                        c_numpy.npy_intp iy1, c_numpy.npy_intp iy2,
+                        int scanline, int packed,
+                        int ithread, int nthreads) noexcept nogil:
+        cdef c_numpy.npy_intp iy, ix, ix1, ix2, it
+        cdef npy_bool *row
+        cdef npy_bool outside
+        cdef BBox b
+        cdef Affine t
+        cdef Spans s
+        cdef int r
+
+        outside = self._bbox(&b)
+        _pixel_range(b.x1, b.x2, nx, &ix1, &ix2)
+
+        # for the packed mask, the rows are filled in a scratch buffer
+        # and then packed.
+        row = NULL
+        if packed:
+            row = <npy_bool *> malloc(nx*sizeof(npy_bool))
+            if row == NULL:
+                return -1
+
+        affine_set_identity(&t)
+        spans_init(&s)
+        r = 0
+        for it from iy1 + ithread*_TILE_ROWS <= it < iy2 by nthreads*_TILE_ROWS:
+            for iy from it <= iy < it + _TILE_ROWS:
+                if iy >= iy2:
+                    break
+                if not packed:
+                    row = <npy_bool *> (rd + iy*rowsize)
+                if scanline:
+                    r = self._fill_row(row, nx, iy, &t, &s)
+                    if r < 0:
+                        break
+                else:
+                    if packed:
+                        memset(row, outside, nx*sizeof(npy_bool))
+                    for ix from ix1 <= ix <= ix2:
+                        row[ix] = self._inside(ix, iy)
+                if packed:
+                    _pack_row(row, nx, rd + iy*rowsize)
+            if r < 0:
+                break
+        spans_free(&s)
+        if packed:
+            free(row)
+
+        return r
+
+    cdef int _span_pixels(self, double x1, double x2, c_numpy.npy_intp nx,
+                          double y, c_numpy.npy_intp *ix1,
+                          c_numpy.npy_intp *ix2, int n=1) noexcept nogil:
+        # set ix1, ix2 to the samples inside the exact span x1, x2 of
+        # the row y. The sample j of a row of nx samples is at
+        # x = (j+0.5)/n - 0.5, i.e., the pixel centers for n=1. The
+        # end samples are tested, so that the result is identical to
+        # the one from _inside. Returns 0 if no sample is inside.
+        cdef c_numpy.npy_intp ix, i1, i2
+
+        _pixel_range(ceil((x1 + 0.5)*n - 0.5), floor((x2 + 0.5)*n - 0.5),
+                     nx, &i1, &i2)
+        if i1 >= nx or i2 < 0:
+            return 0
+        ix = i1
+        while i1 <= i2 and not self._inside((i1 + 0.5)/n - 0.5, y):
+            i1 = i1 + 1
+        if i1 == ix:
+            while i1 > 0 and self._inside((i1 - 0.5)/n - 0.5, y):
+                i1 = i1 - 1
+        ix = i2
+        while i1 <= i2 and not self._inside((i2 + 0.5)/n - 0.5, y):
+            i2 = i2 - 1
+        if i2 == ix:
+            while i2 < nx-1 and self._inside((i2 + 1.5)/n - 0.5, y):
+                i2 = i2 + 1
+
+        ix1[0], ix2[0] = i1, i2
+        return i1 <= i2
+
+    cdef int _fill_row(self, npy_bool *rd, c_numpy.npy_intp nx,
+                       c_numpy.npy_intp iy, Affine *t, Spans *s) noexcept nogil:
+        # fill a row of the mask using the spans of the region.
+        cdef int exact, i
+        cdef c_numpy.npy_intp ix, ix1, ix2
+
+        exact = self._spans(iy, t, s)
+        if exact < 0:
+            return -1
+
+        memset(rd, 0, nx*sizeof(npy_bool))
+
+        for i from 0 <= i < s.n:
+            if exact:
+                if self._span_pixels(s.x[2*i], s.x[2*i+1], nx, iy,
+                                     &ix1, &ix2):
+                    memset(rd + ix1, 1, (ix2-ix1+1)*sizeof(npy_bool))
+            else:
+                _pixel_range(s.x[2*i], s.x[2*i+1], nx, &ix1, &ix2)
+                for ix from ix1 <= ix <= ix2:
+                    rd[ix] = self._inside(ix, iy)
+
+        return 0
+
+    cdef int _label_row(self, npy_int32 *ld, c_numpy.npy_intp nx,
+                        c_numpy.npy_intp iy, npy_int32 label,
+                        Affine *t, Spans *s) noexcept nogil:
+        # set the pixels of a row of the label image covered by the
+        # region to label. Other pixels are left untouched.
+        cdef int exact, i
+        cdef c_numpy.npy_intp ix, ix1, ix2
+
+        exact = self._spans(iy, t, s)
+        if exact < 0:
+            return -1
+
+        for i from 0 <= i < s.n:
+            if exact:
+                if not self._span_pixels(s.x[2*i], s.x[2*i+1], nx, iy,
+                                         &ix1, &ix2):
+                    continue
+                for ix from ix1 <= ix <= ix2:
+                    ld[ix] = label
+            else:
+                _pixel_range(s.x[2*i], s.x[2*i+1], nx, &ix1, &ix2)
+                for ix from ix1 <= ix <= ix2:
+                    if self._inside(ix, iy):
+                        ld[ix] = label
+
+        return 0
+
+    cdef int _label(self, npy_int32 *ld, c_numpy.npy_intp nx,
+                    c_numpy.npy_intp ny, npy_int32 label,
+                    int ithread=0, int nthreads=1) noexcept nogil:
+        # render the region into the label image, row by row within
+        # its bounding box. Only every nthreads-th tile of rows
+        # (starting from the ithread-th one) is rendered.
+        cdef c_numpy.npy_intp iy, iy1, iy2
+        cdef BBox b
+        cdef Affine t
+        cdef Spans s
+        cdef int r
+
+        if self._bbox(&b):
+            iy1, iy2 = 0, ny-1
+        elif bbox_is_empty(&b):
+            return 0
+        else:
+            _pixel_range(b.y1, b.y2, ny, &iy1, &iy2)
+
+        affine_set_identity(&t)
+        spans_init(&s)
+        r = 0
+        for iy from iy1 <= iy <= iy2:
+            if nthreads > 1 and (iy//_TILE_ROWS) % nthreads != ithread:
+                continue
+            r = self._label_row(ld + iy*nx, nx, iy, label, &t, &s)
+            if r < 0:
+                break
+        spans_free(&s)
+
+        return r
+
+    cdef void _inside_array(self, double *xd, double *yd,
+                            c_numpy.npy_intp stride, npy_bool *rd,
+                            c_numpy.npy_intp i1, c_numpy.npy_intp i2) noexcept nogil:
+        cdef c_numpy.npy_intp i
+        for i from i1 <= i < i2:
+            rd[i] = self._inside(xd[stride*i], yd[stride*i])
+
+    def _inside_chunk(self, c_numpy.ndarray xa, c_numpy.ndarray ya,
+                      c_numpy.npy_intp stride, c_numpy.ndarray ra,
+                      int ithread, int nthreads):
+        # evaluate the ithread-th of nthreads chunks with the GIL
+        # released.
+        cdef double *xd
+        cdef double *yd
+        cdef npy_bool *rd
+        cdef c_numpy.npy_intp n, i1, i2
+
+        xd = <double *> c_numpy.PyArray_DATA(xa)
+        yd = <double *> c_numpy.PyArray_DATA(ya)
+        rd = <npy_bool *> c_numpy.PyArray_DATA(ra)
+
+        n = c_numpy.PyArray_SIZE(ra)
+        i1 = (n*ithread)//nthreads
+        i2 = (n*(ithread+1))//nthreads
+
+        with nogil:
+            self._inside_array(xd, yd, stride, rd, i1, i2)
+
     def inside1(self, double x, double y):
         """
         inside1(float, float) : returns True if the point (x,y) is inside the filter.
@@ -197,43 +1115,37 @@ cdef class RegionBase:
         return self._inside(x, y)
 
 
-    def inside(self, x, y=None):
+    def inside(self, x, y=None, nthreads=1):
         if y is None:
             if len(x.shape) == 2 and x.shape[-1] == 2:
-                return self.inside_xy(x)
+                return self.inside_xy(x, nthreads=nthreads)
             else:
                 raise ValueError("input array has a wrong shape")
         else:
-            return self.inside_x_y(x, y)
+            return self.inside_x_y(x, y, nthreads=nthreads)
 
-    def inside_xy(self, xy):
+    def inside_xy(self, xy, nthreads=1):
         """
         inside(x, y) : given the numpy array of x and y, returns an
         array b of same shape, where b[i] = inside1(x[i], y[i])
         """
         cdef c_numpy.ndarray xya
+        cdef c_numpy.ndarray ya
         cdef c_numpy.ndarray ra
-        cdef double *xyd
-        cdef npy_bool *rd
-        cdef int i
-        cdef int n
 
         xya = c_numpy.PyArray_ContiguousFromAny(xy, c_numpy.NPY_DOUBLE, 1, 0)
 
         ra = c_numpy.PyArray_EMPTY(1, xya.dimensions,
                                    c_numpy.NPY_BOOL, 0)
 
-        xyd = <double *> c_numpy.PyArray_DATA(xya)
-        rd = <npy_bool *> c_numpy.PyArray_DATA(ra)
+        # y values start at the second element, with the same stride.
+        ya = xya[:,1:]
 
-        n = xya.dimensions[0] # c_numpy.PyArray_SIZE(xya) / 2
-        #_inside_ptr = self._inside
-        for i from 0 <= i < n:
-            rd[i] = self._inside(xyd[2*i], xyd[2*i+1])
+        self._inside_threaded(xya, ya, 2, ra, nthreads)
         return ra
 
 
-    def inside_x_y(self, x, y):
+    def inside_x_y(self, x, y, nthreads=1):
         """
         inside(x, y) : given the numpy array of x and y, returns an
         array b of same shape, where b[i] = inside1(x[i], y[i])
@@ -241,12 +1153,6 @@ cdef class RegionBase:
         cdef c_numpy.ndarray xa
         cdef c_numpy.ndarray ya
         cdef c_numpy.ndarray ra
-        cdef double *xd
-        cdef double *yd
-        cdef npy_bool *rd
-        cdef int i
-        cdef int n
-        #cdef c_numpy.npy_bool ((*_inside_ptr)(RegionBase, double ,double ))
 
         # FIX : check if two input has identical shape
 
@@ -256,20 +1162,21 @@ cdef class RegionBase:
         ra = c_numpy.PyArray_EMPTY(xa.nd, xa.dimensions,
                                    c_numpy.NPY_BOOL, 0)
 
-        xd = <double *> c_numpy.PyArray_DATA(xa)
-        yd = <double *> c_numpy.PyArray_DATA(ya)
-        rd = <npy_bool *> c_numpy.PyArray_DATA(ra)
-
-        n = c_numpy.PyArray_SIZE(xa)
-        #_inside_ptr = self._inside
-        for i from 0 <= i < n:
-            #self._inside(xd[0], yd[0])
-            #rd[i] = _inside_ptr(self, xd[i], yd[i])
-            rd[i] = self._inside(xd[i], yd[i])
-            #rd[i] = _inside_ptr(self, xd[i], yd[i])
-            #print xd[i], yd[i], rd[i]
+        self._inside_threaded(xa, ya, 1, ra, nthreads)
         return ra
 
+    def _inside_threaded(self, xa, ya, stride, ra, nthreads):
+        nthreads = _get_nthreads(nthreads)
+        if nthreads > c_numpy.PyArray_SIZE(ra)//_MIN_POINTS_PER_THREAD:
+            nthreads = c_numpy.PyArray_SIZE(ra)//_MIN_POINTS_PER_THREAD
+
+        if nthreads > 1:
+            _run_in_threads(lambda i: self._inside_chunk(xa, ya, stride, ra,
+                                                         i, nthreads),
+                            nthreads)
+        else:
+            self._inside_chunk(xa, ya, stride, ra, 0, 1)
+
 
 #     def inside2(self, x, y):
 #         cdef c_numpy.ndarray xa
@@ -316,9 +1223,24 @@ cdef class RegionNot(RegionBase):
     def __init__(self, RegionBase child_region):
         self.child_region = child_region
 
-    cdef npy_bool _inside(self, double x, double y):
+    cdef npy_bool _inside(self, double x, double y) noexcept nogil:
         return not(self.child_region._inside(x, y))
 
+    cdef npy_bool _bbox(self, BBox *b) noexcept nogil:
+        return not(self.child_region._bbox(b))
+
+    cdef int _spans(self, double y, Affine *t, Spans *s) noexcept nogil:
+        cdef int exact
+
+        exact = self.child_region._spans(y, t, s)
+        if exact < 0:
+            return -1
+        if exact and not spans_has_points(s):
+            if spans_complement(s) < 0:
+                return -1
+            return 1
+        return spans_set_full(s)
+
 
 cdef class RegionList(RegionBase):
     cdef object child_regions
@@ -368,7 +1290,7 @@ cdef class RegionOrList(RegionList):
     """
     >>> r = RegionOrList(r1, r2, r3, r4, ...)
     """
-    cdef npy_bool _inside(self, double x, double y):
+    cdef npy_bool _inside(self, double x, double y) noexcept nogil:
         cdef c_python.PyListObject *child_regions
         cdef int i, n
 
@@ -379,6 +1301,58 @@ cdef class RegionOrList(RegionList):
                 return 1
         return 0
 
+    cdef npy_bool _bbox(self, BBox *b) noexcept nogil:
+        # The region is 1 outside the intersection of the boxes of
+        # children that are 1 outside their boxes. If there is no such
+        # child, it is 0 outside the union of all boxes.
+        cdef c_python.PyListObject *child_regions
+        cdef int i, n
+        cdef BBox b1, b_union, b_one
+        cdef int n_one
+
+        child_regions = <c_python.PyListObject *> self.child_regions
+        n = c_python.PyList_GET_SIZE(child_regions)
+
+        bbox_set_empty(&b_union)
+        bbox_set_infinite(&b_one)
+        n_one = 0
+        for i from 0 <= i < n:
+            if (<RegionBase> c_python.PyList_GET_ITEM(child_regions, i))._bbox(&b1):
+                bbox_intersect(&b_one, &b1)
+                n_one = n_one + 1
+            else:
+                bbox_union(&b_union, &b1)
+
+        if n_one:
+            b[0] = b_one
+            return 1
+        else:
+            b[0] = b_union
+            return 0
+
+    cdef int _spans(self, double y, Affine *t, Spans *s) noexcept nogil:
+        cdef c_python.PyListObject *child_regions
+        cdef int i, n, exact, r
+        cdef Spans s1
+
+        child_regions = <c_python.PyListObject *> self.child_regions
+        n = c_python.PyList_GET_SIZE(child_regions)
+
+        s.n = 0
+        exact = 1
+        spans_init(&s1)
+        for i from 0 <= i < n:
+            r = (<RegionBase> c_python.PyList_GET_ITEM(child_regions, i))._spans(y, t, &s1)
+            if r < 0 or spans_extend(s, &s1) < 0:
+                exact = -1
+                break
+            exact = exact & r
+        spans_free(&s1)
+
+        if exact >= 0:
+            spans_normalize(s)
+        return exact
+
 
     def __repr__(self):
         return "Or"+repr(self.child_regions)
@@ -390,7 +1364,7 @@ cdef class RegionAndList(RegionList):
     >>> r = RegionAndList(r1, r2, r3, r4, ...)
     """
 
-    cdef npy_bool _inside(self, double x, double y):
+    cdef npy_bool _inside(self, double x, double y) noexcept nogil:
         cdef c_python.PyListObject *child_regions
         cdef int i, n
 
@@ -401,6 +1375,59 @@ cdef class RegionAndList(RegionList):
                 return 0
         return 1
 
+    cdef npy_bool _bbox(self, BBox *b) noexcept nogil:
+        # The region is 0 outside the intersection of the boxes of
+        # children that are 0 outside their boxes. If there is no such
+        # child, it is 1 outside the union of all boxes.
+        cdef c_python.PyListObject *child_regions
+        cdef int i, n
+        cdef BBox b1, b_union, b_zero
+        cdef int n_zero
+
+        child_regions = <c_python.PyListObject *> self.child_regions
+        n = c_python.PyList_GET_SIZE(child_regions)
+
+        bbox_set_empty(&b_union)
+        bbox_set_infinite(&b_zero)
+        n_zero = 0
+        for i from 0 <= i < n:
+            if (<RegionBase> c_python.PyList_GET_ITEM(child_regions, i))._bbox(&b1):
+                bbox_union(&b_union, &b1)
+            else:
+                bbox_intersect(&b_zero, &b1)
+                n_zero = n_zero + 1
+
+        if n_zero:
+            b[0] = b_zero
+            return 0
+        else:
+            b[0] = b_union
+            return 1
+
+    cdef int _spans(self, double y, Affine *t, Spans *s) noexcept nogil:
+        cdef c_python.PyListObject *child_regions
+        cdef int i, n, exact, r
+        cdef Spans s1
+
+        child_regions = <c_python.PyListObject *> self.child_regions
+        n = c_python.PyList_GET_SIZE(child_regions)
+
+        if spans_set_full(s) < 0:
+            return -1
+        exact = 1
+        spans_init(&s1)
+        for i from 0 <= i < n:
+            if s.n == 0 and exact:
+                break
+            r = (<RegionBase> c_python.PyList_GET_ITEM(child_regions, i))._spans(y, t, &s1)
+            if r < 0 or spans_intersect(s, &s1) < 0:
+                exact = -1
+                break
+            exact = exact & r
+        spans_free(&s1)
+
+        return exact
+
 
     def __repr__(self):
         return "And"+repr(self.child_regions)
@@ -440,6 +1467,79 @@ def RegionOr(RegionBase region1, RegionBase region2):
     return RegionOrList(*(region1_list + region2_list))
 
 
+def _label_tiles(regions, c_numpy.ndarray la, excludes,
+                 int ithread, int nthreads):
+    # render the regions, in order, into every nthreads-th tile of
+    # rows of the label image (starting from the ithread-th one).
+    cdef npy_int32 *ld
+    cdef npy_int32 label
+    cdef c_numpy.npy_intp i, nx, ny
+    cdef RegionBase r
+    cdef int err
+
+    ny, nx = la.dimensions[0], la.dimensions[1]
+    ld = <npy_int32 *> c_numpy.PyArray_DATA(la)
+
+    for i from 0 <= i < len(regions):
+        if regions[i] is None:
+            continue
+        r = regions[i]
+        if excludes[i]:
+            label = -1
+        else:
+            label = i
+        with nogil:
+            err = r._label(ld, nx, ny, label, ithread, nthreads)
+        if err < 0:
+            raise MemoryError()
+
+
+def label_image(regions, img_or_shape, excludes=None, nthreads=1):
+    """
+    label_image(regions, img_or_shape, excludes=None, nthreads=1) :
+    returns an int32 image whose pixel value is the index (in
+    *regions*) of the region covering the pixel, or -1 if no region
+    covers it.
+
+    The regions are rendered in the given order, each within its
+    bounding box only. Where regions overlap, the later one wins. If
+    excludes[i] is true, the pixels covered by regions[i] are reset to
+    -1 instead (so that they are excluded from all the preceding
+    regions, as in ds9). None in *regions* is skipped.
+
+    With nthreads > 1, rows are split into tiles which are processed
+    in parallel threads, as in RegionBase.mask.
+    """
+    cdef c_numpy.npy_intp ny_nx[2]
+    cdef c_numpy.ndarray la
+    cdef c_numpy.npy_intp nx, ny
+
+    ny, nx = _image_shape(img_or_shape)
+    ny_nx[0] = ny
+    ny_nx[1] = nx
+
+    la = c_numpy.PyArray_EMPTY(2, ny_nx, c_numpy.NPY_INT32, 0)
+    memset(c_numpy.PyArray_DATA(la), 0xff, nx*ny*sizeof(npy_int32)) # -1
+
+    if excludes is None:
+        excludes = [False] * len(regions)
+    elif len(excludes) != len(regions):
+        raise ValueError("regions and excludes must have the same length")
+
+    nthreads = _get_nthreads(nthreads)
+    if nthreads > ny//_TILE_ROWS + 1:
+        nthreads = ny//_TILE_ROWS + 1
+
+    if nthreads > 1:
+        _run_in_threads(lambda i: _label_tiles(regions, la, excludes,
+                                               i, nthreads),
+                        nthreads)
+    else:
+        _label_tiles(regions, la, excludes, 0, 1)
+
+    return la
+
+
 # cdef class RegionAnd_OLD(RegionBase):
 #     cdef RegionBase child_region1
 #     cdef RegionBase child_region2
@@ -535,11 +1635,11 @@ cdef class Transform(RegionBase):
         #    del self.child_region
 
 
-    cdef int _transform(self, double x, double y, double *xp, double *yp):
+    cdef int _transform(self, double x, double y, double *xp, double *yp) noexcept nogil:
         xp[0] = x
         yp[0] = y
 
-    cdef npy_bool _inside(self, double x, double y):
+    cdef npy_bool _inside(self, double x, double y) noexcept nogil:
         cdef double xp, yp
         cdef npy_bool r
 
@@ -548,13 +1648,31 @@ cdef class Transform(RegionBase):
 
         return r
 
+    cdef npy_bool _bbox(self, BBox *b) noexcept nogil:
+        return self.child_region._bbox(b)
+
+    cdef void _transform_affine(self, Affine *t, Affine *t2) noexcept nogil:
+        # set t2 to the composition of t and _transform
+        t2[0] = t[0]
 
-cdef extern from "math.h":
+    cdef int _spans(self, double y, Affine *t, Spans *s) noexcept nogil:
+        cdef Affine t2
+
+        self._transform_affine(t, &t2)
+        return self.child_region._spans(y, &t2, s)
+
+
+cdef extern from "math.h" nogil:
     double sin(double)
     double cos(double)
     double atan2(double, double)
     double fmod(double, double)
+    double floor(double)
+    double ceil(double)
+    double fabs(double)
+    double sqrt(double)
     double M_PI
+    double HUGE_VAL
 
 
 cdef class Rotated(Transform):
@@ -581,11 +1699,17 @@ cdef class Rotated(Transform):
         self.sin_theta = sin(theta)
         self.cos_theta = cos(theta)
 
+        # exact values for multiples of 90 degree, so that edges on
+        # pixel centers are not subject to rounding errors.
+        if fmod(degree, 90.) == 0.:
+            self.sin_theta = floor(self.sin_theta + 0.5)
+            self.cos_theta = floor(self.cos_theta + 0.5)
+
         self.origin_x = origin_x
         self.origin_y = origin_y
 
 
-    cdef int _transform(self, double x, double y, double *xp, double *yp):
+    cdef int _transform(self, double x, double y, double *xp, double *yp) noexcept nogil:
         cdef double x1, x2, y1, y2
         cdef double st, ct, ox, oy
 
@@ -603,6 +1727,61 @@ cdef class Rotated(Transform):
         xp[0] = x2 + ox
         yp[0] = y2 + oy
 
+    cdef npy_bool _bbox(self, BBox *b) noexcept nogil:
+        cdef npy_bool outside
+        cdef double st, ct, ox, oy
+        cdef double cx[4]
+        cdef double cy[4]
+        cdef double dx, dy, x, y
+        cdef int i
+
+        outside = self.child_region._bbox(b)
+        if bbox_is_empty(b) or not bbox_is_finite(b):
+            return outside
+
+        st = self.sin_theta
+        ct = self.cos_theta
+        ox = self.origin_x
+        oy = self.origin_y
+
+        cx[0], cy[0] = b.x1, b.y1
+        cx[1], cy[1] = b.x2, b.y1
+        cx[2], cy[2] = b.x2, b.y2
+        cx[3], cy[3] = b.x1, b.y2
+
+        # corners of the child box, rotated in the opposite direction
+        # of _transform.
+        bbox_set_empty(b)
+        for i from 0 <= i < 4:
+            dx = cx[i] - ox
+            dy = cy[i] - oy
+            x = ct*dx - st*dy + ox
+            y = st*dx + ct*dy + oy
+            if x < b.x1: b.x1 = x
+            if x > b.x2: b.x2 = x
+            if y < b.y1: b.y1 = y
+            if y > b.y2: b.y2 = y
+
+        return outside
+
+    cdef void _transform_affine(self, Affine *t, Affine *t2) noexcept nogil:
+        cdef double st, ct, ox, oy, b1, b2
+
+        st = self.sin_theta
+        ct = self.cos_theta
+        ox = self.origin_x
+        oy = self.origin_y
+
+        t2.a11 =  ct*t.a11 + st*t.a21
+        t2.a12 =  ct*t.a12 + st*t.a22
+        t2.a21 = -st*t.a11 + ct*t.a21
+        t2.a22 = -st*t.a12 + ct*t.a22
+
+        b1 = t.b1 - ox
+        b2 = t.b2 - oy
+        t2.b1 =  ct*b1 + st*b2 + ox
+        t2.b2 = -st*b1 + ct*b2 + oy
+
 
 cdef class Translated(Transform):
     """
@@ -623,10 +1802,24 @@ cdef class Translated(Transform):
         self.dx = dx
         self.dy = dy
 
-    cdef int _transform(self, double x, double y, double *xp, double *yp):
+    cdef int _transform(self, double x, double y, double *xp, double *yp) noexcept nogil:
         xp[0] = x - self.dx
         yp[0] = y - self.dy
 
+    cdef npy_bool _bbox(self, BBox *b) noexcept nogil:
+        cdef npy_bool outside
+
+        outside = self.child_region._bbox(b)
+        if not bbox_is_empty(b):
+            bbox_set(b, b.x1 + self.dx, b.y1 + self.dy,
+                     b.x2 + self.dx, b.y2 + self.dy)
+        return outside
+
+    cdef void _transform_affine(self, Affine *t, Affine *t2) noexcept nogil:
+        t2[0] = t[0]
+        t2.b1 = t.b1 - self.dx
+        t2.b2 = t.b2 - self.dy
+
 
 
 
@@ -669,12 +1862,29 @@ cdef class Circle(RegionBase):
         self._set_v(xc, yc, radius)
 
 
-    cdef npy_bool _inside(self, double x, double y):
+    cdef npy_bool _inside(self, double x, double y) noexcept nogil:
         cdef double dist2
 
         dist2 = ((x-self.xc)*self.m.g_x)**2 + ((y-self.yc)*self.m.g_y)**2
         return (dist2 <= self.radius2)
 
+    cdef npy_bool _bbox(self, BBox *b) noexcept nogil:
+        cdef double dx, dy
+
+        bbox_set_infinite(b)
+        if self.m.g_x != 0.:
+            dx = fabs(self.radius/self.m.g_x)
+            b.x1, b.x2 = self.xc - dx, self.xc + dx
+        if self.m.g_y != 0.:
+            dy = fabs(self.radius/self.m.g_y)
+            b.y1, b.y2 = self.yc - dy, self.yc + dy
+        return 0
+
+    cdef int _spans(self, double y, Affine *t, Spans *s) noexcept nogil:
+        return _weighted_disk_spans(t, y, self.xc, self.yc,
+                                    self.m.g_x**2, self.m.g_y**2,
+                                    self.radius2, s)
+
     def __repr__(self):
         return "Circle(%f, %f, %f)" % (self.xc, self.yc, self.radius)
 
@@ -717,12 +1927,25 @@ cdef class Ellipse(RegionBase):
         #MetricInit(&(self.m), xc, yc)
 
 
-    cdef npy_bool _inside(self, double x, double y):
+    cdef npy_bool _inside(self, double x, double y) noexcept nogil:
         cdef double dist2
 
         dist2 = self.radius_minor_2*(x-self.xc)**2 + self.radius_major_2*(y-self.yc)**2
         return (dist2 <= self.radius_major_2_radius_minor_2)
 
+    cdef npy_bool _bbox(self, BBox *b) noexcept nogil:
+        cdef double dx, dy
+
+        dx = fabs(self.radius_major)
+        dy = fabs(self.radius_minor)
+        bbox_set(b, self.xc - dx, self.yc - dy, self.xc + dx, self.yc + dy)
+        return 0
+
+    cdef int _spans(self, double y, Affine *t, Spans *s) noexcept nogil:
+        return _weighted_disk_spans(t, y, self.xc, self.yc,
+                                    self.radius_minor_2, self.radius_major_2,
+                                    self.radius_major_2_radius_minor_2, s)
+
     def __repr__(self):
         return "Ellipse(%f, %f, %f, %f)" % (self.xc, self.yc, self.radius_major, self.radius_minor)
 
@@ -758,9 +1981,30 @@ cdef class Box(RegionBase):
         #MetricInit(&(self.m), xc, yc)
 
 
-    cdef npy_bool _inside(self, double x, double y):
+    cdef npy_bool _inside(self, double x, double y) noexcept nogil:
         return (self.x1 <= x) & (x <= self.x2) & (self.y1 <= y) & (y <= self.y2)
 
+    cdef npy_bool _bbox(self, BBox *b) noexcept nogil:
+        bbox_set(b, self.x1, self.y1, self.x2, self.y2)
+        return 0
+
+    cdef int _spans(self, double y, Affine *t, Spans *s) noexcept nogil:
+        cdef double x1, x2, x3, x4
+
+        s.n = 0
+        if not _linear_range(t.a11, t.a12*y + t.b1, self.x1, self.x2,
+                             &x1, &x2):
+            return 1
+        if not _linear_range(t.a21, t.a22*y + t.b2, self.y1, self.y2,
+                             &x3, &x4):
+            return 1
+        if x3 > x1: x1 = x3
+        if x4 < x2: x2 = x4
+        if x1 <= x2:
+            if spans_append(s, x1, x2) < 0:
+                return -1
+        return 1
+
 
 
 cdef class Polygon(RegionBase):
@@ -794,7 +2038,7 @@ cdef class Polygon(RegionBase):
         self.metric_set_origin(self.x[0], self.y[0], c)
         #MetricInit(&(self.m), )
 
-    cdef npy_bool _inside(self, double x, double y):
+    cdef npy_bool _inside(self, double x, double y) noexcept nogil:
         cdef int i, j
         cdef npy_bool r
         cdef double *xp
@@ -840,6 +2084,83 @@ cdef class Polygon(RegionBase):
 
         return r
 
+    cdef npy_bool _bbox(self, BBox *b) noexcept nogil:
+        cdef int i
+
+        bbox_set_empty(b)
+        for i from 0 <= i < self.n:
+            if self.x[i] < b.x1: b.x1 = self.x[i]
+            if self.x[i] > b.x2: b.x2 = self.x[i]
+            if self.y[i] < b.y1: b.y1 = self.y[i]
+            if self.y[i] > b.y2: b.y2 = self.y[i]
+        return 0
+
+    cdef int _spans(self, double y, Affine *t, Spans *s) noexcept nogil:
+        cdef int i, j, r
+        cdef double *xp
+        cdef double *yp
+        cdef double det, dx, dy
+        cdef double y_yp_i, y_yp_j
+        cdef Spans c
+
+        s.n = 0
+        if self.n == 0:
+            return 1
+
+        if affine_is_identity(t):
+            xp = self.x
+            yp = self.y
+        else:
+            # vertices in the image coordinate
+            det = t.a11*t.a22 - t.a12*t.a21
+            if det == 0.:
+                return spans_set_full(s)
+            xp = <double *> malloc(2*self.n*sizeof(double))
+            if xp == NULL:
+                return -1
+            yp = xp + self.n
+            for i from 0 <= i < self.n:
+                dx = self.x[i] - t.b1
+                dy = self.y[i] - t.b2
+                xp[i] = ( t.a22*dx - t.a12*dy)/det
+                yp[i] = (-t.a21*dx + t.a11*dy)/det
+
+        # same edge rules as in _inside : pairs of crossings bound the
+        # interior, and horizontal edges along the row are inside.
+        spans_init(&c)
+        r = 1
+        j = self.n - 1
+        for i from 0 <= i < self.n:
+            y_yp_i = y - yp[i]
+            y_yp_j = y - yp[j]
+
+            if (y_yp_i == 0.) & (y_yp_j == 0.):
+                if xp[i] < xp[j]:
+                    r = spans_append(s, xp[i], xp[j])
+                else:
+                    r = spans_append(s, xp[j], xp[i])
+
+            if ((0<=y_yp_i) & (0>y_yp_j) | (0<=y_yp_j) & (0>y_yp_i)):
+                r = spans_append(&c, xp[i]+y_yp_i/(yp[j]-yp[i])*(xp[j]-xp[i]), 0.)
+            if r < 0:
+                break
+            j=i
+
+        if r >= 0:
+            qsort(c.x, c.n, 2*sizeof(double), _cmp_span)
+            for i from 0 <= i < c.n//2:
+                r = spans_append(s, c.x[4*i], c.x[4*i+2])
+                if r < 0:
+                    break
+            spans_normalize(s)
+
+        spans_free(&c)
+        if xp != self.x:
+            free(xp)
+        if r < 0:
+            return -1
+        return 1
+
 
 cdef class AngleRange(RegionBase):
     """
@@ -873,14 +2194,14 @@ cdef class AngleRange(RegionBase):
         self.metric_set_origin(xc, yc, c)
 
 
-    cdef double _fix_angle(self, double a):
+    cdef double _fix_angle(self, double a) noexcept nogil:
         if a > self.radian1:
             return self.radian1 + fmod((a-self.radian1), 2*M_PI)
         else:
             return self.radian1 + 2.*M_PI - fmod((self.radian1-a), 2*M_PI)
         
 
-    cdef npy_bool _inside(self, double x, double y):
+    cdef npy_bool _inside(self, double x, double y) noexcept nogil:
         cdef double dx, dy, theta
 
         dx = x - self.xc
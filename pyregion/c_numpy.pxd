@@ -26,6 +26,7 @@ cdef extern from "numpy/arrayobject.h":
         NPY_VOID
         NPY_NTYPES
         NPY_NOTYPE
+        NPY_INT32
 
     cdef enum requirements:
         NPY_CONTIGUOUS
@@ -75,6 +76,8 @@ cdef extern from "numpy/arrayobject.h":
 
     ctypedef short npy_bool 
 
+    ctypedef int npy_int32
+
     ctypedef extern class numpy.dtype [object PyArray_Descr]:
         cdef int type_num, elsize, alignment
         cdef char type, kind, byteorder, hasobject
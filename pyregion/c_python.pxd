@@ -24,8 +24,8 @@ cdef extern from "Python.h":
     ctypedef struct PyListObject:
         void *ob_item
     
-    void * PyList_GET_ITEM(PyListObject *o, int i)
-    int    PyList_GET_SIZE(PyListObject *o)
+    void * PyList_GET_ITEM(PyListObject *o, int i) nogil
+    int    PyList_GET_SIZE(PyListObject *o) nogil
 
     int    PySequence_Check(object o)
     object PySequence_GetItem(object o, int i)
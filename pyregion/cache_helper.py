@@ -0,0 +1,50 @@
+"""
+A small LRU cache, shared by the caches of the parsers and of the WCS
+helpers.
+"""
+
+import threading
+from collections import OrderedDict
+
+
+class _LRUCache(object):
+    """
+    A simple thread-safe LRU cache, with hit/miss counters.
+    """
+    def __init__(self, maxsize):
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self._d = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._d)
+
+    def get(self, key, default=None):
+        with self._lock:
+            try:
+                v = self._d.pop(key)
+            except KeyError:
+                self.misses += 1
+                return default
+            self._d[key] = v
+            self.hits += 1
+            return v
+
+    def put(self, key, value):
+        with self._lock:
+            self._d.pop(key, None)
+            self._d[key] = value
+            while len(self._d) > self.maxsize:
+                self._d.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._d.clear()
+            self.hits = 0
+            self.misses = 0
+
+    def info(self):
+        return dict(hits=self.hits, misses=self.misses,
+                    maxsize=self.maxsize, currsize=len(self._d))
@@ -1,10 +1,40 @@
 from itertools import cycle
 
-from .ds9_region_parser import RegionParser
+import numpy as np
+
+from .ds9_region_parser import RegionParser, ds9_shape_defs, \
+     ds9_coord_command_keys, check_arg_count, _no_attr
+from .parser_helper import Shape
+from .shape_table import ShapeTable
+from .region_writer import write_region
 from .wcs_converter import check_wcs as _check_wcs
 
 _builtin_open = open
 
+
+def _make_shape(name, coord_list, coord_format, exclude=False):
+    # a shape whose coordinates are known, as check_wcs returns
+    shape = Shape(name, coord_list)
+    shape.coord_list = coord_list
+    shape.coord_format = coord_format
+    shape.exclude = bool(exclude)
+    shape.attr = _no_attr
+    return shape
+
+
+def _check_coord_format(coord_format):
+    coord_format = coord_format.lower()
+    if coord_format not in [k.lower() for k in ds9_coord_command_keys]:
+        raise ValueError("unknown coordinate format '%s'" % (coord_format,))
+    return coord_format
+
+
+def _exclude_list(exclude, n):
+    if exclude is None:
+        return [False] * n
+    return np.broadcast_to(np.asarray(exclude, dtype=bool), (n,)).tolist()
+
+
 class ShapeList(list):
     """ A list of shape objects """
     def __init__(self, shape_list, comment_list=None):
@@ -26,6 +56,81 @@ class ShapeList(list):
         self._comment_list = comment_list
         list.__init__(self, shape_list)
 
+    @classmethod
+    def from_arrays(cls, name, *args, **kwargs):
+        """
+        Creates a list of shapes of the same type from arrays of their
+        coordinates, one array (or scalar) for each argument of the
+        shape, without formatting and parsing a region string.
+
+        ShapeList.from_arrays("circle", x, y, r, coord_format="fk5")
+        ShapeList.from_arrays("box", x, y, w, h, angle,
+                              coord_format="image", exclude=mask)
+
+        Coordinates and distances are in the units of coord_list,
+        i.e., degrees for sky coordinates. exclude is None, a bool, or
+        a bool array.
+        """
+        coord_format = kwargs.pop("coord_format", "fk5")
+        exclude = kwargs.pop("exclude", None)
+        if kwargs:
+            raise TypeError("unexpected keyword arguments: %s" % \
+                            ", ".join(kwargs))
+
+        if name not in ds9_shape_defs:
+            raise ValueError("unknown shape name '%s'" % (name,))
+        if not check_arg_count(ds9_shape_defs[name], len(args)):
+            raise ValueError("wrong number of arguments (%d) for '%s'" % \
+                             (len(args), name))
+
+        coord_format = _check_coord_format(coord_format)
+
+        arrays = np.broadcast_arrays(*[np.asarray(a, dtype=float) for a in args])
+        if arrays[0].ndim > 1:
+            raise ValueError("arguments must be 1-d arrays or scalars")
+        n = arrays[0].size
+
+        coord_lists = np.column_stack(arrays).reshape(n, len(args)).tolist()
+
+        return cls([_make_shape(name, cl, coord_format, e)
+                    for cl, e in zip(coord_lists, _exclude_list(exclude, n))])
+
+    @classmethod
+    def from_polygons(cls, vertices, coord_format="fk5", exclude=None):
+        """
+        Creates a list of polygons from a sequence of vertex arrays,
+        each of shape (m, 2), or a flat array of x1, y1, x2, y2, ...
+
+        ShapeList.from_polygons([[(0, 0), (10, 0), (5, 8)], ...],
+                                coord_format="image")
+
+        See from_arrays for coord_format and exclude.
+        """
+        coord_format = _check_coord_format(coord_format)
+
+        coord_lists = []
+        for v in vertices:
+            cl = np.asarray(v, dtype=float).ravel()
+            if len(cl) < 2 or len(cl) % 2:
+                raise ValueError("a polygon needs pairs of coordinates")
+            coord_lists.append(cl.tolist())
+
+        excl = _exclude_list(exclude, len(coord_lists))
+        return cls([_make_shape("polygon", cl, coord_format, e)
+                    for cl, e in zip(coord_lists, excl)])
+
+    def to_arrays(self):
+        """
+        Returns the coordinates of the shapes as NumPy arrays grouped
+        by the shape name, with the index of each shape in the list.
+        See ShapeTable.to_arrays.
+
+        a = r.as_imagecoord(header).to_arrays()
+        c = a["circle"]
+        r[c["index"][0]] # the shape at c["x"][0], c["y"][0]
+        """
+        return ShapeTable.from_shapelist(self).to_arrays()
+
     def __getitem__(self, key):
         if isinstance(key, slice):
             return ShapeList(list.__getitem__(self, key))
@@ -99,13 +204,22 @@ class ShapeList(list):
         return region_filter
 
 
-    def get_mask(self, hdu=None, header=None, shape=None, rot_wrt_axis=1):
+    def get_mask(self, hdu=None, header=None, shape=None, rot_wrt_axis=1,
+                 format="dense", nthreads=1):
         """
         creates a 2-d mask.
 
         get_mask(hdu=f[0])
         get_mask(shape=(10,10))
         get_mask(header=f[0].header, shape=(10,10))
+
+        With format="slices", a sparse mask
+        (pyregion.mask_helper.SpanMask) is returned instead of the
+        dense array. With format="packed", a bit-packed mask (see
+        RegionBase.mask) is returned.
+
+        With nthreads > 1, the mask is filled in parallel threads.
+        nthreads=None (or 0) uses all the cpus.
         """
 
         if hdu and header is None:
@@ -114,83 +228,209 @@ class ShapeList(list):
             shape = hdu.data.shape
 
         region_filter = self.get_filter(header=header, rot_wrt_axis=rot_wrt_axis)
-        mask = region_filter.mask(shape)
+        mask = region_filter.mask(shape, format=format, nthreads=nthreads)
 
         return mask
 
 
-    def write(self, outfile):
-        """ Writes the current shape list out as a region file """
-        if len(self) < 1:
-            print("WARNING: The region list is empty. The region file "\
-                  "'{:s}' will be empty.".format(outfile))
-            try:
-                outf = open(outfile,'w')
-                outf.close()
-                return
-            except IOError as e:
-                cmsg = "Unable to create region file '{:s}'.".format(outfile)
-                if e.args:
-                    e.args = (e.args[0] + '\n' + cmsg,) + e.args[1:]
-                else:
-                    e.args=(cmsg,)
-                raise e
-
-        prev_cs = self[0].coord_format
-
-        outf = None
-        try:
-            outf = _builtin_open(outfile,'w')
+    def get_fractional_mask(self, shape=None, header=None, hdu=None,
+                            subsample=5, rot_wrt_axis=1):
+        """
+        creates a 2-d float32 image of the fraction of each pixel
+        covered by the region.
 
-            attr0 = self[0].attr[1]
-            defaultline = " ".join( [ "{:s}={:s}".format(a,attr0[a]) \
-                                      for a in attr0 if a != 'text' ] )
+        get_fractional_mask(shape=(10,10))
+        get_fractional_mask((10,10), header=f[0].header, subsample=8)
+        get_fractional_mask(hdu=f[0])
 
-            # first line is globals
-            print >>outf, "global", defaultline
-            # second line must be a coordinate format
-            print >>outf, prev_cs
+        Each pixel is sampled on a grid of subsample x subsample
+        points, but only the pixels on the boundary of the region are
+        actually sampled; interior pixels are 1.0 and exterior ones
+        0.0. With subsample=1, the result is identical to get_mask.
+        """
 
-            for shape in self:
-                shape_attr = '' if prev_cs == shape.coord_format \
-                    else shape.coord_format+"; "
-                shape_excl = '-' if shape.exclude else ''
-                text_coordlist = [ "{:f}".format(f) for f in shape.coord_list ]
-                shape_coords = "(" + ",".join(text_coordlist) + ")"
-                shape_comment = " # " + shape.comment if shape.comment else ''
+        if hdu and header is None:
+            header = hdu.header
+        if hdu and shape is None:
+            shape = hdu.data.shape
+
+        region_filter = self.get_filter(header=header, rot_wrt_axis=rot_wrt_axis)
+
+        return region_filter.fractional_mask(shape, subsample=subsample)
 
-                shape_str = shape_attr + shape_excl + shape.name + \
-                            shape_coords + shape_comment
 
-                print >>outf, shape_str
+    def get_label_image(self, shape=None, header=None, hdu=None,
+                        rot_wrt_axis=1, nthreads=1):
+        """
+        creates a 2-d int32 image whose pixel value is the index (in
+        this list) of the shape covering the pixel, or -1.
+
+        get_label_image(shape=(10,10))
+        get_label_image((10,10), header=f[0].header)
+        get_label_image(hdu=f[0])
+
+        The shapes are rendered in order, each within its bounding
+        box, in a single pass over the list. Where shapes overlap,
+        the later one wins. An exclude shape resets the pixels it
+        covers to -1, so that (label_image >= 0) is identical to the
+        mask from get_mask. Shapes which have no filter (e.g.,
+        composite) do not appear in the image. See get_mask for
+        nthreads.
+        """
 
+        from .region_to_filter import as_region_filter_list
+        from ._region_filter import label_image
+
+        if hdu and header is None:
+            header = hdu.header
+        if hdu and shape is None:
+            shape = hdu.data.shape
+
+        if header is None:
+            if not self.check_imagecoord():
+                raise RuntimeError("the region has non-image coordinate. header is required.")
+            reg_in_imagecoord = self
+        else:
+            reg_in_imagecoord = self.as_imagecoord(header, rot_wrt_axis=rot_wrt_axis)
+
+        filter_list = as_region_filter_list(reg_in_imagecoord, origin=1)
+        excludes = [s.exclude for s in reg_in_imagecoord]
+
+        return label_image(filter_list, shape, excludes=excludes,
+                           nthreads=nthreads)
+
+
+    def write(self, outfile, precision=6, sexagesimal=False):
+        """
+        Writes the current shape list out as a region file. outfile is
+        a file name or a file object. See write_region.
+        """
+        name = getattr(outfile, "name", outfile)
+        if len(self) < 1:
+            print("WARNING: The region list is empty. The region file "\
+                  "'{}' will be empty.".format(name))
+
+        try:
+            write_region(self, outfile, precision=precision,
+                         sexagesimal=sexagesimal)
         except IOError as e:
-            cmsg = "Unable to create region file \'{:s}\'.".format(outfile)
+            cmsg = "Unable to create region file \'{}\'.".format(name)
             if e.args:
                 e.args = (e.args[0] + '\n' + cmsg,) + e.args[1:]
             else:
                 e.args=(cmsg,)
             raise e
-        finally:
-            if outf: outf.close()
 
 
-def parse(region_string):
+def parse(region_string, attributes=True):
     """
     Parse the input string of a ds9 region definition.
     Returns a list of Shape instances.
+
+    With attributes=False, the attributes (color, font, tag, etc.) are
+    not parsed and the shapes have empty attributes. The geometry,
+    the exclude flags and the coordinate systems are unchanged.
     """
     rp = RegionParser()
     ss = rp.parse(region_string)
-    sss1 = rp.convert_attr(ss)
+    sss1 = rp.convert_attr(ss, attributes=attributes)
     sss2 = _check_wcs(sss1)
 
     shape_list, comment_list = rp.filter_shape2(sss2)
     return ShapeList(shape_list, comment_list=comment_list)
 
-def open(fname):
+def open(fname, workers=None, attributes=True):
+    """
+    Reads and parses a region file. With workers > 1, the lines are
+    split into chunks which are parsed in a pool of that many
+    processes. The global attributes and the coordinate system in
+    effect at the start of each chunk are found beforehand, so the
+    result is identical to the serial one.
+
+    See parse for attributes.
+    """
     region_string = _builtin_open(fname).read()
-    return parse(region_string)
+    if workers is None or workers <= 1:
+        return parse(region_string, attributes=attributes)
+
+    return _parse_parallel(region_string.split("\n"), workers,
+                           attributes=attributes)
+
+
+# number of chunks per worker in _parse_parallel
+_chunks_per_worker = 4
+
+def _parse_chunk(args):
+    lines, global_attr, default_coord, attributes = args
+
+    rp = RegionParser()
+    ss = rp.parse_lines(lines)
+    sss1 = rp.convert_attr(ss, global_attr=global_attr,
+                           attributes=attributes)
+    sss2 = _check_wcs(sss1, default_coord=default_coord)
+
+    return [s1 for s1 in sss2 if isinstance(s1[0], Shape)]
+
+
+def _parse_parallel(lines, workers, attributes=True):
+    import multiprocessing
+
+    n = -(-len(lines) // (workers * _chunks_per_worker))
+
+    rp = RegionParser()
+    global_attr, default_coord = ([], {}), "physical"
+    tasks = []
+    for i in range(0, len(lines), n):
+        chunk = lines[i:i+n]
+        tasks.append((chunk, global_attr, default_coord, attributes))
+        global_attr, default_coord = rp.scan_state(chunk, global_attr,
+                                                   default_coord)
+
+    pool = multiprocessing.Pool(workers)
+    try:
+        results = pool.map(_parse_chunk, tasks)
+    finally:
+        pool.close()
+        pool.join()
+
+    r = [s1 for rr in results for s1 in rr]
+    if not r:
+        return ShapeList([], comment_list=[])
+    shape_list, comment_list = zip(*r)
+    return ShapeList(shape_list, comment_list=comment_list)
+
+
+def iter_shapes(file_or_path, header=None, rot_wrt_axis=1, attributes=True):
+    """
+    Iterates over the shapes of a region file, reading it line by
+    line. file_or_path is a file name or a file-like object. The
+    global attributes and the coordinate system are carried over from
+    line to line as in parse, so the shapes are identical to those of
+    open(fname).
+
+    If header is given, the shapes are converted to the image
+    coordinate (in batches of a few thousand shapes). See parse for
+    attributes.
+    """
+    if hasattr(file_or_path, "read"):
+        f, close = file_or_path, False
+    else:
+        f, close = _builtin_open(file_or_path), True
+
+    try:
+        rp = RegionParser()
+        ss = rp.parse_lines(f)
+        sss1 = rp.convert_attr(ss, attributes=attributes)
+        sss2 = _check_wcs(sss1)
+        if header is not None:
+            sss2 = rp.sky_to_image(sss2, header, rot_wrt_axis=rot_wrt_axis)
+
+        for s, c in sss2:
+            if isinstance(s, Shape):
+                yield s
+    finally:
+        if close:
+            f.close()
 
 
 # def parse_deprecated(region_string):
@@ -1,4 +1,15 @@
 import copy
+import threading
+
+try:
+    from sys import intern
+except ImportError:
+    pass # a builtin in Python 2
+
+try:
+    from collections.abc import Mapping, Sequence
+except ImportError:
+    from collections import Mapping, Sequence
 
 from pyparsing import Literal, CaselessKeyword, CaselessLiteral, \
      Word, Optional, OneOrMore, Group, Combine, ZeroOrMore, nums, \
@@ -7,6 +18,8 @@ from pyparsing import Literal, CaselessKeyword, CaselessLiteral, \
 
 from .region_numbers import CoordOdd, CoordEven, Distance, Angle
 
+from .cache_helper import _LRUCache
+
 from .parser_helper import as_comma_separated_list, wcs_shape, \
      define_shape, define_shape_helper, define_expr, define_line, \
      comment_shell_like, define_simple_literals, \
@@ -29,48 +42,238 @@ def get_ds9_attr_parser():
 
     return ZeroOrMore(expr)
 
-class Ds9AttrParser(object):
-    def set_continued(self, s, l, tok):
-        self.continued = True
+# shapes which are defined in the comment, e.g., "# text(10, 10)"
+ds9_shape_in_comment_defs = dict(text=wcs_shape(CoordOdd, CoordEven),
+                                 vector=wcs_shape(CoordOdd, CoordEven,
+                                                  Distance, Angle),
+                                 composite=wcs_shape(CoordOdd, CoordEven, Angle),
+                                 projection=wcs_shape(CoordOdd, CoordEven, CoordOdd, CoordEven, Distance),
+                                 segment=wcs_shape(CoordOdd, CoordEven,
+                                                   repeat=(0,2)),
+                                 )
+
+class _ContinuedMark(object):
+    # token for the "||" after a shape in the comment
+    pass
+
+_continued_mark = _ContinuedMark()
+
+
+def define_ds9_attr_grammars():
+    """
+    Returns a tuple of new pyparsing grammars (parser_default,
+    parser_with_shape). The parse actions keep no state.
+    """
+
+    ds9_attr_parser = get_ds9_attr_parser()
+
+    regionShape = define_shape_helper(ds9_shape_in_comment_defs)
+    regionShape = regionShape.setParseAction(lambda s, l, tok: Shape(tok[0], tok[1:]))
+
+    cont = CaselessKeyword("||").setParseAction(lambda s, l, tok: _continued_mark)
+    line = Optional(And([regionShape,
+                         Optional(cont)])) \
+                         + ds9_attr_parser
+
+    return ds9_attr_parser, line
 
-    def __init__(self):
-        self.continued = False
 
-        ds9_attr_parser = get_ds9_attr_parser()
+# The grammars are built once per process, on first use, and shared.
+_ds9_attr_grammars = None
+_ds9_attr_grammars_lock = threading.Lock()
 
-        ds9_shape_in_comment_defs = dict(text=wcs_shape(CoordOdd, CoordEven),
-                                         vector=wcs_shape(CoordOdd, CoordEven,
-                                                          Distance, Angle),
-                                         composite=wcs_shape(CoordOdd, CoordEven, Angle),
-                                         projection=wcs_shape(CoordOdd, CoordEven, CoordOdd, CoordEven, Distance),
-                                         segment=wcs_shape(CoordOdd, CoordEven,
-                                                           repeat=(0,2)),
-                                         )
-        regionShape = define_shape_helper(ds9_shape_in_comment_defs)
-        regionShape = regionShape.setParseAction(lambda s, l, tok: Shape(tok[0], tok[1:]))
+def get_ds9_attr_grammars():
+    global _ds9_attr_grammars
+    if _ds9_attr_grammars is None:
+        with _ds9_attr_grammars_lock:
+            if _ds9_attr_grammars is None:
+                _ds9_attr_grammars = define_ds9_attr_grammars()
+    return _ds9_attr_grammars
 
 
-        self.parser_default = ds9_attr_parser
+# The parsed attribute strings are cached, as many lines of a region
+# file usually have the same comment. The cached values are tuples
+# (and a Shape which is copied before it is returned).
+_parse_default_cache = _LRUCache(1024)
+_parse_check_shape_cache = _LRUCache(1024)
 
-        cont = CaselessKeyword("||").setParseAction(self.set_continued).suppress()
-        line = Optional(And([regionShape,
-                             Optional(cont)])) \
-                             + ds9_attr_parser
 
-        self.parser_with_shape = line
+def attr_cache_info():
+    """
+    Returns the statistics (hits, misses, maxsize, currsize) of the
+    caches of Ds9AttrParser.
+    """
+    return dict(parse_default=_parse_default_cache.info(),
+                parse_check_shape=_parse_check_shape_cache.info())
+
+
+def set_attr_cache_size(maxsize):
+    _parse_default_cache.maxsize = maxsize
+    _parse_check_shape_cache.maxsize = maxsize
 
 
+def clear_attr_cache():
+    _parse_default_cache.clear()
+    _parse_check_shape_cache.clear()
+
+
+class Ds9AttrParser(object):
+
+    def __init__(self):
+        self.parser_default, self.parser_with_shape = get_ds9_attr_grammars()
+
     def parse_default(self, s):
-        return self.parser_default.parseString(s)
+        """
+        Returns a tuple of (keyword, value...) tuples.
+        """
+        r = _parse_default_cache.get(s)
+        if r is None:
+            r = tuple(self.parser_default.parseString(s))
+            _parse_default_cache.put(s, r)
+        return r
 
     def parse_check_shape(self, s):
+        """
+        Returns a tuple of the shape in the string (None if no shape)
+        and the list of attributes.
+        """
+        r = _parse_check_shape_cache.get(s)
+        if r is None:
+            r = self._parse_check_shape(s)
+            _parse_check_shape_cache.put(s, r)
+
+        shape, attr_list = r
+        if shape is not None:
+            shape = copy.copy(shape)
+            shape.params = list(shape.params)
+        return shape, list(attr_list)
+
+    def _parse_check_shape(self, s):
         l = self.parser_with_shape.parseString(s)
         if l and isinstance(l[0], Shape):
-            if self.continued:
+            attr_list = list(l[1:])
+            if attr_list and attr_list[0] is _continued_mark:
                 l[0].continued = True
-            return l[0], l[1:]
+                del attr_list[0]
+            return l[0], tuple(attr_list)
+        else:
+            return None, tuple(l)
+
+class AttrList(Sequence):
+    """
+    A read-only list of attribute flags (e.g., "source", "background"),
+    which can be shared by many shapes. copy.copy returns a plain list.
+    """
+    __slots__ = ("_items",)
+
+    def __init__(self, items=()):
+        self._items = tuple(items)
+
+    def __getitem__(self, i):
+        return self._items[i]
+
+    def __len__(self):
+        return len(self._items)
+
+    def __eq__(self, other):
+        if isinstance(other, (AttrList, list, tuple)):
+            return list(self._items) == list(other)
+        return NotImplemented
+
+    def __ne__(self, other):
+        r = self.__eq__(other)
+        return r if r is NotImplemented else not r
+
+    __hash__ = None
+
+    def __copy__(self):
+        return list(self._items)
+
+    def __repr__(self):
+        return repr(list(self._items))
+
+
+class AttrDict(Mapping):
+    """
+    A read-only dict of attributes, which is layered over the
+    attributes of its parent (usually the global attributes). Only the
+    local attributes are stored, and the parent is shared by many
+    shapes. copy.copy returns a plain dict, with the tag as a set.
+    """
+    __slots__ = ("_local", "_parent")
+
+    def __init__(self, local=None, parent=None):
+        self._local = local if local is not None else {}
+        self._parent = parent
+
+    @property
+    def parent(self):
+        """ the attributes this dict is layered over, or None """
+        return self._parent
+
+    def __getitem__(self, k):
+        try:
+            return self._local[k]
+        except KeyError:
+            if self._parent is None:
+                raise
+            return self._parent[k]
+
+    def __contains__(self, k):
+        return k in self._local or \
+               (self._parent is not None and k in self._parent)
+
+    def __iter__(self):
+        if self._parent is not None:
+            for k in self._parent:
+                yield k
+            for k in self._local:
+                if k not in self._parent:
+                    yield k
         else:
-            return None, l
+            for k in self._local:
+                yield k
+
+    def __len__(self):
+        if self._parent is None:
+            return len(self._local)
+        return len(self._parent) + \
+               len([k for k in self._local if k not in self._parent])
+
+    def __copy__(self):
+        d = dict(self.items())
+        if "tag" in d:
+            d["tag"] = set(d["tag"])
+        return d
+
+    def __repr__(self):
+        return repr(dict(self.items()))
+
+
+def _intern(v):
+    if isinstance(v, str):
+        return intern(v)
+    return v
+
+
+def as_attr_views(attrs):
+    """
+    Returns a tuple of (AttrList, AttrDict) of attrs, a tuple of a
+    list of flags and a dict of attributes. The tag attribute, a set,
+    becomes a frozenset.
+    """
+    attr0, attr1 = attrs
+    if not isinstance(attr0, AttrList):
+        attr0 = AttrList([_intern(a) for a in attr0])
+    if not isinstance(attr1, AttrDict):
+        d = {}
+        for k, v in attr1.items():
+            if k == 'tag':
+                v = frozenset(v)
+            d[_intern(k)] = _intern(v)
+        attr1 = AttrDict(d)
+    return attr0, attr1
+
 
 def get_attr(attr_list, global_attrs):
     """
@@ -80,31 +283,34 @@ def get_attr(attr_list, global_attrs):
         A list of (keyword,value) tuple pairs
     global_attrs : tuple(list,dict)
         has the global attributes which update the local attributes
+
+    Returns a tuple of (AttrList, AttrDict), which share the global
+    attributes.
     """
     local_attr = [], {}
     for kv in attr_list:
-        keyword = kv[0]
+        keyword = _intern(kv[0])
         if len(kv) == 1:
             local_attr[0].append(keyword)
             continue
         elif len(kv) == 2:
-            value = kv[1]
+            value = _intern(kv[1])
         elif len(kv) > 2:
-            value = kv[1:]
+            value = tuple(kv[1:])
 
         if keyword == 'tag':
-            local_attr[1].setdefault(keyword,set()).add(value)
+            local_attr[1][keyword] = local_attr[1].get(keyword, frozenset()) | \
+                                     frozenset([value])
         else:
             local_attr[1][keyword] = value
 
-    attr0 = copy.copy(global_attrs[0])
-    attr1 = copy.copy(global_attrs[1])
+    attr0, attr1 = as_attr_views(global_attrs)
 
     if local_attr[0]:
-        attr0.extend(local_attr[0])
+        attr0 = AttrList(attr0._items + tuple(local_attr[0]))
 
     if local_attr[1]:
-        attr1.update(local_attr[1])
+        attr1 = AttrDict(local_attr[1], parent=attr1)
 
     return attr0, attr1
 
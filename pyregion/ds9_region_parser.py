@@ -1,4 +1,6 @@
 import copy
+import re
+import threading
 
 from pyparsing import Literal, CaselessKeyword, CaselessLiteral, \
      Word, Optional, OneOrMore, Group, Combine, ZeroOrMore, nums, \
@@ -7,22 +9,23 @@ from pyparsing import Literal, CaselessKeyword, CaselessLiteral, \
 
 from .region_numbers import CoordOdd, CoordEven, Distance, Angle, Integer
 from .region_numbers import SimpleNumber, SimpleInteger
+from .region_numbers import HMS, DMS, AngularDistance
 
-from .wcs_helper import get_kapteyn_projection, sky2sky
+from .wcs_helper import get_kapteyn_projection, get_physical_coordinate
 
 import warnings
 
-from .ds9_attr_parser import Ds9AttrParser, get_attr
+from .ds9_attr_parser import Ds9AttrParser, get_attr, \
+     ds9_shape_in_comment_defs, AttrList, AttrDict, as_attr_views
 
 from .wcs_helper import UnknownWcs, image_like_coordformats, select_wcs
-from .wcs_converter import convert_to_imagecoord, convert_physical_to_imagecoord
+from .wcs_converter import convert_physical_to_imagecoord
+from .wcs_converter import convert_to_imagecoord_batch, expand_arg_types
 
 from .parser_helper import as_comma_separated_list, wcs_shape, \
      define_shape, define_shape_helper, define_expr, define_line, \
      comment_shell_like, define_simple_literals, \
-     Shape, Property, CoordCommand, Global, Comment, RegionPusher
-
-from .physical_coordinate import PhysicalCoordinate
+     Shape, Property, CoordCommand, Global, Comment
 
 
 ds9_shape_defs = dict(circle=wcs_shape(CoordOdd, CoordEven, Distance),
@@ -55,65 +58,441 @@ ds9_shape_defs = dict(circle=wcs_shape(CoordOdd, CoordEven, Distance),
                       text=wcs_shape(CoordOdd, CoordEven)
                       )
 
-class RegionParser(RegionPusher):
+ds9_coord_command_keys = "PHYSICAL IMAGE FK4 B1950 FK5 J2000 GALACTIC ECLIPTIC ICRS LINEAR AMPLIFIER DETECTOR".split()
 
-    def __init__(self):
+# matches any line which may have a global or a coordinate command,
+# i.e., an atom starting with one of those keywords.
+_state_line_re = re.compile(r"(?:^|;)\s*(?:global|%s)\b" % \
+                            "|".join(ds9_coord_command_keys), re.I)
 
-        RegionPusher.__init__(self)
+# matches a comment which may start with a shape (see Ds9AttrParser)
+_comment_shape_re = re.compile(r"\s*(?:%s)\b" % \
+                               "|".join(ds9_shape_in_comment_defs), re.I)
 
-        self.shape_definition = ds9_shape_defs
-        regionShape = define_shape_helper(self.shape_definition)
-        regionShape = regionShape.setParseAction(lambda s, l, tok: Shape(tok[0], tok[1:]))
+# maximum number of distinct comments whose attributes are shared in
+# convert_attr
+_shared_attr_size = 4096
+
+# the attributes of shapes in the geometry-only mode
+_no_attr = AttrList(), AttrDict()
+
+_sky_to_image_batch_size = 4096
+
+
+def _physical_to_imagecoord(name, cl, pc):
+    # converts the coordinates of a shape in the physical coordinate
+
+    if pc is None:
+        raise RuntimeError("Physical coordinate is not known.")
+
+    fl = ds9_shape_defs[name].args_list
+
+    # take care of repeated items
+    if ds9_shape_defs[name].args_repeat:
+        n1, n2 = ds9_shape_defs[name].args_repeat
+    else:
+        n1 = 0
+        n2 = len(cl)
+
+    cl1, fl1 = cl[:n1], fl[:n1]
+    cl10 = convert_physical_to_imagecoord(cl1, fl1, pc)
+
+    nn2 = len(cl)-(len(fl) - n2)
+    cl2, fl2 = cl[n1:nn2], fl[n1:n2]
+    cl20 = convert_physical_to_imagecoord(cl2, fl2, pc)
 
-        regionExpr = define_expr(regionShape,
-                                 negate_func=lambda s, l, tok: tok[-1].set_exclude(),
-                                 )
+    cl3, fl3 = cl[nn2:], fl[n2:]
+    cl30 = convert_physical_to_imagecoord(cl3, fl3, pc)
 
-        coord_command_keys = "PHYSICAL IMAGE FK4 B1950 FK5 J2000 GALACTIC ECLIPTIC ICRS LINEAR AMPLIFIER DETECTOR".split()
+    return cl10 + cl20 + cl30
 
-        coordCommand = define_simple_literals(coord_command_keys,
-                                              parseAction=lambda s, l, tok:CoordCommand(tok[-1]))
 
-        regionGlobal = comment_shell_like(CaselessKeyword("global"),
-                                          lambda s, l, tok:Global(tok[-1]))
+def convert_coord_lists_to_image(name_list, cl_list, format_list,
+                                 wcs_proj, pc, rot_wrt_axis=1):
+    """
+    Converts the coordinates of shapes, given as lists of their names,
+    coordinate lists and coordinate formats, to the image coordinate.
+    Returns a list of the new coordinate lists, where None means the
+    shape is left as it is (e.g., already in the image coordinate).
+    Shapes in sky coordinates are converted together (see
+    convert_to_imagecoord_batch).
+    """
 
-        regionAtom = (regionExpr | coordCommand | regionGlobal)
+    new_cl_list = [None] * len(name_list)
+
+    sky_index = [i for i, f in enumerate(format_list)
+                 if f not in image_like_coordformats]
+
+    if sky_index:
+        tgt = wcs_proj.radesys
+
+        cl_list1, fl_list1, src_list1 = [], [], []
+        for i in sky_index:
+            if format_list[i] == UnknownWcs:
+                src = tgt
+            else:
+                src = select_wcs(format_list[i])
+
+            shape_def = ds9_shape_defs[name_list[i]]
+            cl_list1.append(cl_list[i])
+            fl_list1.append(expand_arg_types(shape_def.args_list,
+                                             shape_def.args_repeat,
+                                             len(cl_list[i])))
+            src_list1.append(src)
+
+        r = convert_to_imagecoord_batch(cl_list1, fl_list1, src_list1,
+                                        wcs_proj,
+                                        rot_wrt_axis=rot_wrt_axis)
+        for i, cl in zip(sky_index, r):
+            new_cl_list[i] = cl
+
+    for i, f in enumerate(format_list):
+        if f == "physical":
+            new_cl_list[i] = _physical_to_imagecoord(name_list[i],
+                                                     cl_list[i], pc)
+
+    return new_cl_list
+
+
+def get_wcs_proj_and_pc(header):
+    """
+    Returns the projection and the physical coordinate (None if
+    unknown) of the header, which may also be a wcs object.
+    """
+    try: # this is a hack to test if header is fits header of wcs object.
+        header["NAXIS"]
+    except (KeyError, TypeError, ValueError):
+        pc = None
+    else:
+        pc = get_physical_coordinate(header)
+
+    wcs_proj = get_kapteyn_projection(header)
+
+    return wcs_proj, pc
+
+
+def _sky_to_image_batch(l, wcs_proj, pc, rot_wrt_axis):
+    # convert the shapes in l (a list of (shape, comment) tuples) to
+    # the image coordinate.
+
+    shape_index = [i for i, (l1, c1) in enumerate(l) if isinstance(l1, Shape)]
+    shapes = [l[i][0] for i in shape_index]
+
+    new_cl_list = convert_coord_lists_to_image([l1.name for l1 in shapes],
+                                               [l1.coord_list for l1 in shapes],
+                                               [l1.coord_format for l1 in shapes],
+                                               wcs_proj, pc,
+                                               rot_wrt_axis=rot_wrt_axis)
+    new_cl_dict = dict((i, cl) for i, cl in zip(shape_index, new_cl_list)
+                       if cl is not None)
+
+    for i, (l1, c1) in enumerate(l):
+        if i in new_cl_dict:
+            l1n = copy.copy(l1)
+
+            l1n.coord_list = new_cl_dict[i]
+            l1n.coord_format = "image"
+            yield l1n, c1
+        else:
+            yield l1, c1
+
+
+def update_global_attr(global_attr, text, parser=None):
+    """
+    Returns global_attr, a tuple of (list, dict), updated with the
+    attributes in the text of a global line, as a tuple of read-only
+    (AttrList, AttrDict). global_attr itself is not modified, as it is
+    shared by the shapes parsed so far.
+    """
+    if parser is None:
+        parser = Ds9AttrParser()
+
+    attr0, attr1 = list(global_attr[0]), dict(global_attr[1])
+
+    for kv in parser.parse_default(text):
+        if len(kv) == 1:
+            attr0.append(kv[0])
+        elif len(kv) == 2:
+            if kv[0] == 'tag':
+                attr1[kv[0]] = attr1.get(kv[0], frozenset()) | \
+                               frozenset([kv[1]])
+            else:
+                attr1[kv[0]] = kv[1]
+
+    return as_attr_views((attr0, attr1))
+
+
+# Fast path for the common forms of a region line, i.e., shapes with
+# their arguments in parens, coordinate commands and comments, e.g.,
+#
+#   fk5;circle(12:34:56.7,+12:34:56,2") # color=red
+#
+# The line is matched with regular expressions and the same objects as
+# the pyparsing grammar are created. If any part of the line does not
+# match, parse_line_fast returns None and the grammar is used instead.
+
+_usn = r"\d+(?:\.\d*)?(?:[eE][-+]?\d+)?"
+
+_simple_number_re = re.compile(r"[-+]?%s$" % _usn)
+_simple_integer_re = re.compile(r"\+?\d+$")
+_sexadecimal_re = re.compile(r"([-+]?)(%s):(%s)(?::(%s))?$" % (_usn, _usn, _usn))
+_hms_re = re.compile(r"([-+]?)(%s)h(?:(%s)m(?:(%s)s)?)?$" % (_usn, _usn, _usn))
+_dms_re = re.compile(r"([-+]?)(%s)d(?:(%s)m(?:(%s)s)?)?$" % (_usn, _usn, _usn))
+_angular_distance_re = re.compile(r"(?:(%s)')?(?:(%s)\")?$" % (_usn, _usn))
+
+_shape_re = re.compile(r"\s*(-?)\s*([A-Za-z]+)\s*\((.*)\)\s*$")
+
+
+def _sixty_tokens(m, units):
+    # tokens of a sexadecimal number as returned by the grammar, e.g.,
+    # ["-", "12", "d", "34", "m"] or ["", "12", ":", "34", ":", "56"]
+    sign, v1, v2, v3 = m.groups()
+    if units == ":":
+        kl = [sign, v1, ":", v2]
+        if v3 is not None:
+            kl.extend([":", v3])
+        return kl
+
+    kl = [sign]
+    for v, u in zip([v1, v2, v3], units):
+        if v is None:
+            break
+        kl.extend([v, u])
+    return kl
+
+def _fast_simple_number(t):
+    if _simple_number_re.match(t):
+        return SimpleNumber(t)
+
+def _fast_coord_odd(t):
+    m = _hms_re.match(t)
+    if m:
+        return HMS(_sixty_tokens(m, "hms"))
+    m = _sexadecimal_re.match(t)
+    if m:
+        return HMS(_sixty_tokens(m, ":"))
+    return _fast_simple_number(t)
+
+def _fast_coord_even(t):
+    m = _dms_re.match(t)
+    if m:
+        return DMS(_sixty_tokens(m, "dms"))
+    m = _sexadecimal_re.match(t)
+    if m:
+        return DMS(_sixty_tokens(m, ":"))
+    return _fast_simple_number(t)
+
+def _fast_distance(t):
+    m = _angular_distance_re.match(t)
+    if m and t:
+        mm, ss = m.groups()
+        kl = []
+        if mm is not None:
+            kl.extend([mm, "'"])
+        if ss is not None:
+            kl.extend([ss, '"'])
+        return AngularDistance(kl)
+    return _fast_simple_number(t)
+
+def _fast_integer(t):
+    if _simple_integer_re.match(t):
+        return SimpleInteger(t)
+
+_fast_arg_parsers = {CoordOdd: _fast_coord_odd,
+                     CoordEven: _fast_coord_even,
+                     Distance: _fast_distance,
+                     Angle: _fast_simple_number,
+                     Integer: _fast_integer}
+
+_fast_coord_commands = dict((k.lower(), k) for k in ds9_coord_command_keys)
+
+
+def check_arg_count(shape_def, n):
+    """
+    Returns True if n is a valid number of arguments for the shape
+    definition (a wcs_shape).
+    """
+    fl, args_repeat = shape_def.args_list, shape_def.args_repeat
+    if args_repeat is None:
+        return n == len(fl)
+
+    n1, n2 = args_repeat
+    nr = n - (len(fl) - (n2 - n1))
+    return nr >= n2 - n1 and nr % (n2 - n1) == 0
+
+
+def _fast_shape(atom):
+    m = _shape_re.match(atom)
+    if m is None:
+        return None
+
+    exclude, name, args = m.groups()
+    name = name.lower()
+    shape_def = ds9_shape_defs.get(name)
+    if shape_def is None:
+        return None
+
+    fl, args_repeat = shape_def.args_list, shape_def.args_repeat
+    args = [a.strip() for a in args.split(",")]
+    n = len(args)
+    if not check_arg_count(shape_def, n):
+        return None
+
+    params = []
+    for a, f in zip(args, expand_arg_types(fl, args_repeat, n)):
+        p = _fast_arg_parsers[f](a)
+        if p is None:
+            return None
+        params.append(p)
+
+    shape = Shape(name, params)
+    if exclude:
+        shape.set_exclude()
+
+    return shape
+
+
+def parse_line_fast(l):
+    """
+    Parse a line of the common forms. Returns the same tuple as
+    RegionParser.parseLine, or None if the line needs the full
+    grammar.
+    """
+    atoms, sep, c = l.partition("#")
+    if sep:
+        c = c.strip()
+    else:
+        c = None
+
+    s = []
+    if atoms.strip():
+        for atom in atoms.split(";"):
+            k = _fast_coord_commands.get(atom.strip().lower())
+            if k is not None:
+                s.append(CoordCommand(k))
+                continue
 
-        regionAtom = regionAtom.setParseAction(self.pushAtom)
+            shape = _fast_shape(atom)
+            if shape is None:
+                return None
+            s.append(shape)
 
-        regionComment = comment_shell_like(Literal("#"),
-                                           parseAction=self.pushComment)
+    return s, c, None
 
-        line_simple = define_line(atom=regionAtom,
-                                  separator=Literal(";"),
-                                  comment=regionComment
-                                  )
 
-        line_w_composite = And([regionAtom,
-                                CaselessKeyword("||").setParseAction(self.set_continued)
-                                ]) \
-                           + Optional(regionComment)
+class _ContinuedMark(object):
+    # token for the "||" at the end of a composite line
+    pass
 
-        line = Or([line_simple, line_w_composite])
+_continued_mark = _ContinuedMark()
 
-        self.parser = Optional(line) + StringEnd()
 
+def define_region_grammar():
+    """
+    Returns a new pyparsing grammar of a single line of ds9 region
+    file. The parse actions keep no state, and the parsed line is a
+    list of Shape, CoordCommand and Global instances, optionally
+    followed by the continued mark and a Comment.
+    """
+
+    regionShape = define_shape_helper(ds9_shape_defs)
+    regionShape = regionShape.setParseAction(lambda s, l, tok: Shape(tok[0], tok[1:]))
+
+    regionExpr = define_expr(regionShape,
+                             negate_func=lambda s, l, tok: tok[-1].set_exclude(),
+                             )
+
+    coordCommand = define_simple_literals(ds9_coord_command_keys,
+                                          parseAction=lambda s, l, tok:CoordCommand(tok[-1]))
+
+    regionGlobal = comment_shell_like(CaselessKeyword("global"),
+                                      lambda s, l, tok:Global(tok[-1]))
+
+    regionAtom = (regionExpr | coordCommand | regionGlobal)
+
+    regionComment = comment_shell_like(Literal("#"),
+                                       parseAction=lambda s, l, tok:Comment(tok[-1].strip()))
+
+    line_simple = define_line(atom=regionAtom,
+                              separator=Literal(";"),
+                              comment=regionComment
+                              )
+
+    line_w_composite = And([regionAtom,
+                            CaselessKeyword("||").setParseAction(lambda s, l, tok:_continued_mark)
+                            ]) \
+                       + Optional(regionComment)
+
+    line = Or([line_simple, line_w_composite])
+
+    return Optional(line) + StringEnd()
+
+
+# The grammar is built once per process, on first use, and shared.
+_region_grammar = None
+_region_grammar_lock = threading.Lock()
+
+def get_region_grammar():
+    global _region_grammar
+    if _region_grammar is None:
+        with _region_grammar_lock:
+            if _region_grammar is None:
+                _region_grammar = define_region_grammar()
+    return _region_grammar
+
+
+class RegionParser(object):
+
+    # try parse_line_fast before the pyparsing grammar
+    use_fast_path = True
+
+    def __init__(self):
+
+        self.shape_definition = ds9_shape_defs
+
+    @property
+    def parser(self):
+        return get_region_grammar()
 
     def parseLine(self, l):
-        self.parser.parseString(l)
-        s, c, continued = self.stack, self.comment, self.continued
-        self.flush()
+        """
+        Parse a single line. Returns a tuple of the list of parsed
+        items (Shape, CoordCommand, Global), the comment, and whether
+        the line is continued (None if not).
+        """
+        if self.use_fast_path:
+            r = parse_line_fast(l)
+            if r is not None:
+                return r
+
+        tokens = self.parser.parseString(l)
+
+        s, c, continued = [], None, None
+        for t in tokens:
+            if isinstance(t, Comment):
+                c = t.text
+            elif t is _continued_mark:
+                continued = True
+            else:
+                s.append(t)
 
         return s, c, continued
 
     def parse(self, s):
+        return self.parse_lines(s.split("\n"))
+
+    def parse_lines(self, lines):
+        """
+        Same as parse, but takes an iterable of lines (e.g., a file
+        object), which is consumed lazily.
+        """
 
-        for l in s.split("\n"):
+        for l in lines:
+            l = l.rstrip("\n")
             try:
                 s, c, continued = self.parseLine(l)
             except ParseException:
                 warnings.warn("Failed to parse : " + l)
-                self.flush()
                 continue
 
             if len(s) > 1:
@@ -130,32 +509,47 @@ class RegionParser(RegionPusher):
             elif c:
                 yield None, c
 
-            self.flush()
+    def convert_attr(self, l, global_attr=None, attributes=True):
+        """
+        Sets the attributes of the shapes. global_attr is the initial
+        global attributes (e.g., as returned by scan_state).
 
-    def convert_attr(self, l):
-        global_attr = [], {}
+        With attributes=False, the comments and the global lines are
+        not parsed and every shape gets empty attributes. Shapes
+        defined in the comment (e.g., composite) are still recognized.
+        """
+        if not attributes:
+            for r in self._convert_attr_geometry_only(l):
+                yield r
+            return
+
+        if global_attr is None:
+            global_attr = [], {}
+        global_attr = as_attr_views(global_attr)
 
         parser = Ds9AttrParser()
 
+        # The attributes are read-only, and are shared by the shapes
+        # with the same comment (and the same global attributes).
+        shared_attr = {}
+
         for l1, c1 in l:
             if isinstance(l1, Global):
-                for kv in parser.parse_default(l1.text):
-                    if len(kv) == 1:
-                        global_attr[0].append(kv[0])
-                    elif len(kv) == 2:
-                        if kv[0] == 'tag':
-                            global_attr[1].setdefault(kv[0],set()).add(kv[1])
-                        else:
-                            global_attr[1][kv[0]] = kv[1]
+                global_attr = update_global_attr(global_attr, l1.text, parser)
+                shared_attr = {}
 
             elif isinstance(l1, Shape):
                 if c1:
-                    attr_list = parser.parse_default(c1)
-                    attr0, attr1 = get_attr(attr_list, global_attr)
+                    attr = shared_attr.get(c1)
+                    if attr is None:
+                        attr_list = parser.parse_default(c1)
+                        attr = get_attr(attr_list, global_attr)
+                        if len(shared_attr) < _shared_attr_size:
+                            shared_attr[c1] = attr
                 else:
-                    attr0, attr1 = global_attr
+                    attr = global_attr
                 l1n = copy.copy(l1)
-                l1n.attr = attr0, attr1
+                l1n.attr = attr
                 yield l1n, c1
 
             elif not l1 and c1:
@@ -166,106 +560,75 @@ class RegionParser(RegionPusher):
             else:
                 yield l1, c1
 
-    @staticmethod
-    def sky_to_image(l, header, rot_wrt_axis=1):
-
-        try: # this is a hack to test if header is fits header of wcs object.
-            header["NAXIS"]
-        except (KeyError, TypeError, ValueError):
-            pc = None
-        else:
-            pc = PhysicalCoordinate(header)
-
-        wcs_proj = get_kapteyn_projection(header)
+    def _convert_attr_geometry_only(self, l):
+        parser = Ds9AttrParser()
 
         for l1, c1 in l:
-            if isinstance(l1, Shape) and \
-                   (l1.coord_format not in image_like_coordformats):
-                tgt = wcs_proj.radesys
-                if l1.coord_format == UnknownWcs:
-                    src = tgt
-                else:
-                    src = select_wcs(l1.coord_format)
-                sky_to_sky = sky2sky(src, tgt)
-
-                cl = l1.coord_list
-                fl = ds9_shape_defs[l1.name].args_list
-
-                # take care of repeated items
-                if ds9_shape_defs[l1.name].args_repeat:
-                    n1, n2 = ds9_shape_defs[l1.name].args_repeat
-                else:
-                    n1 = 0
-                    n2 = len(cl)
-                #new_cl = []
-
-                xy0 = None
-
-                cl1, fl1 = cl[:n1], fl[:n1]
-                cl10, xy0 = convert_to_imagecoord(cl1, fl1, wcs_proj,
-                                sky_to_sky, xy0, rot_wrt_axis=rot_wrt_axis)
-
-                nn2 = len(cl)-(len(fl) - n2)
-                cl2, fl2 = cl[n1:nn2], fl[n1:n2]
-                cl20, xy0 = convert_to_imagecoord(cl2, fl2, wcs_proj,
-                                sky_to_sky, xy0, rot_wrt_axis=rot_wrt_axis)
-
-                cl3, fl3 = cl[nn2:], fl[n2:]
-                cl30, xy0 = convert_to_imagecoord(cl3, fl3, wcs_proj,
-                                sky_to_sky, xy0, rot_wrt_axis=rot_wrt_axis)
-
-                new_cl = cl10 + cl20 + cl30
-
+            if isinstance(l1, Global):
+                continue
 
+            elif isinstance(l1, Shape):
                 l1n = copy.copy(l1)
-
-                l1n.coord_list = new_cl
-                l1n.coord_format = "image"
+                l1n.attr = _no_attr
                 yield l1n, c1
 
-            elif isinstance(l1, Shape) and (l1.coord_format == "physical"):
-
-                if pc is None:
-                    raise RuntimeError("Physical coordinate is not known.")
-
-                cl = l1.coord_list
-                fl = ds9_shape_defs[l1.name].args_list
-
-                # take care of repeated items
-                if ds9_shape_defs[l1.name].args_repeat:
-                    n1, n2 = ds9_shape_defs[l1.name].args_repeat
-                else:
-                    n1 = 0
-                    n2 = len(cl)
-                #new_cl = []
-
-                xy0 = None
-
-                cl1, fl1 = cl[:n1], fl[:n1]
-                cl10 = convert_physical_to_imagecoord(cl1, fl1, pc)
-                #cl10, xy0 = convert_to_imagecoord(cl1, fl1, wcs_proj,
-                #                sky_to_sky, xy0, rot_wrt_axis=rot_wrt_axis)
+            elif not l1 and c1:
+                if not _comment_shape_re.match(c1):
+                    continue
+                shape, attr_list = parser.parse_check_shape(c1)
+                if shape:
+                    shape.attr = _no_attr
+                    yield shape, c1
+            else:
+                yield l1, c1
 
-                nn2 = len(cl)-(len(fl) - n2)
-                cl2, fl2 = cl[n1:nn2], fl[n1:n2]
-                cl20 = convert_physical_to_imagecoord(cl2, fl2, pc)
-                #cl20, xy0 = convert_to_imagecoord(cl2, fl2, wcs_proj,
-                #                sky_to_sky, xy0, rot_wrt_axis=rot_wrt_axis)
+    @staticmethod
+    def sky_to_image(l, header, rot_wrt_axis=1):
 
-                cl3, fl3 = cl[nn2:], fl[n2:]
-                cl30 = convert_physical_to_imagecoord(cl3, fl3, pc)
+        wcs_proj, pc = get_wcs_proj_and_pc(header)
 
-                new_cl = cl10 + cl20 + cl30
+        # shapes in sky coordinates are converted in batches of
+        # _sky_to_image_batch_size items.
+        batch = []
+        for l1, c1 in l:
+            batch.append((l1, c1))
+            if len(batch) >= _sky_to_image_batch_size:
+                for r in _sky_to_image_batch(batch, wcs_proj, pc,
+                                             rot_wrt_axis):
+                    yield r
+                batch = []
+
+        for r in _sky_to_image_batch(batch, wcs_proj, pc, rot_wrt_axis):
+            yield r
+
+    def scan_state(self, lines, global_attr=None, default_coord="physical"):
+        """
+        Returns the global attributes and the coordinate system in
+        effect after the given lines, starting from global_attr and
+        default_coord. Only the lines which may have a global or a
+        coordinate command are parsed.
+        """
+        if global_attr is None:
+            global_attr = [], {}
 
+        parser = Ds9AttrParser()
 
-                l1n = copy.copy(l1)
+        for l in lines:
+            if not _state_line_re.search(l):
+                continue
+            try:
+                s, c, continued = self.parseLine(l.rstrip("\n"))
+            except ParseException:
+                continue
 
-                l1n.coord_list = new_cl
-                l1n.coord_format = "image"
-                yield l1n, c1
+            for s1 in s:
+                if isinstance(s1, Global):
+                    global_attr = update_global_attr(global_attr, s1.text,
+                                                     parser)
+                elif isinstance(s1, CoordCommand):
+                    default_coord = s1.text.lower()
 
-            else:
-                yield l1, c1
+        return global_attr, default_coord
 
     def filter_shape(self, sss):
         return [s1[0] for s1 in sss if isinstance(s1[0], Shape)]
@@ -0,0 +1,152 @@
+"""
+Helpers for the sparse masks returned by RegionBase.mask with
+format="slices", and for the bit-packed masks returned with
+format="packed".
+"""
+
+import numpy as np
+
+# number of pixels gathered at once by SpanMask.sum, etc.
+_CHUNK_SIZE = 1 << 20
+
+
+class SpanMask(object):
+    """
+    A sparse mask, i.e., a list of runs of pixels inside a region. The
+    run i covers data[row[i], x0[i]:x1[i]]. Runs are sorted by row
+    and then by x0, and do not overlap.
+
+    m = region_filter.mask(shape, format="slices")
+    m.sum(data), m.mean(data), m.values(data)
+    """
+
+    def __init__(self, shape, row, x0, x1):
+        self.shape = tuple(shape)
+        self.row = np.asarray(row, dtype=np.intp)
+        self.x0 = np.asarray(x0, dtype=np.intp)
+        self.x1 = np.asarray(x1, dtype=np.intp)
+
+    def __len__(self):
+        return len(self.row)
+
+    def __repr__(self):
+        return "<SpanMask shape=%s runs=%d npix=%d>" % (self.shape,
+                                                        len(self),
+                                                        self.npix)
+
+    @property
+    def npix(self):
+        """ number of pixels inside the mask """
+        return int(np.sum(self.x1 - self.x0))
+
+    def slices(self):
+        """
+        iterates over (row, slice(x0, x1)) of each run.
+        """
+        for r, x0, x1 in zip(self.row, self.x0, self.x1):
+            yield int(r), slice(int(x0), int(x1))
+
+    def to_mask(self):
+        """ returns the dense bool mask """
+        m = np.zeros(self.shape, dtype=bool)
+        for r, s in self.slices():
+            m[r, s] = True
+        return m
+
+    def _check_data(self, data):
+        data = np.asanyarray(data)
+        if data.shape[-2:] != self.shape:
+            raise ValueError("shape of the data %s does not match the shape of the mask %s" % (data.shape, self.shape))
+        return data
+
+    def _iter_indices(self):
+        # yields (rows, cols) index arrays of the pixels inside the
+        # mask, in chunks of about _CHUNK_SIZE pixels.
+        n = self.x1 - self.x0
+        end = np.cumsum(n)
+        i = 0
+        while i < len(n):
+            j = np.searchsorted(end, end[i] - n[i] + _CHUNK_SIZE,
+                                side="right")
+            j = max(j, i + 1)
+            ni = n[i:j]
+            rows = np.repeat(self.row[i:j], ni)
+            offset = np.repeat(np.cumsum(ni) - ni - self.x0[i:j], ni)
+            cols = np.arange(len(rows)) - offset
+            yield rows, cols
+            i = j
+
+    def values(self, data):
+        """
+        returns the values of data inside the mask as a 1-d array
+        (or an array of shape data.shape[:-2] + (npix,)), in the order
+        of the runs.
+        """
+        data = self._check_data(data)
+        v = [data[..., rows, cols] for rows, cols in self._iter_indices()]
+        if not v:
+            return np.empty(data.shape[:-2] + (0,), dtype=data.dtype)
+        return np.concatenate(v, axis=-1)
+
+    def sum(self, data):
+        """ returns the sum of data inside the mask """
+        data = self._check_data(data)
+        s = np.zeros(data.shape[:-2], dtype=np.result_type(data, 0.))
+        for rows, cols in self._iter_indices():
+            s = s + data[..., rows, cols].sum(axis=-1)
+        return s
+
+    def mean(self, data):
+        """
+        returns the mean of data inside the mask, or nan if the mask
+        is empty
+        """
+        s = self.sum(data)
+        npix = self.npix
+        if npix == 0:
+            return np.full(np.shape(s), np.nan)[()]
+        return s / npix
+
+
+# Bit-packed masks are uint8 arrays of shape (ny, (nx+7)//8), in the
+# layout of numpy.packbits(mask, axis=1). The padding bits at the end of
+# each row are always 0.
+
+def pack_mask(mask):
+    """ returns the bit-packed version of a 2-d bool mask """
+    return np.packbits(np.asarray(mask, dtype=bool), axis=-1)
+
+
+def unpack_mask(packed, shape):
+    """ returns the 2-d bool mask of the given shape """
+    nx = shape[-1]
+    return np.unpackbits(packed, axis=-1)[..., :nx].astype(bool)
+
+
+def packed_and(a, b, out=None):
+    """ pixel-wise AND of two packed masks """
+    return np.bitwise_and(a, b, out=out)
+
+
+def packed_or(a, b, out=None):
+    """ pixel-wise OR of two packed masks """
+    return np.bitwise_or(a, b, out=out)
+
+
+def packed_not(a, shape, out=None):
+    """
+    pixel-wise NOT of a packed mask. The shape of the unpacked mask is
+    needed to keep the padding bits 0.
+    """
+    out = np.invert(a, out=out)
+    nx = shape[-1]
+    if nx % 8:
+        out[..., -1] &= (0xff << (8 - nx % 8)) & 0xff
+    return out
+
+
+_BIT_COUNT = np.array([bin(i).count("1") for i in range(256)], dtype=np.uint8)
+
+def packed_count(a):
+    """ number of pixels set in a packed mask """
+    return int(_BIT_COUNT[a].sum(dtype=np.intp))
@@ -1,7 +1,9 @@
 from pyparsing import Literal, CaselessKeyword, CaselessLiteral, \
      Word, Optional, OneOrMore, Group, Combine, ZeroOrMore, nums, \
      Forward, StringEnd, restOfLine, alphas, alphanums, CharsNotIn, \
-     MatchFirst, And, Or
+     MatchFirst, And, Token, ParseException
+
+import re
 
 
 def as_comma_separated_list(al):
@@ -75,17 +77,49 @@ def define_shape(name, shape_args, args_repeat=None):
 
 
 
+class KeywordDispatch(Token):
+    """
+    Reads the leading keyword and parses the rest with the expression
+    registered for it (keywords are case-insensitive). Unlike Or, only
+    a single expression is tried.
+    """
+
+    _keyword_re = re.compile(r"[A-Za-z_$][A-Za-z0-9_$]*")
+
+    def __init__(self, exprs):
+        Token.__init__(self)
+        self.exprs = dict((k.lower(), e) for k, e in exprs.items())
+        self.mayReturnEmpty = False
+        self.mayIndexError = False
+        self.errmsg = "Expected one of " + ", ".join(sorted(self.exprs))
+
+    def _generateDefaultName(self):
+        return "{" + " | ".join(sorted(self.exprs)) + "}"
+
+    def __str__(self):
+        return self._generateDefaultName()
+
+    def parseImpl(self, instring, loc, doActions=True):
+        m = self._keyword_re.match(instring, loc)
+        if m:
+            expr = self.exprs.get(m.group(0).lower())
+            if expr is not None:
+                return expr._parse(instring, loc, doActions)
+
+        raise ParseException(instring, loc, self.errmsg, self)
+
+
 def define_shape_helper(shape_defs):
-    l = []
+    d = {}
 
     for n, args in shape_defs.items():
         s = define_shape(n,
                          args.get_pyparsing(),
                          args_repeat = args.args_repeat)
 
-        l.append(s)
+        d[n] = s
 
-    return Or(l)
+    return KeywordDispatch(d)
 
 
 
@@ -135,6 +169,11 @@ def define_simple_literals(literal_list, parseAction=None):
 
 class Shape(object):
 
+    # coord_list, coord_format and attr are set later (check_wcs and
+    # convert_attr).
+    __slots__ = ("name", "params", "comment", "exclude", "continued",
+                 "coord_list", "coord_format", "attr")
+
     def __init__(self, shape_name, shape_params):
         self.name = shape_name
         self.params = shape_params
@@ -172,23 +211,3 @@ class Global(Property):
 class Comment(Property):
     def __repr__(self):
         return "Comment : " + repr(self.text)
-
-
-class RegionPusher(object):
-    def __init__(self):
-        self.flush()
-
-    def flush(self):
-        self.stack = []
-        self.comment = None
-        self.continued = None
-        
-    def pushAtom(self, s, l, tok):
-        self.stack.append(tok[-1])
-
-    def pushComment(self, s, l, tok):
-        self.comment  = tok[-1].strip()
-
-    def set_continued(self, s, l, tok):
-        self.continued = True
-
@@ -44,6 +44,10 @@ optional_sign = Optional(Literal("+") | Literal("-")).setParseAction(get_default
 
 
 class SimpleNumber(object):
+    # The text is kept only if it differs from repr(v), which is
+    # usually the case for hand-written numbers only.
+    __slots__ = ("_text", "v")
+
     def __repr__(self):
         return "Number(%s)" % (self.text,)
 
@@ -51,8 +55,14 @@ class SimpleNumber(object):
         return self.__repr__()
 
     def __init__(self, text):
-        self.text = text
         self.v = float(text)
+        self._text = None if text == repr(self.v) else text
+
+    @property
+    def text(self):
+        if self._text is None:
+            return repr(self.v)
+        return self._text
 
 
 
@@ -66,6 +76,9 @@ simple_number = _simple_number()
 
 
 class SimpleInteger(object):
+    # see SimpleNumber
+    __slots__ = ("_text", "v")
+
     def __repr__(self):
         return "Number(%s)" % (self.text,)
 
@@ -73,8 +86,14 @@ class SimpleInteger(object):
         return self.__repr__()
 
     def __init__(self, text):
-        self.text = text
         self.v = int(text)
+        self._text = None if text == str(self.v) else text
+
+    @property
+    def text(self):
+        if self._text is None:
+            return str(self.v)
+        return self._text
 
 def _unsigned_integer():
     s = Combine(Optional("+") + Word(nums))
@@ -91,11 +110,15 @@ def get_degree(s, l, tok):
 
 
 class Sixty(object):
+    __slots__ = ("v", "degree")
+
     def __init__(self, sn, d, m, s):
         self.v = sn * (d +(m + s/60.)/60.)
         self.degree = self.v
 
 class HMS(object):
+    __slots__ = ("text", "v", "degree")
+
     def __repr__(self):
         return "HMS(%s)" % (self.text,)
 
@@ -121,6 +144,8 @@ class HMS(object):
 
 
 class DMS(object):
+    __slots__ = ("text", "v", "degree")
+
     def __repr__(self):
         return "DMS(%s)" % (self.text,)
 
@@ -147,6 +172,8 @@ class DMS(object):
 
 
 class AngularDistance(object):
+    __slots__ = ("text", "v", "degree")
+
     def __repr__(self):
         return "Ang(%s)" % (self.text,)
 
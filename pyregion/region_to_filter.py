@@ -2,111 +2,136 @@ import numpy as np
 import pyregion._region_filter as region_filter
 import warnings
 
-def as_region_filter(shape_list, origin=1):
-    """
-    Often, the regions files implicitly assume the lower-left corner
-    of the image as a coordinate (1,1). However, the python convetion
-    is that the array index starts from 0. By default (origin = 1),
-    coordinates of the returned mpl artists have coordinate shifted by
-    (1, 1). If you do not want this shift, use origin=0.
-    """
+def _as_filter(shape, origin):
+    # returns a region filter of a single shape, or None if the shape
+    # cannot be converted.
 
-    filter_list = []
-    for shape in shape_list:
+    if shape.name == "composite":
+        return None
 
-        if shape.name == "composite":
-            continue
+    if shape.name == "polygon":
+        xy = np.array(shape.coord_list) - origin
+        f = region_filter.Polygon(xy[::2], xy[1::2])
 
-        if shape.name == "polygon":
-            xy = np.array(shape.coord_list) - origin
-            f = region_filter.Polygon(xy[::2], xy[1::2])
+    elif shape.name == "rotbox" or shape.name == "box":
+        xc, yc, w, h, rot = shape.coord_list
+        # -1 for change origin to 0,0
+        xc, yc = xc-origin, yc-origin
 
-        elif shape.name == "rotbox" or shape.name == "box":
-            xc, yc, w, h, rot = shape.coord_list
-            # -1 for change origin to 0,0
-            xc, yc = xc-origin, yc-origin
+        f = region_filter.Rotated(region_filter.Box(xc, yc, w, h),
+                                  rot, xc, yc)
 
-            f = region_filter.Rotated(region_filter.Box(xc, yc, w, h),
-                                      rot, xc, yc)
+    elif shape.name == "ellipse":
+        xc, yc  = shape.coord_list[:2]
+        # -1 for change origin to 0,0
+        xc, yc = xc-origin, yc-origin
+        angle = shape.coord_list[-1]
 
-        elif shape.name == "ellipse":
-            xc, yc  = shape.coord_list[:2]
-            # -1 for change origin to 0,0
-            xc, yc = xc-origin, yc-origin
-            angle = shape.coord_list[-1]
+        maj_list, min_list = shape.coord_list[2:-1:2], shape.coord_list[3:-1:2]
 
-            maj_list, min_list = shape.coord_list[2:-1:2], shape.coord_list[3:-1:2]
+        if len(maj_list) > 1:
+            w1, h1 = max(maj_list), max(min_list)
+            w2, h2 = min(maj_list), min(min_list)
 
-            if len(maj_list) > 1:
-                w1, h1 = max(maj_list), max(min_list)
-                w2, h2 = min(maj_list), min(min_list)
+            f1 = region_filter.Ellipse(xc, yc, w1, h1) \
+                & ~region_filter.Ellipse(xc, yc, w2, h2)
+            f = region_filter.Rotated(f1, angle, xc, yc)
+        else:
+            w, h = maj_list[0], min_list[0]
+            f = region_filter.Rotated(region_filter.Ellipse(xc, yc, w, h),
+                                      angle, xc, yc)
 
-                f1 = region_filter.Ellipse(xc, yc, w1, h1) \
-                    & ~region_filter.Ellipse(xc, yc, w2, h2)
-                f = region_filter.Rotated(f1, angle, xc, yc)
-            else:
-                w, h = maj_list[0], min_list[0]
-                f = region_filter.Rotated(region_filter.Ellipse(xc, yc, w, h),
-                                          angle, xc, yc)
 
 
+    elif shape.name == "annulus":
+        xc, yc  = shape.coord_list[:2]
+        # -1 for change origin to 0,0
+        xc, yc = xc-origin, yc-origin
+        r_list = shape.coord_list[2:]
 
-        elif shape.name == "annulus":
-            xc, yc  = shape.coord_list[:2]
-            # -1 for change origin to 0,0
-            xc, yc = xc-origin, yc-origin
-            r_list = shape.coord_list[2:]
+        r1 = max(r_list)
+        r2 = min(r_list)
 
-            r1 = max(r_list)
-            r2 = min(r_list)
+        f = region_filter.Circle(xc, yc, r1) & ~region_filter.Circle(xc, yc, r2)
 
-            f = region_filter.Circle(xc, yc, r1) & ~region_filter.Circle(xc, yc, r2)
+    elif shape.name == "circle":
+        xc, yc, r = shape.coord_list
+        # -1 for change origin to 0,0
+        xc, yc = xc-origin, yc-origin
 
-        elif shape.name == "circle":
-            xc, yc, r = shape.coord_list
-            # -1 for change origin to 0,0
-            xc, yc = xc-origin, yc-origin
+        f = region_filter.Circle(xc, yc, r)
 
-            f = region_filter.Circle(xc, yc, r)
+    elif shape.name == "panda":
+        xc, yc, a1, a2, an, r1, r2, rn = shape.coord_list
+        # -1 for change origin to 0,0
+        xc, yc = xc-origin, yc-origin
 
-        elif shape.name == "panda":
-            xc, yc, a1, a2, an, r1, r2, rn = shape.coord_list
-            # -1 for change origin to 0,0
-            xc, yc = xc-origin, yc-origin
+        f1 = region_filter.Circle(xc, yc, r2) & ~region_filter.Circle(xc, yc, r1)
+        f = f1 & region_filter.AngleRange(xc, yc, a1, a2)
 
-            f1 = region_filter.Circle(xc, yc, r2) & ~region_filter.Circle(xc, yc, r1)
-            f = f1 & region_filter.AngleRange(xc, yc, a1, a2)
+    elif shape.name == "pie":
+        xc, yc, r1, r2, a1, a2 = shape.coord_list
+        # -1 for change origin to 0,0
+        xc, yc = xc-origin, yc-origin
 
-        elif shape.name == "pie":
-            xc, yc, r1, r2, a1, a2 = shape.coord_list
-            # -1 for change origin to 0,0
-            xc, yc = xc-origin, yc-origin
+        f1 = region_filter.Circle(xc, yc, r2) & ~region_filter.Circle(xc, yc, r1)
+        f = f1 & region_filter.AngleRange(xc, yc, a1, a2)
 
-            f1 = region_filter.Circle(xc, yc, r2) & ~region_filter.Circle(xc, yc, r1)
-            f = f1 & region_filter.AngleRange(xc, yc, a1, a2)
+    elif shape.name == "epanda":
+        xc, yc, a1, a2, an, r11, r12, r21, r22, rn, angle = shape.coord_list
+        # -1 for change origin to 0,0
+        xc, yc = xc-origin, yc-origin
 
-        elif shape.name == "epanda":
-            xc, yc, a1, a2, an, r11, r12, r21, r22, rn, angle = shape.coord_list
-            # -1 for change origin to 0,0
-            xc, yc = xc-origin, yc-origin
+        f1 = region_filter.Ellipse(xc, yc, r21, r22) & ~region_filter.Ellipse(xc, yc, r11, r12)
+        f2 = f1 & region_filter.AngleRange(xc, yc, a1, a2)
+        f = region_filter.Rotated(f2, angle, xc, yc)
+        #f = f2 & region_filter.AngleRange(xc, yc, a1, a2)
 
-            f1 = region_filter.Ellipse(xc, yc, r21, r22) & ~region_filter.Ellipse(xc, yc, r11, r12)
-            f2 = f1 & region_filter.AngleRange(xc, yc, a1, a2)
-            f = region_filter.Rotated(f2, angle, xc, yc)
-            #f = f2 & region_filter.AngleRange(xc, yc, a1, a2)
+    elif shape.name == "bpanda":
+        xc, yc, a1, a2, an, r11, r12, r21, r22, rn, angle = shape.coord_list
+        # -1 for change origin to 0,0
+        xc, yc = xc-origin, yc-origin
 
-        elif shape.name == "bpanda":
-            xc, yc, a1, a2, an, r11, r12, r21, r22, rn, angle = shape.coord_list
-            # -1 for change origin to 0,0
-            xc, yc = xc-origin, yc-origin
+        f1 = region_filter.Box(xc, yc, r21, r22) & ~region_filter.Box(xc, yc, r11, r12)
+        f2 = f1 & region_filter.AngleRange(xc, yc, a1, a2)
+        f = region_filter.Rotated(f2, angle, xc, yc)
+        #f = f2 & region_filter.AngleRange(xc, yc, a1, a2)
 
-            f1 = region_filter.Box(xc, yc, r21, r22) & ~region_filter.Box(xc, yc, r11, r12)
-            f2 = f1 & region_filter.AngleRange(xc, yc, a1, a2)
-            f = region_filter.Rotated(f2, angle, xc, yc)
-            #f = f2 & region_filter.AngleRange(xc, yc, a1, a2)
+    else:
+        warnings.warn("'as_region_filter' does not know how to convert '%s' to a region filter." % (shape.name,))
+        return None
 
-        else:
-            warnings.warn("'as_region_filter' does not know how to convert '%s' to a region filter." % (shape.name,))
+    return f
+
+
+def as_region_filter_list(shape_list, origin=1):
+    """
+    Returns a list of region filters, one for each shape in the
+    list. None is returned for the shapes which cannot be converted
+    (e.g., composite). The exclusion of the shapes is not
+    applied. See as_region_filter for *origin*. shape_list may also be
+    a ShapeTable.
+    """
+
+    return [_as_filter(shape, origin) for shape in shape_list]
+
+
+def as_region_filter(shape_list, origin=1):
+    """
+    Often, the regions files implicitly assume the lower-left corner
+    of the image as a coordinate (1,1). However, the python convetion
+    is that the array index starts from 0. By default (origin = 1),
+    coordinates of the returned mpl artists have coordinate shifted by
+    (1, 1). If you do not want this shift, use origin=0.
+
+    shape_list may also be a ShapeTable.
+    """
+
+    filter_list = []
+    for shape in shape_list:
+
+        f = _as_filter(shape, origin)
+        if f is None:
             continue
 
         if shape.exclude:
@@ -0,0 +1,303 @@
+"""
+Writes shapes as a ds9 region file.
+
+The shapes are written in chunks. Each chunk is formatted with a single
+format operation, and written with a single write call.
+"""
+
+import re
+from itertools import islice
+
+import numpy as np
+
+from .ds9_region_parser import ds9_shape_defs
+from .ds9_attr_parser import ds9_shape_in_comment_defs
+from .region_numbers import CoordOdd, CoordEven, Distance, Integer
+from .wcs_converter import expand_arg_types
+from .shape_table import ShapeTable
+
+
+# number of shapes formatted and written at once
+_chunk_size = 50000
+
+# coordinate formats written as sexagesimal with sexagesimal=True
+_sexagesimal_formats = ["fk4", "b1950", "fk5", "j2000", "icrs"]
+
+# a list of numbers, e.g., dashlist=8 3
+_numbers_re = re.compile(r"^[-+.\d\s]+$")
+
+# kinds of coordinates
+_PLAIN, _RA, _DEC, _ARCSEC, _INTEGER = range(5)
+
+
+def _shape_kinds(name, n, sexagesimal):
+    """ returns the kind of each of the n coordinates of a shape """
+    shape_def = ds9_shape_defs.get(name) or ds9_shape_in_comment_defs.get(name)
+    if shape_def is None:
+        return (_PLAIN,) * n
+
+    kinds = {Integer: _INTEGER}
+    if sexagesimal:
+        kinds.update({CoordOdd: _RA, CoordEven: _DEC, Distance: _ARCSEC})
+    return tuple(kinds.get(t, _PLAIN) for t in
+                 expand_arg_types(shape_def.args_list, shape_def.args_repeat, n))
+
+
+def _format_batch(fmt, values, nargs=1):
+    """
+    formats values with fmt, which takes nargs values, with a single
+    format operation
+    """
+    if len(values) == 0:
+        return []
+    s = "\n".join([fmt] * (len(values) // nargs)) % tuple(values)
+    return s.split("\n")
+
+
+def _format_sexagesimal(v, precision, hours):
+    """
+    returns v (in degrees) as [+-]dd:mm:ss.sss, or hh:mm:ss.sss if
+    hours. Rounding is done on integers, so that 59.9999 seconds carry.
+    """
+    scale = 10**precision
+    if hours:
+        v = np.mod(v, 360.) / 15.
+    n = np.rint(np.abs(v) * (3600 * scale)).astype(np.int64)
+    if hours:
+        # 23:59:59.9999 rounded up
+        n %= 24 * 3600 * scale
+
+    d, rest = np.divmod(n, 3600 * scale)
+    m, rest = np.divmod(rest, 60 * scale)
+    s, f = np.divmod(rest, scale)
+
+    fmt = "%02d:%02d:%02d"
+    columns = [d, m, s]
+    if precision > 0:
+        fmt += ".%%0%dd" % precision
+        columns.append(f)
+
+    text = _format_batch(fmt, np.column_stack(columns).ravel().tolist(),
+                         len(columns))
+    if hours:
+        return text
+
+    sign = np.where((v < 0) & (n > 0), "-", "+").tolist()
+    return [s1 + t1 for s1, t1 in zip(sign, text)]
+
+
+def _coord_values(coords, kinds, precision):
+    """
+    returns the values of the coordinates for the formats of
+    _kind_formats, i.e., the text of the sexagesimal coordinates and
+    the distances in arcsec.
+    """
+    coords = coords.copy()
+    k = kinds == _ARCSEC
+    coords[k] *= 3600.
+
+    values = np.array(coords.tolist(), dtype=object)
+
+    # the seconds have the resolution of precision decimals of degrees
+    k = kinds == _RA
+    values[k] = _format_sexagesimal(coords[k], max(precision - 2, 0),
+                                    hours=True)
+    k = kinds == _DEC
+    values[k] = _format_sexagesimal(coords[k], max(precision - 3, 0),
+                                    hours=False)
+
+    return values.tolist()
+
+
+def _kind_formats(precision):
+    plain = "%%.%df" % precision
+    return {_PLAIN: plain, _RA: "%s", _DEC: "%s",
+            _ARCSEC: "%%.%df\"" % max(precision - 3, 0),
+            _INTEGER: "%d"}
+
+
+def _format_value(k, v):
+    if k in ("text", "tag"):
+        return "%s={%s}" % (k, v)
+    # the values are kept as written, e.g., with quotes, except that
+    # some have a trailing space
+    v = str(v).strip()
+    if " " in v and v[0] not in "\"'{" and not _numbers_re.match(v):
+        return '%s="%s"' % (k, v)
+    return "%s=%s" % (k, v)
+
+
+def _format_attr(attr_dict, flags=(), skip=("text",)):
+    """
+    Returns the ds9 text of a dict of attributes, e.g.,
+    'color=red font="helvetica 10 normal" tag={a}'.
+    """
+    l = list(flags)
+    for k in attr_dict:
+        if k in skip:
+            continue
+        v = attr_dict[k]
+        if k == "tag":
+            l.extend([_format_value(k, t) for t in sorted(v)])
+        else:
+            l.append(_format_value(k, v))
+    return " ".join(l)
+
+
+def _global_attr(attr):
+    """ the global attributes of the attributes of a shape, or None """
+    if not attr:
+        return None
+    # the attributes of a shape without a comment are the global ones
+    attr_dict = attr[1]
+    parent = getattr(attr_dict, "parent", None)
+    return attr_dict if parent is None else parent
+
+
+def _shape_comment(comment, attr, global_attr):
+    # shapes in comments (e.g., composite) keep their attributes in
+    # attr instead of the comment.
+    if comment or not attr or attr[1] is global_attr:
+        return comment
+
+    flags, attr_dict = attr
+    local = dict((k, v) for k, v in attr_dict.items()
+                 if global_attr is None or k not in global_attr or
+                 global_attr[k] != v)
+    return _format_attr(local, flags, skip=())
+
+
+def _format_table(t, precision, sexagesimal, coord_format, global_attr):
+    """
+    Returns the text of the shapes of the ShapeTable t, and the
+    coordinate format and the global attributes of its last shape.
+    A coordinate format or global line is written wherever they
+    change.
+
+    Each shape has a format string, e.g., "circle(%.6f,%.6f,%.6f)",
+    and the whole table is formatted at once.
+    """
+    names = t.names
+    formats = t.coord_formats
+    sexagesimal_format = [sexagesimal and f in _sexagesimal_formats
+                          for f in formats]
+    kind_formats = _kind_formats(precision)
+
+    kinds_cache, template_cache = {}, {}
+
+    comments = t.comments if t.comments is not None else [None] * len(t)
+    attrs = t.attrs if t.attrs is not None else [None] * len(t)
+
+    lines = []
+    kinds = []
+    last_attr = None
+    for nc, fc, n, exclude, continued, comment, attr in \
+            zip(t.name_code.tolist(), t.format_code.tolist(),
+                np.diff(t.offsets).tolist(), t.exclude.tolist(),
+                t.continued.tolist(), comments, attrs):
+        # the attributes are usually shared between shapes
+        if attr is not last_attr:
+            last_attr = attr
+            g = _global_attr(attr)
+            if g is not None and g is not global_attr:
+                if g != (global_attr or {}):
+                    lines.append("global " +
+                                 _format_attr(g).replace("%", "%%"))
+                global_attr = g
+
+        if formats[fc] != coord_format:
+            coord_format = formats[fc]
+            lines.append(coord_format)
+
+        key = nc, fc, n, exclude, continued
+        template = template_cache.get(key)
+        if template is None:
+            name = names[nc]
+            shape_kinds = _shape_kinds(name, n, sexagesimal_format[fc])
+            kinds_cache[key] = shape_kinds
+            if name in ds9_shape_defs:
+                head = "-" + name if exclude else name
+            else:
+                head = "# " + name
+            template = head + "(" + \
+                       ",".join([kind_formats[k] for k in shape_kinds]) + ")"
+            if continued:
+                template += " ||"
+            template_cache[key] = template
+
+        if sexagesimal:
+            kinds.extend(kinds_cache[key])
+
+        comment = _shape_comment(comment, attr, global_attr)
+        if comment:
+            comment = comment.replace("%", "%%")
+            if template[0] == "#":
+                template = template + " " + comment
+            else:
+                template = template + " # " + comment
+
+        lines.append(template)
+
+    if sexagesimal:
+        values = _coord_values(t.coords, np.array(kinds, dtype=np.int8),
+                               precision)
+    else:
+        values = t.coords.tolist()
+
+    lines.append("")
+    return "\n".join(lines) % tuple(values), coord_format, global_attr
+
+
+def _iter_tables(shapes, chunk_size):
+    if isinstance(shapes, ShapeTable):
+        for i in range(0, len(shapes), chunk_size):
+            yield shapes[i:i+chunk_size]
+        return
+
+    it = iter(shapes)
+    while True:
+        chunk = list(islice(it, chunk_size))
+        if not chunk:
+            break
+        yield ShapeTable.from_shapelist(chunk)
+
+
+def write_region(shapes, outfile, precision=6, sexagesimal=False,
+                 chunk_size=None):
+    """
+    Writes shapes as a ds9 region file.
+
+    shapes : a ShapeList, a ShapeTable, or any iterable of shapes
+        (e.g., pyregion.iter_shapes), which is read in chunks.
+    outfile : a file name or a file object open for writing text
+    precision : number of decimals of the coordinates (in degrees,
+        pixels, etc.)
+    sexagesimal : write equatorial coordinates (fk4, fk5, icrs) as
+        hh:mm:ss and dd:mm:ss, and distances in arcsec, with the same
+        resolution as precision decimals of degrees. Otherwise,
+        coordinates are in degrees.
+
+    A global line is written before the first shape, and again
+    wherever the global attributes of the shapes change.
+    """
+    if chunk_size is None:
+        chunk_size = _chunk_size
+
+    if hasattr(outfile, "write"):
+        outf, close = outfile, False
+    else:
+        outf, close = open(outfile, "w"), True
+
+    try:
+        outf.write("# Region file format: DS9 version 4.1\n")
+
+        coord_format = None
+        global_attr = None
+        for t in _iter_tables(shapes, chunk_size):
+            text, coord_format, global_attr = \
+                  _format_table(t, precision, sexagesimal,
+                                coord_format, global_attr)
+            outf.write(text)
+    finally:
+        if close:
+            outf.close()
@@ -0,0 +1,381 @@
+"""
+A columnar representation of a list of shapes.
+"""
+
+from array import array
+from collections import namedtuple
+
+import numpy as np
+
+
+# a single shape of a ShapeTable, as returned by ShapeTable[i]. It has
+# the same attributes as Shape (except the params), so it can be used
+# where a Shape is read, e.g., by as_region_filter.
+ShapeRow = namedtuple("ShapeRow", ["name", "coord_list", "coord_format",
+                                   "exclude", "continued", "comment",
+                                   "attr"])
+
+
+# the names of the coordinates of the shapes with a fixed number of
+# arguments, used by ShapeTable.to_arrays
+_array_fields = dict(circle=("x", "y", "radius"),
+                     box=("x", "y", "width", "height", "angle"),
+                     rotbox=("x", "y", "width", "height", "angle"),
+                     point=("x", "y"),
+                     text=("x", "y"),
+                     line=("x1", "y1", "x2", "y2"),
+                     vector=("x", "y", "length", "angle"),
+                     pie=("x", "y", "inner", "outer",
+                          "start_angle", "end_angle"),
+                     panda=("x", "y", "start_angle", "end_angle", "nangle",
+                            "inner", "outer", "nradius"),
+                     epanda=("x", "y", "start_angle", "end_angle", "nangle",
+                             "inner_width", "inner_height",
+                             "outer_width", "outer_height", "nradius",
+                             "angle"),
+                     bpanda=("x", "y", "start_angle", "end_angle", "nangle",
+                             "inner_width", "inner_height",
+                             "outer_width", "outer_height", "nradius",
+                             "angle"),
+                     )
+
+# shapes with a repeated group of arguments :
+# (leading fields, group name, group size, trailing fields)
+_array_repeat_fields = dict(polygon=((), "vertices", 2, ()),
+                            ellipse=(("x", "y"), "radii", 2, ("angle",)),
+                            annulus=(("x", "y"), "radii", 1, ()),
+                            )
+
+
+def _gather(coords, offsets, idx):
+    """
+    returns the coordinates of the shapes idx, concatenated, and their
+    offsets. A view of coords if idx are all the shapes.
+    """
+    if len(idx) == len(offsets) - 1:
+        return coords[offsets[0]:offsets[-1]], offsets - offsets[0]
+
+    starts = offsets[idx]
+    lengths = offsets[idx + 1] - starts
+    new_offsets = np.zeros(len(idx) + 1, dtype=np.int64)
+    np.cumsum(lengths, out=new_offsets[1:])
+    take = np.repeat(starts - new_offsets[:-1], lengths) + \
+           np.arange(new_offsets[-1])
+    return coords[take], new_offsets
+
+
+def _fixed_arrays(name, flat, offsets):
+    fields = _array_fields[name]
+    k = len(fields)
+    if np.any(np.diff(offsets) != k):
+        raise ValueError("%s must have %d coordinates" % (name, k))
+
+    coords = flat.reshape(-1, k)
+    d = dict(coords=coords)
+    for i, f in enumerate(fields):
+        d[f] = coords[:, i]
+    return d
+
+
+def _repeat_arrays(name, flat, offsets):
+    head, group, group_size, tail = _array_repeat_fields[name]
+    nh, nt = len(head), len(tail)
+
+    lengths = np.diff(offsets) - (nh + nt)
+    if np.any(lengths < group_size) or np.any(lengths % group_size):
+        raise ValueError("wrong number of coordinates for %s" % (name,))
+
+    d = {}
+    for i, f in enumerate(head):
+        d[f] = flat[offsets[:-1] + i]
+    for i, f in enumerate(tail):
+        d[f] = flat[offsets[1:] - nt + i]
+
+    if nh + nt:
+        keep = np.ones(len(flat), dtype=bool)
+        for i in range(nh):
+            keep[offsets[:-1] + i] = False
+        for i in range(nt):
+            keep[offsets[1:] - nt + i] = False
+        values = flat[keep]
+    else:
+        values = flat
+
+    d[group] = values if group_size == 1 else values.reshape(-1, group_size)
+    d["offsets"] = np.zeros(len(offsets), dtype=np.int64)
+    np.cumsum(lengths // group_size, out=d["offsets"][1:])
+    return d
+
+
+class ShapeTable(object):
+    """
+    A table of shapes, stored in NumPy arrays instead of a list of
+    Shape objects.
+
+    names, coord_formats : lists of the distinct shape names and
+        coordinate formats. name_code and format_code index them.
+    exclude, continued : bool arrays
+    offsets : int64 array of n+1 items. The coordinates of shape i are
+        coords[offsets[i]:offsets[i+1]].
+    coords : float64 array of the coordinates of all shapes
+    comments, attrs : lists of the comment and the attributes of each
+        shape (None if not available). The attributes are usually
+        shared between shapes.
+
+    t = ShapeTable.from_shapelist(pyregion.open("ds9.reg"))
+    t = t.as_imagecoord(header)
+    m = t.get_mask(shape=(100, 100))
+    """
+
+    def __init__(self, names, name_code, coord_formats, format_code,
+                 exclude, continued, offsets, coords,
+                 comments=None, attrs=None):
+        self.names = list(names)
+        self.name_code = np.asarray(name_code, dtype=np.int16)
+        self.coord_formats = list(coord_formats)
+        self.format_code = np.asarray(format_code, dtype=np.int8)
+        self.exclude = np.asarray(exclude, dtype=bool)
+        self.continued = np.asarray(continued, dtype=bool)
+        self.offsets = np.asarray(offsets, dtype=np.int64)
+        self.coords = np.asarray(coords, dtype=np.float64)
+        self.comments = comments
+        self.attrs = attrs
+
+        n = len(self.name_code)
+        if len(self.offsets) != n + 1:
+            raise ValueError("offsets must have %d items" % (n + 1,))
+        for k in ["format_code", "exclude", "continued"]:
+            if len(getattr(self, k)) != n:
+                raise ValueError("%s must have %d items" % (k, n))
+        for k in ["comments", "attrs"]:
+            if getattr(self, k) is not None and len(getattr(self, k)) != n:
+                raise ValueError("%s must have %d items" % (k, n))
+
+    def __len__(self):
+        return len(self.name_code)
+
+    def __repr__(self):
+        return "<ShapeTable of %d shapes, %d coordinates>" % \
+               (len(self), len(self.coords))
+
+    @classmethod
+    def from_shapelist(cls, shape_list):
+        """
+        Creates a table from a ShapeList, or any iterable of shapes
+        (e.g., pyregion.iter_shapes) whose coordinates are known.
+        """
+        names, name_index = [], {}
+        coord_formats, format_index = [], {}
+
+        name_code, format_code = array("h"), array("b")
+        exclude, continued = array("b"), array("b")
+        offsets, coords = array("q", [0]), array("d")
+        comments, attrs = [], []
+
+        for s in shape_list:
+            if s.name not in name_index:
+                name_index[s.name] = len(names)
+                names.append(s.name)
+            if s.coord_format not in format_index:
+                format_index[s.coord_format] = len(coord_formats)
+                coord_formats.append(s.coord_format)
+
+            name_code.append(name_index[s.name])
+            format_code.append(format_index[s.coord_format])
+            exclude.append(bool(s.exclude))
+            continued.append(bool(s.continued))
+            coords.extend(s.coord_list)
+            offsets.append(len(coords))
+            comments.append(s.comment)
+            attrs.append(getattr(s, "attr", None))
+
+        return cls(names, np.frombuffer(name_code, dtype=np.int16),
+                   coord_formats, np.frombuffer(format_code, dtype=np.int8),
+                   np.frombuffer(exclude, dtype=np.int8),
+                   np.frombuffer(continued, dtype=np.int8),
+                   np.frombuffer(offsets, dtype=np.int64),
+                   np.frombuffer(coords, dtype=np.float64),
+                   comments=comments, attrs=attrs)
+
+    def to_shapelist(self):
+        """
+        Returns a ShapeList of new Shape objects. As the original
+        parameters are not kept, the params of the shapes are their
+        coordinates.
+        """
+        from .core import ShapeList
+        from .parser_helper import Shape
+
+        shape_list = []
+        for r in self:
+            s = Shape(r.name, r.coord_list)
+            s.coord_list = r.coord_list
+            s.coord_format = r.coord_format
+            s.exclude = r.exclude
+            s.continued = r.continued
+            s.comment = r.comment
+            if r.attr is not None:
+                s.attr = r.attr
+            shape_list.append(s)
+
+        comment_list = None if self.comments is None else list(self.comments)
+        return ShapeList(shape_list, comment_list=comment_list)
+
+    def coord_list(self, i):
+        """ returns the coordinates of the i-th shape as a list """
+        return self.coords[self.offsets[i]:self.offsets[i+1]].tolist()
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return self._slice(i)
+
+        n = len(self)
+        if i < 0:
+            i += n
+        if not 0 <= i < n:
+            raise IndexError("shape index out of range")
+
+        return ShapeRow(self.names[self.name_code[i]],
+                        self.coord_list(i),
+                        self.coord_formats[self.format_code[i]],
+                        bool(self.exclude[i]),
+                        bool(self.continued[i]),
+                        None if self.comments is None else self.comments[i],
+                        None if self.attrs is None else self.attrs[i])
+
+    def _slice(self, key):
+        # a table of a contiguous range of shapes, sharing the arrays
+        start, stop, step = key.indices(len(self))
+        if step != 1:
+            raise ValueError("ShapeTable only supports contiguous slices")
+        stop = max(start, stop)
+
+        offsets = self.offsets[start:stop+1]
+        coords = self.coords[offsets[0]:offsets[-1]]
+        comments = None if self.comments is None else self.comments[start:stop]
+        attrs = None if self.attrs is None else self.attrs[start:stop]
+
+        return ShapeTable(self.names, self.name_code[start:stop],
+                          self.coord_formats, self.format_code[start:stop],
+                          self.exclude[start:stop],
+                          self.continued[start:stop],
+                          offsets - offsets[0], coords,
+                          comments=comments, attrs=attrs)
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self[i]
+
+    def to_arrays(self):
+        """
+        Returns the coordinates of the shapes grouped by the shape
+        name, as a dict of {name: dict of arrays}. Each group has
+
+        index : the positions of the shapes in the table
+        exclude : bool array
+        coord_format : array of the coordinate format of each shape
+
+        and the coordinates. Shapes with a fixed number of arguments
+        have coords, a (n, nargs) array, and a 1-d view of each of its
+        columns, e.g., x, y and radius for circles. For polygons,
+        vertices is a (m, 2) array and the vertices of shape i are
+        vertices[offsets[i]:offsets[i+1]]. Ellipses and annuli
+        similarly have radii and offsets, and x, y (and angle). Other
+        shapes have the flat coords and offsets.
+
+        If all shapes have the same name, the coordinates are a view
+        of self.coords.
+        """
+        formats = np.array(self.coord_formats, dtype=str)
+        groups = {}
+        for k, name in enumerate(self.names):
+            idx = np.flatnonzero(self.name_code == k)
+            if len(idx) == 0:
+                continue
+
+            flat, offsets = _gather(self.coords, self.offsets, idx)
+            if name in _array_fields:
+                d = _fixed_arrays(name, flat, offsets)
+            elif name in _array_repeat_fields:
+                d = _repeat_arrays(name, flat, offsets)
+            else:
+                d = dict(coords=flat, offsets=offsets)
+
+            d["index"] = idx
+            d["exclude"] = self.exclude[idx]
+            d["coord_format"] = formats[self.format_code[idx]]
+            groups[name] = d
+
+        return groups
+
+    def check_imagecoord(self):
+        if "image" not in self.coord_formats:
+            return len(self) == 0
+        return bool(np.all(self.format_code ==
+                           self.coord_formats.index("image")))
+
+    def as_imagecoord(self, header, rot_wrt_axis=1):
+        """
+        Returns a new ShapeTable where the coordinates are converted to
+        the image coordinate using the given header. The shapes in sky
+        coordinates are converted together.
+        """
+        from .ds9_region_parser import get_wcs_proj_and_pc, \
+             convert_coord_lists_to_image
+
+        wcs_proj, pc = get_wcs_proj_and_pc(header)
+
+        name_list = [self.names[k] for k in self.name_code]
+        format_list = [self.coord_formats[k] for k in self.format_code]
+        cl_list = [self.coord_list(i) for i in range(len(self))]
+
+        new_cl_list = convert_coord_lists_to_image(name_list, cl_list,
+                                                   format_list,
+                                                   wcs_proj, pc,
+                                                   rot_wrt_axis=rot_wrt_axis)
+
+        coord_formats = list(self.coord_formats)
+        if "image" not in coord_formats:
+            coord_formats.append("image")
+        image_code = coord_formats.index("image")
+
+        coords = self.coords.copy()
+        format_code = self.format_code.copy()
+        for i, cl in enumerate(new_cl_list):
+            if cl is not None:
+                coords[self.offsets[i]:self.offsets[i+1]] = cl
+                format_code[i] = image_code
+
+        return ShapeTable(self.names, self.name_code,
+                          coord_formats, format_code,
+                          self.exclude, self.continued,
+                          self.offsets, coords,
+                          comments=self.comments, attrs=self.attrs)
+
+    def get_filter(self, header=None, origin=1, rot_wrt_axis=1):
+        """
+        Same as ShapeList.get_filter.
+        """
+        from .region_to_filter import as_region_filter
+
+        if header is None:
+            if not self.check_imagecoord():
+                raise RuntimeError("the region has non-image coordinate. header is required.")
+            reg_in_imagecoord = self
+        else:
+            reg_in_imagecoord = self.as_imagecoord(header, rot_wrt_axis=rot_wrt_axis)
+
+        return as_region_filter(reg_in_imagecoord, origin=origin)
+
+    def get_mask(self, hdu=None, header=None, shape=None, rot_wrt_axis=1,
+                 format="dense", nthreads=1):
+        """
+        Same as ShapeList.get_mask.
+        """
+        if hdu and header is None:
+            header = hdu.header
+        if hdu and shape is None:
+            shape = hdu.data.shape
+
+        region_filter = self.get_filter(header=header, rot_wrt_axis=rot_wrt_axis)
+        return region_filter.mask(shape, format=format, nthreads=nthreads)
@@ -1,4 +1,6 @@
 from ..ds9_attr_parser import get_ds9_attr_parser, get_attr, Ds9AttrParser
+from ..ds9_attr_parser import attr_cache_info, clear_attr_cache
+from ..ds9_attr_parser import AttrList, AttrDict
 
 
 def test_attr():
@@ -27,4 +29,69 @@ def test_shape_in_comment():
 
     r = parser.parse_check_shape("projection(0, 2, 3, 2, 4)")
     assert r[0].name == "projection"
-    assert r[1] == []
\ No newline at end of file
+    assert r[1] == []
+
+def test_attr_cache():
+    clear_attr_cache()
+    parser = Ds9AttrParser()
+
+    s = 'color=green font="helvetica 10 normal" width=2'
+    r1 = parser.parse_default(s)
+    r2 = Ds9AttrParser().parse_default(s)
+    assert r1 == r2 == (("color", "green"),
+                        ("font", '"helvetica 10 normal"'), ("width", "2"))
+    assert isinstance(r1, tuple)
+
+    info = attr_cache_info()["parse_default"]
+    assert info["hits"] == 1 and info["misses"] == 1
+
+    s = "composite(1, 2, 0) || composite=1"
+    r1 = parser.parse_check_shape(s)
+    r2 = parser.parse_check_shape(s)
+    assert r1[0] is not r2[0]
+    assert r1[0].continued and r2[0].continued
+    assert r1[1] == r2[1] == [("composite", "1")]
+
+    r1[0].attr = "modified"
+    r1[1].append(("color", "red"))
+    r3 = parser.parse_check_shape(s)
+    assert not hasattr(r3[0], "attr")
+    assert r3[1] == [("composite", "1")]
+
+
+def test_shared_attr():
+    import copy
+    from .. import parse
+
+    global_attrs = ["source"], {"color": "green", "width": "1"}
+    attr = get_attr([("color", "red"), ("dash",)], global_attrs)
+    assert isinstance(attr[0], AttrList) and isinstance(attr[1], AttrDict)
+    assert attr[0] == ["source", "dash"]
+    assert attr[1] == {"color": "red", "width": "1"}
+    assert list(attr[1]) == ["color", "width"]
+
+    d = copy.copy(attr[1])
+    assert type(d) is dict
+    d["color"] = "blue"
+    assert attr[1]["color"] == "red"
+    try:
+        attr[1]["color"] = "blue"
+    except TypeError:
+        pass
+    else:
+        assert False
+
+    attr = get_attr([("tag", "a"), ("tag", "b")], global_attrs)
+    assert attr[1]["tag"] == frozenset(["a", "b"])
+    d = copy.copy(attr[1])
+    d["tag"].add("c")
+    assert d["tag"] == set(["a", "b", "c"])
+    assert attr[1]["tag"] == frozenset(["a", "b"])
+
+    r = parse("\n".join(["global color=green", "image",
+                         "circle(1,2,3) # color=red",
+                         "circle(4,5,6) # color=red",
+                         "circle(7,8,9)"]))
+    assert r[0].attr is r[1].attr
+    assert r[0].attr[1]["color"] == "red"
+    assert r[2].attr[1]["color"] == "green"
@@ -1,4 +1,9 @@
-from ..ds9_region_parser import RegionParser, Global
+import os
+import glob
+
+from ..ds9_region_parser import RegionParser, Global, parse_line_fast
+
+rootdir = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'examples')
 
 
 def test_regionLine():
@@ -42,3 +47,101 @@ def test_global():
     ss = rp.parseLine(s)[0]
 
     assert isinstance(ss[0], Global)
+
+def test_shared_grammar():
+    rp1, rp2 = RegionParser(), RegionParser()
+    assert rp1.parser is rp2.parser
+
+    s, c, continued = rp1.parseLine("circle(1,2,3) || # composite")
+    assert continued and c == "composite"
+
+    s, c, continued = rp2.parseLine("circle(1,2,3)")
+    assert continued is None and c is None
+
+
+def _line_summary(r):
+    s, c, continued = r
+    s = [(repr(s1), [(type(p), p.v) for p in getattr(s1, "params", [])])
+         for s1 in s]
+    return s, c, continued
+
+def test_fast_path():
+    rp = RegionParser()
+    rp.use_fast_path = False
+
+    n_fast = 0
+    for fname in glob.glob(os.path.join(rootdir, "*.reg")):
+        for l in open(fname).read().split("\n"):
+            r = parse_line_fast(l)
+            if r is None:
+                continue
+            n_fast += 1
+            assert _line_summary(r) == _line_summary(rp.parseLine(l)), l
+
+    assert n_fast > 0
+
+    assert parse_line_fast("circle(1,2,3) || # composite") is None
+    assert parse_line_fast("polygon(1,2,3)") is None
+
+def test_iter_shapes():
+    from .. import open as pyregion_open, iter_shapes
+
+    for fname in glob.glob(os.path.join(rootdir, "*.reg")):
+        r0 = pyregion_open(fname)
+        with open(fname) as f:
+            r = list(iter_shapes(f))
+        assert len(r) == len(r0)
+        for s0, s in zip(r0, r):
+            assert repr(s0) == repr(s)
+            assert s0.coord_format == s.coord_format
+            assert s0.coord_list == s.coord_list
+            assert s0.attr == s.attr
+            assert s0.comment == s.comment
+
+def test_open_workers(tmpdir):
+    from .. import open as pyregion_open
+
+    lines = []
+    for i in range(20):
+        lines.append("global color=c%d tag={t%d}" % (i, i))
+        lines.append(["image", "fk5", "galactic"][i % 3])
+        for j in range(10):
+            lines.append("circle(%d,%d,3) # width=%d" % (i, j, j))
+            lines.append("box(%d,%d,3,4,0)" % (i, j))
+    fname = str(tmpdir.join("test.reg"))
+    with open(fname, "w") as f:
+        f.write("\n".join(lines))
+
+    r0 = pyregion_open(fname)
+    r = pyregion_open(fname, workers=2)
+    assert len(r) == len(r0) == 400
+    for s0, s in zip(r0, r):
+        assert repr(s0) == repr(s)
+        assert s0.coord_format == s.coord_format
+        assert s0.coord_list == s.coord_list
+        assert s0.attr == s.attr
+
+    assert r0[0].attr[1]["tag"] == set(["t0"])
+
+def test_parse_geometry_only():
+    from .. import parse
+
+    s = "\n".join(['global color=green',
+                   'fk5',
+                   'circle(1,2,3") # color=red width=2',
+                   '-box(1,2,3",4",5)',
+                   '# composite(1,2,0) || composite=1',
+                   'image; circle(10,20,3)',
+                   '# text(1,2) text={hello}',
+                   '# a comment'])
+
+    r0 = parse(s)
+    r = parse(s, attributes=False)
+    assert [repr(s1) for s1 in r] == [repr(s1) for s1 in r0]
+    assert [s1.name for s1 in r] == ["circle", "box", "composite",
+                                     "circle", "text"]
+    for s0, s1 in zip(r0, r):
+        assert s0.coord_format == s1.coord_format
+        assert s0.exclude == s1.exclude
+        assert s0.continued == s1.continued
+        assert s1.attr == ([], {})
@@ -53,4 +53,80 @@ def test_region():
     # for reg_name in region_list:
     #     r = pyregion_open(join(rootdir,reg_name)).as_imagecoord(header)
     #     get_mask(r)
-        
\ No newline at end of file
+        
+def test_label_image():
+    from .. import parse
+
+    region_string = """image
+circle(20,20,8)
+box(25,20,10,6,30)
+-circle(22,22,3)
+polygon(40,40,60,42,50,60)
+ellipse(10,40,6,3,20)
+"""
+    r = parse(region_string)
+
+    l = r.get_label_image(shape=(70, 80))
+    assert l.dtype == np.int32
+    assert set(np.unique(l)) == set([-1, 0, 1, 3, 4])
+    assert np.all((l >= 0) == r.get_mask(shape=(70, 80)))
+
+    for i in [3, 4]:
+        assert np.all((l == i) == r[i:i+1].get_mask(shape=(70, 80)))
+
+def test_mask_nthreads():
+    from .. import parse
+    from ..shape_table import ShapeTable
+
+    r = parse("""image
+circle(20,20,8)
+box(25,90,10,60,30)
+-circle(22,22,3)
+polygon(40,40,60,42,50,160)
+ellipse(10,140,6,3,20)
+""")
+    shape = (170, 80)
+    for nthreads in [2, 4, None]:
+        assert np.all(r.get_mask(shape=shape, nthreads=nthreads) ==
+                      r.get_mask(shape=shape))
+        assert np.all(r.get_label_image(shape=shape, nthreads=nthreads) ==
+                      r.get_label_image(shape=shape))
+
+    t = ShapeTable.from_shapelist(r)
+    assert np.all(t.get_mask(shape=shape, nthreads=3) ==
+                  r.get_mask(shape=shape))
+
+def test_fractional_mask():
+    from .. import parse
+
+    r = parse("image;circle(20.3,20.1,4.2)")
+    fm = r.get_fractional_mask(shape=(40, 40), subsample=20)
+    assert abs(fm.sum() - np.pi*4.2**2) < 0.1
+    assert np.all(fm[r.get_mask(shape=(40, 40))] > 0)
+
+def test_from_arrays():
+    from .. import parse, ShapeList
+
+    r = parse("""image
+circle(20,20,8)
+circle(40,30,5)
+-circle(22,22,3)
+polygon(40,40,60,42,50,60)
+""")
+    r1 = ShapeList.from_arrays("circle", [20, 40, 22], [20, 30, 22], [8, 5, 3],
+                               coord_format="image",
+                               exclude=[False, False, True])
+    r2 = ShapeList.from_polygons([[(40, 40), (60, 42), (50, 60)]],
+                                 coord_format="image")
+    r3 = ShapeList(r1 + r2)
+
+    assert [s.coord_list for s in r3] == [s.coord_list for s in r]
+    assert np.all(r3.get_mask(shape=(70, 80)) == r.get_mask(shape=(70, 80)))
+
+    assert len(ShapeList.from_arrays("circle", [], [], [])) == 0
+    assert len(ShapeList.from_polygons([])) == 0
+
+    r = parse("fk5;box(10.5,-20,0.01,0.02,30)")
+    r1 = ShapeList.from_arrays("box", 10.5, -20, 0.01, 0.02, 30)
+    assert r1[0].coord_format == r[0].coord_format
+    assert r1[0].coord_list == r[0].coord_list
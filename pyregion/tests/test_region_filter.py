@@ -0,0 +1,185 @@
+import numpy as np
+import pytest
+
+import pyregion._region_filter as region_filter
+
+
+def _point_mask(f, shape):
+    ny, nx = shape
+    y, x = np.indices(shape)
+    return f.inside_x_y(x.ravel().astype("d"),
+                        y.ravel().astype("d")).reshape(shape)
+
+
+def _test_regions():
+    Circle, Ellipse, Box = (region_filter.Circle, region_filter.Ellipse,
+                            region_filter.Box)
+    Polygon, AngleRange = region_filter.Polygon, region_filter.AngleRange
+    Rotated, Translated = region_filter.Rotated, region_filter.Translated
+
+    annulus = Circle(30, 25, 12) & ~Circle(30, 25, 5)
+
+    return [Circle(10, 12, 3),
+            Circle(-5, 20, 10),
+            Circle(70, 70, 3),
+            Ellipse(30, 20, 10, 4),
+            Rotated(Ellipse(30, 20, 10, 4), 35, 30, 20),
+            Rotated(Box(25, 30, 20, 6), 30, 25, 30),
+            Rotated(Box(25, 30, 20, 6), 180, 25, 30),
+            Rotated(Polygon([3, 40, 20], [2, 10, 40]), 20, 25, 20),
+            Translated(Box(10, 10, 4, 4), 5.5, 3),
+            Polygon([3, 40, 20, 35], [2, 10, 40, 38]),
+            annulus,
+            annulus & AngleRange(30, 25, 20, 160),
+            ~Circle(30, 30, 8),
+            Circle(10, 10, 5) | Circle(40, 30, 6),
+            ~Circle(10, 10, 5) | ~Circle(40, 30, 6),
+            ~Circle(20, 20, 10) | Box(50, 20, 4, 4),
+            ~(Circle(20, 20, 15) & ~Box(20, 20, 8, 8)),
+            region_filter.RegionOrList(),
+            region_filter.RegionAndList(),
+            ]
+
+
+def test_bbox():
+    c = region_filter.Circle(10, 12, 3)
+    assert c.bbox() == (7, 9, 13, 15)
+
+    b = region_filter.Translated(region_filter.Box(10, 10, 4, 2), 1, 2)
+    assert b.bbox() == (9, 11, 13, 13)
+
+    x1, y1, x2, y2 = region_filter.AngleRange(0, 0, 10, 20).bbox()
+    assert np.isinf([x1, y1, x2, y2]).all()
+
+
+def test_mask_bbox_clipped():
+    shape = (50, 60)
+    for f in _test_regions():
+        m = f.mask(shape)
+        assert m.dtype == np.bool_
+        assert np.all(m == _point_mask(f, shape)), repr(f)
+
+
+def test_mask_scanline():
+    shape = (50, 60)
+    for f in _test_regions():
+        m = f.mask(shape, method="scanline")
+        assert np.all(m == f.mask(shape, method="point")), repr(f)
+
+
+def test_mask_nthreads():
+    shape = (500, 60)
+    y, x = np.indices(shape).astype("d")
+    for f in _test_regions():
+        for method in ["scanline", "point"]:
+            m = f.mask(shape, method=method, nthreads=4)
+            assert np.all(m == f.mask(shape, method=method)), repr(f)
+
+        r = f.inside(x.ravel(), y.ravel(), nthreads=4)
+        assert np.all(r == f.inside(x.ravel(), y.ravel())), repr(f)
+
+    f = region_filter.Circle(10, 12, 3)
+    assert np.all(f.mask(shape, nthreads=None) == f.mask(shape, nthreads=0))
+    with pytest.raises(ValueError):
+        f.mask(shape, nthreads=-1)
+
+
+def test_mask_slices():
+    shape = (50, 60)
+    data = np.arange(50*60, dtype="d").reshape(shape)
+    for f in _test_regions():
+        m = f.mask(shape)
+        s = f.mask(shape, format="slices")
+        assert np.all(s.to_mask() == m), repr(f)
+        assert s.npix == m.sum()
+        assert np.all(s.values(data) == data[m])
+        assert s.sum(data) == data[m].sum()
+
+    # empty masks
+    full = ~region_filter.RegionOrList()
+    for f, shape in [(full, (0, 60)), (full, (50, 0)),
+                     (region_filter.RegionOrList(), (50, 60))]:
+        s = f.mask(shape, format="slices")
+        assert s.npix == 0
+        assert np.isnan(s.mean(np.ones(shape)))
+        assert np.isnan(s.mean(np.ones((2,) + shape))).all()
+
+
+def test_mask_packed():
+    from ..mask_helper import (unpack_mask, packed_and, packed_or,
+                               packed_not, packed_count)
+
+    shape = (50, 61)
+    regions = _test_regions()
+    for f in regions:
+        m = f.mask(shape)
+        for method in ["scanline", "point"]:
+            p = f.mask(shape, method=method, format="packed")
+            assert p.dtype == np.uint8
+            assert np.all(p == np.packbits(m, axis=1)), repr(f)
+        assert np.all(unpack_mask(p, shape) == m)
+        assert packed_count(p) == m.sum()
+
+    p1, p2 = [f.mask(shape, format="packed") for f in regions[:2]]
+    m1, m2 = [f.mask(shape) for f in regions[:2]]
+    assert np.all(unpack_mask(packed_and(p1, p2), shape) == (m1 & m2))
+    assert np.all(unpack_mask(packed_or(p1, p2), shape) == (m1 | m2))
+    assert np.all(packed_not(p1, shape) == np.packbits(~m1, axis=1))
+
+
+def test_fractional_mask():
+    shape = (50, 60)
+    n = 3
+    y, x = np.indices((shape[0]*n, shape[1]*n)).astype("d")
+    x, y = (x + 0.5)/n - 0.5, (y + 0.5)/n - 0.5
+    for f in _test_regions():
+        fm = f.fractional_mask(shape, subsample=n)
+        assert fm.dtype == np.float32
+
+        m = f.inside(x.ravel(), y.ravel()).reshape(x.shape)
+        fm2 = m.reshape(shape[0], n, shape[1], n).mean(axis=(1, 3))
+        assert np.allclose(fm, fm2), repr(f)
+
+        assert np.all(f.fractional_mask(shape, subsample=1) == f.mask(shape))
+
+
+def test_mask_tangent_spans():
+    # the inner circle touches single pixels of the rows y=7 and y=13
+    Circle = region_filter.Circle
+    annulus = Circle(10, 10, 5) & ~Circle(10, 10, 3)
+    for f in [~annulus, Circle(10, 10, 20) & ~annulus, ~~annulus]:
+        m = f.mask((25, 25), method="scanline")
+        assert np.all(m == f.mask((25, 25), method="point")), repr(f)
+        assert np.all(m == _point_mask(f, (25, 25))), repr(f)
+
+
+def _random_region(rng, depth):
+    # shapes on integer positions, with integer sizes, so that their
+    # edges are tangent to each other and go through the pixel centers
+    k = rng.randint(6 if depth > 0 else 3)
+    if k == 0:
+        return region_filter.Circle(rng.randint(5, 15), rng.randint(5, 15),
+                                    rng.randint(0, 8))
+    if k == 1:
+        return region_filter.Box(rng.randint(5, 15), rng.randint(5, 15),
+                                 2*rng.randint(0, 6), 2*rng.randint(0, 6))
+    if k == 2:
+        x, y = rng.randint(0, 20, size=(2, 3))
+        return region_filter.Polygon(x.astype("d"), y.astype("d"))
+    if k == 3:
+        return ~_random_region(rng, depth - 1)
+
+    children = [_random_region(rng, depth - 1)
+                for i in range(rng.randint(1, 4))]
+    if k == 4:
+        return region_filter.RegionAndList(*children)
+    return region_filter.RegionOrList(*children)
+
+
+def test_mask_scanline_random():
+    rng = np.random.RandomState(0)
+    shape = (21, 22)
+    for i in range(500):
+        f = _random_region(rng, 4)
+        m = f.mask(shape, method="scanline")
+        assert np.all(m == f.mask(shape, method="point")), repr(f)
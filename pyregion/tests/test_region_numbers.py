@@ -54,3 +54,21 @@ def test_coord_odd():
 
     s1 = s("32:24:32.2s")[0]
     assert isinstance(s1, HMS)
+
+
+def test_slots():
+    from ..region_numbers import (SimpleNumber, SimpleInteger, DMS,
+                                  AngularDistance, simple_number)
+    from ..parser_helper import Shape
+
+    objs = [SimpleNumber("1.5"), SimpleInteger("+3"),
+            HMS(["", "12", ":", "30"]), DMS(["-", "12", "d"]),
+            AngularDistance(["2", '"']), Shape("circle", [])]
+    for o in objs:
+        assert not hasattr(o, "__dict__"), o
+
+    for t in ["1.5", "1", "-2.50", "1e3", "303.991867", "+4"]:
+        n = simple_number.parseString(t)[0]
+        assert n.text == t and n.v == float(t)
+    assert SimpleInteger("+3").text == "+3"
+    assert SimpleInteger("3").text == "3"
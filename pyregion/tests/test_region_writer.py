@@ -0,0 +1,89 @@
+import os
+import io
+import glob
+
+import numpy as np
+
+from .. import open as pyregion_open
+from .. import parse, iter_shapes, write_region, ShapeList
+from ..shape_table import ShapeTable
+
+rootdir = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'examples')
+
+
+def _strip_attr(attr):
+    # some attribute values have a trailing space
+    return dict((k, v.strip() if isinstance(v, str) else v)
+                for k, v in attr.items())
+
+
+def _assert_same(r, r2, atol):
+    assert len(r) == len(r2)
+    for s, s2 in zip(r, r2):
+        assert s.name == s2.name
+        assert s.coord_format == s2.coord_format
+        assert s.exclude == s2.exclude
+        assert bool(s.continued) == bool(s2.continued)
+        assert np.allclose(s.coord_list, s2.coord_list, atol=atol)
+        assert list(s.attr[0]) == list(s2.attr[0])
+        assert _strip_attr(s.attr[1]) == _strip_attr(s2.attr[1])
+
+
+def test_write_roundtrip():
+    for fname in glob.glob(os.path.join(rootdir, "*.reg")):
+        r = pyregion_open(fname)
+        for sexagesimal in [False, True]:
+            out = io.StringIO()
+            write_region(r, out, sexagesimal=sexagesimal, chunk_size=3)
+            _assert_same(r, parse(out.getvalue()), atol=1.e-5)
+
+
+def test_write_sexagesimal():
+    out = io.StringIO()
+    write_region(parse('fk5;circle(13:29:52.698,-47:11:42.93,3.2")'), out,
+                 sexagesimal=True)
+    assert out.getvalue().splitlines()[-1] == \
+           'circle(13:29:52.6980,-47:11:42.930,3.200")'
+
+    out = io.StringIO()
+    write_region(parse("fk5;point(359.9999999999,-0.0000000001)"), out,
+                 sexagesimal=True, precision=3)
+    assert out.getvalue().splitlines()[-1] == "point(00:00:00.0,+00:00:00)"
+
+    out = io.StringIO()
+    r = ShapeList.from_arrays("circle", [-1.], [-0.5], [0.001])
+    write_region(r, out, sexagesimal=True)
+    assert out.getvalue().splitlines()[-1] == \
+           'circle(23:56:00.0000,-00:30:00.000,3.600")'
+    assert np.allclose(parse(out.getvalue())[0].coord_list,
+                       [359., -0.5, 0.001])
+
+
+def test_write_globals():
+    r = parse("""global color=green width=2
+image
+circle(1,2,3)
+global color=blue
+circle(4,5,6) # width=3
+point(1,1)
+global font="times 10%"
+point(2,2) # text={a%b}
+""")
+    for chunk_size in [1, 2, 10]:
+        out = io.StringIO()
+        write_region(r, out, chunk_size=chunk_size)
+        assert out.getvalue().count("global ") == 3
+        _assert_same(r, parse(out.getvalue()), atol=1.e-6)
+
+
+def test_write_streaming(tmpdir):
+    fname = str(tmpdir.join("test.reg"))
+    r = pyregion_open(os.path.join(rootdir, "test_context.reg"))
+
+    for shapes in [r, ShapeTable.from_shapelist(r),
+                   iter_shapes(os.path.join(rootdir, "test_context.reg"))]:
+        write_region(shapes, fname, chunk_size=5)
+        _assert_same(r, pyregion_open(fname), atol=1.e-6)
+
+    r.write(fname, precision=2)
+    _assert_same(r, pyregion_open(fname), atol=0.005)
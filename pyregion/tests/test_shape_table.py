@@ -0,0 +1,91 @@
+import numpy as np
+
+from .. import parse
+from ..shape_table import ShapeTable
+from ..region_to_filter import as_region_filter
+
+
+region_string = """
+global color=green
+image
+circle(30,30,10) # color=red
+-box(30,30,5,5,30)
+polygon(10,10,40,12,25,40)
+ellipse(60,20,10,5,8,4,30) # tag={a}
+# composite(50,50,0) ||
+circle(50,50,5) ||
+annulus(50,50,2,4)
+"""
+
+
+def test_shape_table():
+    r = parse(region_string)
+    t = ShapeTable.from_shapelist(r)
+
+    assert len(t) == len(r)
+    assert t.coords.dtype == np.float64
+    assert len(t.coords) == sum(len(s.coord_list) for s in r)
+    assert t.check_imagecoord()
+
+    for s, s1 in zip(r, t):
+        assert s1.name == s.name
+        assert s1.coord_list == s.coord_list
+        assert s1.coord_format == s.coord_format
+        assert s1.exclude == s.exclude
+        assert s1.continued == bool(s.continued)
+        assert s1.attr == s.attr
+
+    r2 = t.to_shapelist()
+    assert [s.name for s in r2] == [s.name for s in r]
+    assert [s.coord_list for s in r2] == [s.coord_list for s in r]
+    assert [s.exclude for s in r2] == [s.exclude for s in r]
+
+    shape = (60, 80)
+    m = r.get_mask(shape=shape)
+    assert np.all(as_region_filter(t).mask(shape) == m)
+    assert np.all(t.get_mask(shape=shape) == m)
+
+
+def test_shape_table_physical():
+    t = ShapeTable.from_shapelist(parse("physical\ncircle(1,2,3)"))
+    assert not t.check_imagecoord()
+    try:
+        t.get_filter()
+    except RuntimeError:
+        pass
+    else:
+        assert False
+
+
+def test_to_arrays():
+    r = parse(region_string + "polygon(1,2,3,4,5,6,7,8)\ncircle(1,2,3)\n")
+    a = r.to_arrays()
+
+    assert sorted(a) == sorted(set(s.name for s in r))
+    assert sorted(np.concatenate([d["index"] for d in a.values()])) == \
+           list(range(len(r)))
+
+    c = a["circle"]
+    assert list(c["index"]) == [0, 5, 8]
+    assert c["coords"].shape == (3, 3)
+    assert list(c["radius"]) == [10, 5, 3]
+    assert list(a["box"]["exclude"]) == [True]
+    assert list(c["coord_format"]) == ["image"] * 3
+
+    p = a["polygon"]
+    assert list(p["offsets"]) == [0, 3, 7]
+    for i, k in enumerate(p["index"]):
+        vertices = p["vertices"][p["offsets"][i]:p["offsets"][i+1]]
+        assert vertices.ravel().tolist() == r[k].coord_list
+
+    e = a["ellipse"]
+    assert list(e["x"]) == [60] and list(e["angle"]) == [30]
+    assert e["radii"].tolist() == [[10, 5], [8, 4]]
+    assert list(a["annulus"]["radii"]) == [2, 4]
+    assert list(a["composite"]["coords"]) == [50, 50, 0]
+
+    # a single shape type is not copied
+    t = ShapeTable.from_shapelist(parse("image;circle(1,2,3);circle(4,5,6)"))
+    c = t.to_arrays()["circle"]
+    assert np.shares_memory(c["x"], t.coords)
+    assert list(c["y"]) == [2, 5]
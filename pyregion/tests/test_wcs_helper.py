@@ -33,3 +33,196 @@ def test_estimate_cdelt():
     reg = parse(region_string).as_imagecoord(wcs)
 
     assert np.allclose([reg[0].coord_list[-1]], [0.5/0.1])
+
+
+def test_estimate_cdelt_array():
+    wcs = pywcs.WCS(naxis=2)
+
+    wcs.wcs.crpix = [5.5, 5.5]
+    wcs.wcs.cdelt = [0.1, -0.1]
+    wcs.wcs.crval = [10, 60]
+    wcs.wcs.ctype = ["RA---TAN", "DEC--TAN"]
+
+    import pyregion.wcs_helper as wcs_helper
+    proj = wcs_helper.get_kapteyn_projection(wcs)
+
+    x, y = [1., 5.5, 100.], [3., 5.5, -50.]
+    cdelt = wcs_helper.estimate_cdelt_array(proj, x, y)
+    assert cdelt.shape == (3,)
+    assert np.allclose(cdelt[1], 0.1)
+    for x1, y1, c1 in zip(x, y, cdelt):
+        assert wcs_helper.estimate_cdelt(proj, x1, y1) == c1
+
+
+def test_local_scale_cache():
+    wcs = pywcs.WCS(naxis=2)
+
+    wcs.wcs.crpix = [5.5, 5.5]
+    wcs.wcs.cdelt = [0.1, -0.1]
+    wcs.wcs.crval = [10, 60]
+    wcs.wcs.ctype = ["RA---TAN", "DEC--TAN"]
+
+    import pyregion.wcs_helper as wcs_helper
+    proj = wcs_helper.get_kapteyn_projection(wcs)
+
+    # not cached by default
+    x, y = np.array([1., 1.2, 100.]), np.array([3., 3.1, -50.])
+    cdelt = wcs_helper.estimate_cdelt_array(proj, x, y)
+    assert cdelt[0] != cdelt[1]
+    assert len(proj.get_local_scale_cache()) == 0
+
+    proj.local_scale_quantum = 1.
+    cdelt2 = wcs_helper.estimate_cdelt_array(proj, x, y)
+    assert cdelt2[0] == cdelt2[1]
+    assert np.allclose(cdelt, cdelt2)
+    assert proj.get_local_scale_cache().info()["currsize"] == 2
+
+    wcs_helper.estimate_cdelt_array(proj, x, y)
+    assert proj.get_local_scale_cache().info()["hits"] == 3
+
+    # the scalar version is exact
+    assert wcs_helper.estimate_cdelt(proj, x[1], y[1]) == cdelt[1]
+
+    proj.clear_local_scale_cache()
+    assert len(proj.get_local_scale_cache()) == 0
+
+
+def test_local_scale_cache_angle():
+    wcs = pywcs.WCS(naxis=2)
+
+    wcs.wcs.crpix = [5.5, 5.5]
+    wcs.wcs.cdelt = [0.1, -0.1]
+    wcs.wcs.crval = [10, 60]
+    wcs.wcs.ctype = ["RA---TAN", "DEC--TAN"]
+
+    import pyregion.wcs_helper as wcs_helper
+    proj = wcs_helper.get_kapteyn_projection(wcs)
+    sky_to_sky = wcs_helper.sky2sky("fk5", "fk4")
+
+    x, y = np.array([1., 1.2, 100.]), np.array([3., 3.1, -50.])
+    a1, a2 = wcs_helper.estimate_angle_array(proj, x, y, sky_to_sky)
+
+    # the cdelt given is used for the values not in the cache
+    proj.local_scale_quantum = 1.
+    cdelt = wcs_helper.estimate_cdelt_array(proj, x, y)
+    b1, b2 = wcs_helper.estimate_angle_array(proj, x, y, sky_to_sky,
+                                             cdelt=cdelt*1000.)
+    proj.clear_local_scale_cache()
+    c1, c2 = wcs_helper.estimate_angle_array(proj, x, y, sky_to_sky,
+                                             cdelt=cdelt)
+    assert np.allclose([a1, a2], [c1, c2], atol=0.1)
+    assert not np.allclose([b1, b2], [c1, c2], atol=0.1)
+
+    # the scalar version is exact
+    assert wcs_helper.estimate_angle(proj, x[1], y[1], sky_to_sky) == \
+           (a1[1], a2[1])
+
+
+def test_local_scale_cache_shared():
+    try:
+        from astropy.io import fits as pyfits
+    except ImportError:
+        import pyfits
+
+    import pyregion.wcs_helper as wcs_helper
+
+    h = pyfits.Header()
+    h["NAXIS"] = 2
+    h["CTYPE1"], h["CTYPE2"] = "RA---TAN", "DEC--TAN"
+    h["CRPIX1"], h["CRPIX2"] = 5.5, 5.5
+    h["CDELT1"], h["CDELT2"] = 0.1, -0.1
+    h["CRVAL1"], h["CRVAL2"] = 10., 60.
+
+    wcs_helper.clear_wcs_cache()
+    p1 = wcs_helper.get_kapteyn_projection(h)
+    p1.local_scale_quantum = 1.
+    wcs_helper.estimate_cdelt_array(p1, [1.], [3.])
+
+    p2 = wcs_helper.get_kapteyn_projection(h.copy())
+    p2.local_scale_quantum = 1.
+    assert p2.get_local_scale_cache() is p1.get_local_scale_cache()
+    wcs_helper.estimate_cdelt_array(p2, [1.2], [3.1])
+    assert p2.get_local_scale_cache().info()["hits"] == 1
+
+    p2.local_scale_quantum = 2.
+    assert p2.get_local_scale_cache() is not p1.get_local_scale_cache()
+
+
+def test_topixel():
+    wcs = pywcs.WCS(naxis=2)
+
+    wcs.wcs.crpix = [5.5, 5.5]
+    wcs.wcs.cdelt = [0.1, -0.1]
+    wcs.wcs.crval = [10, 60]
+    wcs.wcs.ctype = ["RA---TAN", "DEC--TAN"]
+
+    import pyregion.wcs_helper as wcs_helper
+    proj = wcs_helper.get_kapteyn_projection(wcs)
+
+    lon = np.array([10., 11., 9.5, 10.2, 200.])
+    lat = np.array([60., 59.5, 60.3, 61., -60.])
+    x, y = proj.topixel((lon, lat))
+
+    for lon1, lat1, x1, y1 in zip(lon, lat, x, y):
+        xy1 = wcs.wcs_world2pix([[lon1, lat1]], 1)[0]
+        assert np.allclose(xy1, [x1, y1], equal_nan=True)
+
+
+def test_sky2sky_cache():
+    import pyregion.wcs_helper as wcs_helper
+
+    wcs_helper.clear_skymatrix_cache()
+    t1 = wcs_helper.sky2sky("fk5", "gal")
+    t2 = wcs_helper.sky2sky(wcs_helper.FK5, wcs_helper.GAL)
+    assert t1._skymatrix is t2._skymatrix
+    assert t1.inverted()._skymatrix is t2.inverted()._skymatrix
+    assert len(wcs_helper._skymatrix_cache) == 2
+
+
+def test_wcs_cache():
+    try:
+        from astropy.io import fits as pyfits
+    except ImportError:
+        import pyfits
+
+    import pyregion.wcs_helper as wcs_helper
+
+    h = pyfits.Header()
+    h["NAXIS"] = 2
+    h["CTYPE1"], h["CTYPE2"] = "RA---TAN", "DEC--TAN"
+    h["CRVAL1"], h["CRVAL2"] = 10., 60.
+    h["OBJECT"] = "test"
+
+    key = wcs_helper.wcs_header_key(h)
+    h2 = h.copy()
+    h2["OBJECT"] = "test2"
+    assert wcs_helper.wcs_header_key(h2) == key
+    h2["CRVAL1"] = 11.
+    assert wcs_helper.wcs_header_key(h2) != key
+    assert wcs_helper.wcs_header_key(pywcs.WCS(naxis=2)) is None
+
+    wcs_helper.clear_wcs_cache()
+    pc = wcs_helper.get_physical_coordinate(h)
+    assert wcs_helper.get_physical_coordinate(h.copy()) is pc
+    info = wcs_helper.wcs_cache_info()["physical_coordinate"]
+    assert (info["hits"], info["misses"], info["currsize"]) == (1, 1, 1)
+
+    wcs_helper.clear_wcs_cache()
+    assert wcs_helper.wcs_cache_info()["physical_coordinate"]["currsize"] == 0
+
+
+def test_projection_not_shared():
+    import pyregion.wcs_helper as wcs_helper
+
+    wcs = pywcs.WCS(naxis=2)
+    wcs.wcs.ctype = ["RA---TAN", "DEC--TAN"]
+
+    wcs_helper.clear_wcs_cache()
+    p1 = wcs_helper.get_kapteyn_projection(wcs)
+    p1.constant_local_scale = True
+    p1.set_lon_ref(0)
+    p2 = wcs_helper.get_kapteyn_projection(wcs)
+    assert p2 is not p1
+    assert not p2.constant_local_scale
+    assert p2._lon_ref is None
+    assert p2.get_local_scale_cache() is not p1.get_local_scale_cache()
@@ -1,10 +1,13 @@
 from .wcs_helper import estimate_cdelt, estimate_angle
+from .wcs_helper import estimate_cdelt_array, estimate_angle_array, sky2sky
 from .region_numbers import CoordOdd, CoordEven, Distance, Angle
 from .parser_helper import Shape, CoordCommand
 from .region_numbers import SimpleNumber, SimpleInteger
 
 import copy
 
+import numpy as np
+
 
 def convert_to_imagecoord(cl, fl, wcs_proj, sky_to_sky, xy0, rot_wrt_axis=1):
     fl0 = fl
@@ -45,6 +48,132 @@ def convert_to_imagecoord(cl, fl, wcs_proj, sky_to_sky, xy0, rot_wrt_axis=1):
     return new_cl, xy0
 
 
+def expand_arg_types(fl, args_repeat, n):
+    """
+    Returns the type of each of the n coordinates of a shape, given
+    its argument list and repeat range (see wcs_shape).
+    """
+    def _cycle(fl1, n1):
+        if n1 <= 0:
+            return []
+        return [fl1[i % len(fl1)] for i in range(n1)]
+
+    if args_repeat:
+        n1, n2 = args_repeat
+    else:
+        n1, n2 = 0, n
+
+    nn2 = n - (len(fl) - n2)
+
+    return _cycle(fl[:n1], n1) + _cycle(fl[n1:n2], nn2 - n1) + \
+           _cycle(fl[n2:], n - nn2)
+
+
+def convert_to_imagecoord_batch(cl_list, fl_list, src_list, wcs_proj,
+                                rot_wrt_axis=1):
+    """
+    Batched version of convert_to_imagecoord for a list of shapes.
+
+    cl_list : coordinate lists of the shapes
+    fl_list : type of each coordinate (see expand_arg_types)
+    src_list : sky coordinate system of each shape
+
+    All the positions are converted with one sky2sky call per source
+    coordinate system and a single wcs_proj.topixel call. Local pixel
+    scales and angles are estimated for all the reference positions
+    at once. Returns the list of the new coordinate lists.
+    """
+
+    tgt = wcs_proj.radesys
+
+    # collect the positions, and the distances and angles along with
+    # the index of their reference position (the last position before
+    # them in the same shape).
+    lon, lat, pos_src = [], [], []
+    pos_index, dist_index, angle_index = [], [], []
+
+    for i, (cl, fl, src) in enumerate(zip(cl_list, fl_list, src_list)):
+        ref = None
+        k = 0
+        while k < len(cl):
+            if fl[k] == CoordOdd and k + 1 < len(cl) and fl[k+1] == CoordEven:
+                ref = len(lon)
+                lon.append(cl[k])
+                lat.append(cl[k+1])
+                pos_src.append(src)
+                pos_index.append((i, k))
+                k += 2
+                continue
+            elif fl[k] == Distance or fl[k] == Angle:
+                if ref is None:
+                    raise ValueError("no reference position for the distance or angle")
+                if fl[k] == Distance:
+                    dist_index.append((i, k, ref))
+                else:
+                    angle_index.append((i, k, ref))
+            k += 1
+
+    new_cl_list = [list(cl) for cl in cl_list]
+
+    if not lon:
+        return new_cl_list
+
+    lon = np.array(lon, dtype="d")
+    lat = np.array(lat, dtype="d")
+
+    sky_to_sky_dict = {}
+    for src in set(pos_src):
+        sky_to_sky_dict[src] = sky2sky(src, tgt)
+
+    if len(sky_to_sky_dict) > 1:
+        for src, sky_to_sky in sky_to_sky_dict.items():
+            msk = np.array([s == src for s in pos_src], dtype=bool)
+            lon[msk], lat[msk] = sky_to_sky(lon[msk], lat[msk])
+    else:
+        sky_to_sky, = sky_to_sky_dict.values()
+        lon, lat = sky_to_sky(lon, lat)
+
+    x, y = wcs_proj.topixel((lon, lat))
+    x, y = np.asarray(x), np.asarray(y)
+
+    for p, (i, k) in enumerate(pos_index):
+        new_cl_list[i][k:k+2] = [x[p], y[p]]
+
+    if dist_index or angle_index:
+        refs = sorted(set([ref for (i, k, ref) in dist_index + angle_index]))
+        refs = np.array(refs, dtype=int)
+        cdelt = estimate_cdelt_array(wcs_proj, x[refs], y[refs])
+        cdelt_dict = dict(zip(refs, cdelt))
+
+        for i, k, ref in dist_index:
+            new_cl_list[i][k] = cl_list[i][k]/cdelt_dict[ref]
+
+    if angle_index:
+        angle_refs = {}
+        for i, k, ref in angle_index:
+            angle_refs.setdefault(pos_src[ref], set()).add(ref)
+
+        rot_dict = {}
+        for src, refs in angle_refs.items():
+            refs = np.array(sorted(refs), dtype=int)
+            cdelt = np.array([cdelt_dict[r] for r in refs])
+            rot1, rot2 = estimate_angle_array(wcs_proj, x[refs], y[refs],
+                                              sky_to_sky_dict[src],
+                                              cdelt=cdelt)
+            rot_dict.update(zip(refs, zip(rot1, rot2)))
+
+        for i, k, ref in angle_index:
+            rot1, rot2 = rot_dict[ref]
+            if rot_wrt_axis == 1:
+                # use the angle between the X axis and North
+                new_cl_list[i][k] = cl_list[i][k]+rot1-180.
+            else:
+                # use the angle between the Y axis and North
+                new_cl_list[i][k] = cl_list[i][k]+rot2-90.
+
+    return new_cl_list
+
+
 def convert_physical_to_imagecoord(cl, fl, pc):
     fl0 = fl
     new_cl = []
@@ -89,8 +218,7 @@ def check_wcs_and_convert(args, all_dms=False):
     return is_wcs, value_list
 
 
-def check_wcs(l):
-    default_coord = "physical"
+def check_wcs(l, default_coord="physical"):
 
     for l1, c1 in l:
         if isinstance(l1, CoordCommand):
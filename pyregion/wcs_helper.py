@@ -1,7 +1,11 @@
+import threading
+from collections import OrderedDict
+
 import numpy as np
 
 from .kapteyn_celestial import skymatrix, longlat2xyz, dotrans, xyz2longlat
 from . import kapteyn_celestial
+from .cache_helper import _LRUCache
 
 pywcs = None
 
@@ -60,6 +64,38 @@ def is_string_like(obj):
     return True
 
 
+# The transformation matrices of sky2sky are memoized by the source
+# and destination sky definitions (which include the epochs of the
+# equatorial systems), and shared across calls and threads.
+
+_skymatrix_cache = {}
+_skymatrix_lock = threading.Lock()
+
+
+def get_skymatrix(src, dest):
+    """
+    returns kapteyn_celestial.skymatrix(src, dest), which is computed
+    only once for each (src, dest).
+    """
+    key = (src, dest)
+    try:
+        hash(key)
+    except TypeError:
+        return skymatrix(src, dest)
+
+    with _skymatrix_lock:
+        m = _skymatrix_cache.get(key)
+        if m is None:
+            m = skymatrix(src, dest)
+            _skymatrix_cache[key] = m
+    return m
+
+
+def clear_skymatrix_cache():
+    with _skymatrix_lock:
+        _skymatrix_cache.clear()
+
+
 class sky2sky(object):
     def __init__(self, src, dest):
 
@@ -71,7 +107,7 @@ class sky2sky(object):
 
         self.src = src
         self.dest = dest
-        self._skymatrix = skymatrix(src, dest)
+        self._skymatrix = get_skymatrix(src, dest)
         #self.tran = wcs.Transformation(src, dest)
 
     def inverted(self):
@@ -166,8 +202,25 @@ class ProjectionBase(object):
     A wrapper for kapteyn.projection or pywcs
     """
 
+    # The array versions of estimate_cdelt and estimate_angle can
+    # cache the local pixel scale and angle, evaluated at positions
+    # quantized to local_scale_quantum pixels (e.g., 1.), at the cost
+    # of that approximation. If constant_local_scale is True, the
+    # scale and angle are assumed to be the same everywhere (e.g., for
+    # linear or small-field WCS), and are estimated only once. Both
+    # are off by default. Projections of the same fits header (see
+    # get_kapteyn_projection) share their cache.
+    local_scale_quantum = None
+    local_scale_cache_size = 65536
+    constant_local_scale = False
+
+    # hash of the WCS keywords of the header, set by
+    # get_kapteyn_projection
+    _wcs_key = None
+
     def __init__(self):
         self._lon_ref = None
+        self._local_scale_cache = None
 
         for i, ct in enumerate(self.ctypes):
             ct = ct.upper()
@@ -180,6 +233,25 @@ class ProjectionBase(object):
     def get_lon(self):
         pass
 
+    def get_local_scale_cache(self):
+        with _local_scale_lock:
+            if self._wcs_key is None:
+                if getattr(self, "_local_scale_cache", None) is None:
+                    self._local_scale_cache = \
+                        _LRUCache(self.local_scale_cache_size)
+                return self._local_scale_cache
+
+            key = (self._wcs_key, self.local_scale_quantum,
+                   self.constant_local_scale)
+            cache = _local_scale_caches.get(key)
+            if cache is None:
+                cache = _LRUCache(self.local_scale_cache_size)
+                _local_scale_caches.put(key, cache)
+            return cache
+
+    def clear_local_scale_cache(self):
+        self.get_local_scale_cache().clear()
+
 
     def set_lon_ref(self, ref):
         self._lon_ref = ref
@@ -254,6 +326,32 @@ class _ProjectionSubInterface:
         return self.substitute(axis_nums_to_keep, [0] * self.naxis)
 
 
+def _pywcs_from_header(header):
+    # We can't check the header type using isinstance since we don't know
+    # if it comes from PyFITS or Astropy, so instead we check if it has
+    # the 'ascard' attribute that both header classes define.
+
+    if hasattr(header, 'ascard'):
+
+        header = fix_header(header)
+
+        # Since we don't know if PyFITS or PyWCS are from Astropy, and the
+        # WCS object in PyWCS and Astropy both accept a string
+        # representation of the header, we use this instead (both
+        # internally use `repr(header.ascard)` which returns str,
+        # and is compatible with Python 3
+
+        header = repr(header.ascard).encode('latin1')
+
+        return pywcs.WCS(header=header)
+
+    elif hasattr(header, "wcs"):
+        return header
+    else:
+
+        raise ValueError("header must be an instance of pyfits.Header or astropy.io.fits.Header")
+
+
 class ProjectionPywcsNd(_ProjectionSubInterface, ProjectionBase):
     """
     A wrapper for pywcs
@@ -263,29 +361,7 @@ class ProjectionPywcsNd(_ProjectionSubInterface, ProjectionBase):
         header could be pyfits.Header instance of pywcs.WCS instance.
         """
 
-        # We can't check the header type using isinstance since we don't know
-        # if it comes from PyFITS or Astropy, so instead we check if it has
-        # the 'ascard' attribute that both header classes define.
-
-        if hasattr(header, 'ascard'):
-
-            header = fix_header(header)
-
-            # Since we don't know if PyFITS or PyWCS are from Astropy, and the
-            # WCS object in PyWCS and Astropy both accept a string
-            # representation of the header, we use this instead (both
-            # internally use `repr(header.ascard)` which returns str,
-            # and is compatible with Python 3
-
-            header = repr(header.ascard).encode('latin1')
-
-            self._pywcs = pywcs.WCS(header=header)
-
-        elif hasattr(header, "wcs"):
-            self._pywcs = header
-        else:
-
-            raise ValueError("header must be an instance of pyfits.Header or astropy.io.fits.Header")
+        self._pywcs = _pywcs_from_header(header)
 
         ProjectionBase.__init__(self)
 
@@ -314,11 +390,23 @@ class ProjectionPywcsNd(_ProjectionSubInterface, ProjectionBase):
 
         xy1 = lon_lat.transpose()
 
-        # somehow, wcs_world2pix does not work for some cases
-        xy21 = [self._pywcs.wcs_world2pix([xy11], 1)[0] for xy11 in xy1]
-        #xy21 = self._pywcs.wcs_world2pix(xy1, 1)
+        # somehow, wcs_world2pix does not work for some cases. The
+        # whole array is converted at once, and only the points for
+        # which it fails (an exception, or non-finite results for
+        # finite input) are converted one by one.
+        try:
+            xy21 = np.array(self._pywcs.wcs_world2pix(xy1, 1), dtype="d")
+        except ValueError: # includes WcsError
+            bad = np.ones(len(xy1), dtype=bool)
+            xy21 = np.empty(xy1.shape, dtype="d")
+        else:
+            bad = ~np.all(np.isfinite(xy21), axis=-1) & \
+                  np.all(np.isfinite(xy1), axis=-1)
+
+        for i in np.nonzero(bad)[0]:
+            xy21[i] = self._pywcs.wcs_world2pix([xy1[i]], 1)[0]
 
-        xy2 = np.array(xy21).transpose()
+        xy2 = xy21.transpose()
         return xy2
 
     def toworld(self, xy):
@@ -538,16 +626,112 @@ class ProjectionSimple(ProjectionBase):
 
 ProjectionDefault = ProjectionPywcsNd
 
+# The pywcs.WCS objects (and PhysicalCoordinate instances) created from
+# fits headers are kept in LRU caches, keyed by a hash of the WCS
+# keywords of the header. See wcs_cache_info and clear_wcs_cache. Each
+# call of get_kapteyn_projection returns a new projection wrapping the
+# cached WCS, as projections have settings (set_lon_ref,
+# constant_local_scale, etc.) of their own. The caches of the local
+# scales are kept in an LRU cache as well, keyed by the hash of the
+# header and the settings of the cache.
+
+_wcs_keyword_pattern = re.compile(r"^(NAXIS\d*|WCSAXES[A-Z]?|WCSNAME[A-Z]?|"
+                                  r"CTYPE\d+[A-Z]?|CRPIX\d+[A-Z]?|"
+                                  r"CRVAL\d+[A-Z]?|CDELT\d+[A-Z]?|"
+                                  r"CUNIT\d+[A-Z]?|CROTA\d+|"
+                                  r"CD\d+_\d+[A-Z]?|PC\d+_\d+[A-Z]?|"
+                                  r"PV\d+_\d+[A-Z]?|PS\d+_\d+[A-Z]?|"
+                                  r"LONPOLE[A-Z]?|LATPOLE[A-Z]?|"
+                                  r"EQUINOX[A-Z]?|EPOCH|RADESYS[A-Z]?|RADECSYS|"
+                                  r"MJD-OBS|DATE-OBS|"
+                                  r"A_\w+|B_\w+|AP_\w+|BP_\w+|"
+                                  r"WCSTY\d+[A-Z]?|LTV\d+|LTM\d+_\d+)$")
+
+_wcs_cache = _LRUCache(32)
+_physical_coordinate_cache = _LRUCache(32)
+_local_scale_caches = _LRUCache(32)
+_local_scale_lock = threading.Lock()
+
+
+def wcs_header_key(header):
+    """
+    Returns a hash (a hex string) of the WCS keywords of a fits
+    header, or None if header is not a fits header.
+    """
+    import hashlib
+
+    if hasattr(header, "cards"):
+        cards = header.cards
+    elif hasattr(header, "ascard"):
+        cards = header.ascard
+    else:
+        return None
+
+    wcs_cards = []
+    for c in cards:
+        key = getattr(c, "keyword", None)
+        if key is None:
+            key = getattr(c, "key", "")
+        if _wcs_keyword_pattern.match(key):
+            wcs_cards.append("%s=%r" % (key, c.value))
+
+    s = "\n".join([type(header).__module__, type(header).__name__] + wcs_cards)
+    return hashlib.sha1(s.encode("utf-8")).hexdigest()
+
+
+def _get_cached(cache, cls, header, key):
+    if key is None:
+        return cls(header)
+
+    obj = cache.get(key)
+    if obj is None:
+        obj = cls(header)
+        cache.put(key, obj)
+    return obj
+
+
 def get_kapteyn_projection(header):
     if isinstance(header, ProjectionBase):
         projection = header
     else:
-        projection = ProjectionPywcsNd(header)
+        key = wcs_header_key(header)
+        wcs = _get_cached(_wcs_cache, _pywcs_from_header, header, key)
+        projection = ProjectionPywcsNd(wcs)
+        projection._wcs_key = key
 
     #projection = projection.sub(axes=[1,2])
     return projection
 
 
+def get_physical_coordinate(header):
+    from .physical_coordinate import PhysicalCoordinate
+    return _get_cached(_physical_coordinate_cache, PhysicalCoordinate, header,
+                       wcs_header_key(header))
+
+
+def wcs_cache_info():
+    """
+    Returns the statistics (hits, misses, maxsize, currsize) of the
+    caches of projections (i.e., of their WCS), physical
+    coordinates, and local scales.
+    """
+    return dict(projection=_wcs_cache.info(),
+                physical_coordinate=_physical_coordinate_cache.info(),
+                local_scale=_local_scale_caches.info())
+
+
+def set_wcs_cache_size(maxsize):
+    _wcs_cache.maxsize = maxsize
+    _physical_coordinate_cache.maxsize = maxsize
+    _local_scale_caches.maxsize = maxsize
+
+
+def clear_wcs_cache():
+    _wcs_cache.clear()
+    _physical_coordinate_cache.clear()
+    _local_scale_caches.clear()
+
+
 def estimate_cdelt_trans(transSky2Pix, x0, y0):
 
     transPix2Sky = transSky2Pix.inverted()
@@ -597,29 +781,146 @@ def estimate_angle_trans(transSky2Pix, x0, y0):
     return a1, a2
 
 
-def estimate_cdelt(wcs_proj, x0, y0): #, sky_to_sky):
-    lon0, lat0 = wcs_proj.toworld(([x0], [y0]))
+def _fix_lon_array(lon, lon_ref):
+    # array version of fix_lon
+    lon_ = lon - lon_ref
+    lon2 = lon_ - 360*np.floor_divide(lon_, 360.)
+    lon2 = np.where(lon_ == 360, 360, lon2)
+    return lon2 + lon_ref
+
+
+def _cached_local_scale(wcs_proj, key, x0, y0, func):
+    # returns the values of func (a tuple of arrays) at the positions
+    # (x0, y0), using the local scale cache of wcs_proj. func(idx, x, y)
+    # is called for the indices idx of the positions not in the cache,
+    # with their quantized positions x, y.
+    cache = wcs_proj.get_local_scale_cache()
+
+    if wcs_proj.constant_local_scale:
+        keys = [key] * len(x0)
+        xq, yq = x0, y0
+    else:
+        q = wcs_proj.local_scale_quantum
+        ix, iy = np.round(x0/q), np.round(y0/q)
+        keys = [key + (i, j) for i, j in zip(ix.tolist(), iy.tolist())]
+        xq, yq = ix*q, iy*q
+
+    values = [cache.get(k) for k in keys]
+
+    missing = OrderedDict()
+    for i, (k, v) in enumerate(zip(keys, values)):
+        if v is None and k not in missing:
+            missing[k] = i
+
+    if missing:
+        idx = np.array(list(missing.values()), dtype=int)
+        r = func(idx, xq[idx], yq[idx])
+        computed = {}
+        for j, k in enumerate(missing):
+            computed[k] = tuple(a[j] for a in r)
+            cache.put(k, computed[k])
+        values = [computed[k] if v is None else v
+                  for k, v in zip(keys, values)]
+
+    return tuple(np.array([v[m] for v in values]) for m in range(len(values[0])))
+
+
+def _use_local_scale_cache(wcs_proj):
+    return isinstance(wcs_proj, ProjectionBase) and \
+           (wcs_proj.local_scale_quantum is not None or
+            wcs_proj.constant_local_scale)
+
+
+def estimate_cdelt_array(wcs_proj, x0, y0):
+    """
+    array version of estimate_cdelt. The pixel scales at all the
+    positions (x0, y0) are estimated with a single call of
+    wcs_proj.toworld. See ProjectionBase for the caching of the
+    estimates.
+    """
+    x0, y0 = np.atleast_1d(x0).astype("d"), np.atleast_1d(y0).astype("d")
+
+    if len(x0) and _use_local_scale_cache(wcs_proj):
+        cdelt, = _cached_local_scale(wcs_proj, ("cdelt",), x0, y0,
+                                     lambda idx, x, y: (_estimate_cdelt_array(wcs_proj, x, y),))
+        return cdelt
+
+    return _estimate_cdelt_array(wcs_proj, x0, y0)
+
 
-    if lat0 == 90 or lat0 == -90:
+def _estimate_cdelt_array(wcs_proj, x0, y0):
+    n = len(x0)
+
+    lon, lat = wcs_proj.toworld((np.concatenate([x0, x0+1, x0]),
+                                 np.concatenate([y0, y0, y0+1])))
+    lon, lat = np.asarray(lon), np.asarray(lat)
+    lon0, lat0 = lon[:n], lat[:n]
+
+    if np.any((lat0 == 90) | (lat0 == -90)):
         raise ValueError("estimate_cdelt does not work at poles.")
 
     lon_ref = lon0 - 180.
+    cos_lat0 = np.cos(lat0/180.*np.pi)
 
-    lon1, lat1 = wcs_proj.toworld(([x0+1], [y0]))
-    lon1 = fix_lon(lon1, lon_ref)
-    dlon = (lon1[0]-lon0[0])*np.cos(lat0[0]/180.*np.pi)
-    dlat = (lat1[0]-lat0[0])
+    lon1 = _fix_lon_array(lon[n:2*n], lon_ref)
+    dlon = (lon1-lon0)*cos_lat0
+    dlat = (lat[n:2*n]-lat0)
     cd1 = (dlon**2 + dlat**2)**.5
 
-    lon2, lat2 = wcs_proj.toworld(([x0], [y0+1]))
-    lon2 = fix_lon(lon2, lon_ref)
-    dlon = (lon2[0]-lon0[0])*np.cos(lat0[0]/180.*np.pi)
-    dlat = (lat2[0]-lat0[0])
+    lon2 = _fix_lon_array(lon[2*n:], lon_ref)
+    dlon = (lon2-lon0)*cos_lat0
+    dlat = (lat[2*n:]-lat0)
     cd2 = (dlon**2 + dlat**2)**.5
 
     return ((cd1*cd2)**.5)
 
 
+def estimate_angle_array(wcs_proj, x0, y0, sky_to_sky, cdelt=None):
+    """
+    array version of estimate_angle. Returns a tuple of two arrays.
+    If cdelt (from estimate_cdelt_array) is given, it is not
+    estimated again.
+    """
+    x0, y0 = np.atleast_1d(x0).astype("d"), np.atleast_1d(y0).astype("d")
+    if cdelt is not None:
+        cdelt = np.atleast_1d(cdelt).astype("d")
+
+    if len(x0) and _use_local_scale_cache(wcs_proj):
+        key = ("angle", sky_to_sky.src, sky_to_sky.dest)
+        return _cached_local_scale(wcs_proj, key, x0, y0,
+                                   lambda idx, x, y: _estimate_angle_array(
+                                       wcs_proj, x, y, sky_to_sky,
+                                       None if cdelt is None else cdelt[idx]))
+
+    return _estimate_angle_array(wcs_proj, x0, y0, sky_to_sky, cdelt)
+
+
+def _estimate_angle_array(wcs_proj, x0, y0, sky_to_sky, cdelt=None):
+    n = len(x0)
+
+    if cdelt is None:
+        cdelt = _estimate_cdelt_array(wcs_proj, x0, y0)
+
+    ll = wcs_proj.toworld((x0, y0))
+    lon0, lat0 = sky_to_sky.inverted()(ll[0], ll[1])
+
+    ll = sky_to_sky(np.concatenate([lon0 + cdelt*np.cos(lat0/180.*np.pi),
+                                    lon0]),
+                    np.concatenate([lat0, lat0+cdelt]))
+    x, y = wcs_proj.topixel(ll)
+
+    a1 = np.arctan2(y[:n]-y0, x[:n]-x0)/np.pi*180.
+    a2 = np.arctan2(y[n:]-y0, x[n:]-x0)/np.pi*180.
+
+    return a1, a2
+
+
+def estimate_cdelt(wcs_proj, x0, y0): #, sky_to_sky):
+    # not cached, i.e., always estimated at (x0, y0)
+    return _estimate_cdelt_array(wcs_proj, np.array([x0], dtype="d"),
+                                 np.array([y0], dtype="d"))[0]
+
+
 def estimate_angle(wcs_proj, x0, y0, sky_to_sky=None):
     """
     return a tuple of two angles (in degree) of increasing direction
@@ -629,24 +930,12 @@ def estimate_angle(wcs_proj, x0, y0, sky_to_sky=None):
 
     """
 
-    cdelt = estimate_cdelt(wcs_proj, x0, y0)
-
-    #x0, y0 = wcs_proj.topixel((lon0, lat0))
-    ll = wcs_proj.toworld(([x0], [y0]))
-    lon0, lat0 = sky_to_sky.inverted()(ll[0], ll[1])
-
-    ll = sky_to_sky(lon0 + cdelt*np.cos(lat0/180.*np.pi), lat0)
-    x1, y1 = wcs_proj.topixel(ll)
-    a1 = np.arctan2(y1-y0, x1-x0)/np.pi*180.
-
-    ll = sky_to_sky(lon0, lat0+cdelt)
-    x2, y2 = wcs_proj.topixel(ll)
-    a2 = np.arctan2(y2-y0, x2-x0)/np.pi*180.
+    a1, a2 = _estimate_angle_array(wcs_proj, np.array([x0], dtype="d"),
+                                   np.array([y0], dtype="d"), sky_to_sky)
 
     return a1[0], a2[0]
 
 
-
 if __name__ == "__main__":
     fk5_to_fk4 = sky2sky(FK5, FK4)
     #print fk5_to_fk4([47.37], [6.32])